@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "invoices.metrics.MetricsMiddleware",
+    "invoices.replicas.ReplicaStickinessMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -85,15 +88,60 @@ DATABASES = {
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': 'localhost',
         'PORT': '5432',
+        # Persistent connections, checked before reuse. Under ASGI every
+        # request runs in a fresh thread, so set DB_CONN_MAX_AGE=0 there and
+        # pool with PgBouncer instead.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Optional streaming replica of the primary, read by the read-only views
+# (see invoices.replicas). Never migrated directly; it follows the primary.
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', '5432'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['invoices.replicas.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND is locmem (per process), file (shared by the processes of one
+# host; CACHE_LOCATION is a directory) or redis (shared by every host;
+# CACHE_LOCATION is a redis:// URL, and the redis package is needed).
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+            'redis': 'django.core.cache.backends.redis.RedisCache',
+        }[CACHE_BACKEND],
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', str(BASE_DIR / 'cache') if CACHE_BACKEND == 'file' else ''
+        ),
     }
 }
 
 # Use SQLite for testing to avoid PostgreSQL permission issues
 import sys
 if 'test' in sys.argv:
-    DATABASES['default'] = {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': ':memory:',
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
+        # A separate database standing in for the replica, so tests can tell
+        # which one a query went to
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
     }
 
 
@@ -141,3 +189,65 @@ os.makedirs(STATIC_ROOT, exist_ok=True)
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Invoices app
+
+# Rows per page in invoice_list (keyset paginated)
+INVOICES_PAGE_SIZE = 50
+
+# Blank item rows the invoice create/update forms offer
+INVOICES_ITEM_FORMSET_EXTRA = 3
+
+# Most companies/customers one autocomplete request for the invoice form returns
+INVOICES_AUTOCOMPLETE_LIMIT = 20
+
+# Numbers given to invoices created without one (see invoices.numbering):
+# a str.format() pattern over seq, year, month and company (id), and how many
+# numbers each process reserves at a time
+INVOICES_NUMBER_FORMAT = 'INV-{year}-{seq:06d}'
+INVOICES_NUMBER_BLOCK_SIZE = 20
+
+# JSON API (/api/invoices/): invoices per cursor page, and the most one
+# ids= request may name
+INVOICES_API_PAGE_SIZE = 100
+INVOICES_API_MAX_IDS = 500
+
+# Rendered invoice PDFs, LRU-evicted once the directory passes the size limit
+INVOICES_PDF_CACHE_DIR = BASE_DIR / 'pdf_cache'
+INVOICES_PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Database alias the read-only views read from (None: the primary), and how
+# long a client that just wrote keeps reading from the primary instead
+INVOICES_READ_REPLICA = 'replica' if 'replica' in DATABASES else None
+INVOICES_REPLICA_STICKY_SECONDS = 10
+
+# Cached list rows and detail blocks (see invoices.fragments): the CACHES
+# alias and how long an entry lives
+INVOICES_FRAGMENT_CACHE = 'default'
+INVOICES_FRAGMENT_CACHE_TIMEOUT = 600
+
+# Processes rendering PDFs for bulk exports, shared by all concurrent exports
+# (None: one per core, 0: inline)
+INVOICES_EXPORT_WORKERS = None
+
+# Processes rendering PDFs for the async invoice_pdf view; requests beyond
+# this many wait for a free worker without holding up the event loop
+INVOICES_PDF_RENDER_WORKERS = 2
+
+# Request/PDF metrics served at /metrics. With several worker processes, point
+# INVOICES_METRICS_DIR at a directory they share (emptied on restart) so the
+# view reports all of them; each process writes its totals there at most once
+# per flush interval.
+INVOICES_METRICS_DIR = os.getenv('INVOICES_METRICS_DIR')
+INVOICES_METRICS_FLUSH_INTERVAL = 1.0
+
+# View benchmarks (manage.py benchmark_views): stored baseline. Set
+# INVOICES_BENCHMARK_BUDGET to override keys of invoices.benchmark.DEFAULT_BUDGET,
+# how far a run may drift from it.
+INVOICES_BENCHMARK_BASELINE = BASE_DIR / 'benchmarks' / 'baseline.json'
+
+if 'test' in sys.argv:
+    # Tests opt in to the replica with override_settings
+    INVOICES_READ_REPLICA = None
+    INVOICES_PDF_CACHE_DIR = Path(tempfile.mkdtemp(prefix='invoices-pdf-cache-'))
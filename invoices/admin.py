@@ -1,28 +1,87 @@
-from django.contrib import admin
+from decimal import Decimal
+
+from django.contrib import admin, messages
 from .models import *
+from .pagination import EstimatedCountPaginator
+from .search import filter_invoices
+from . import transitions
 
 # Register your models here.
 
 class InvoiceItemInline(admin.TabularInline):
     model = InvoiceItem
     extra = 1
+    
+    def get_queryset(self, request):
+        # Each row's label is InvoiceItem.__str__, which reads the invoice number
+        return super().get_queryset(request).select_related('invoice')
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
     list_display = ['name', 'email', 'phone']
+    search_fields = ['name', 'email']
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ['name', 'email', 'phone']
     search_fields = ['name', 'email']
 
+def status_action(status, label):
+    """Admin action moving the selected invoices to ``status`` in bulk"""
+    @admin.action(description=f"Mark selected invoices as {label.lower()}")
+    def action(modeladmin, request, queryset):
+        moved, skipped = transitions.transition(queryset, status)
+        modeladmin.message_user(request, f"Marked {moved} invoices as {label.lower()}.")
+        if skipped:
+            modeladmin.message_user(
+                request,
+                f"Skipped {skipped} invoices that can't move to {label.lower()}.",
+                messages.WARNING,
+            )
+    action.__name__ = f'mark_{status}'
+    return action
+
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
+    # total is the stored column, so rows need no per-invoice item queries
     list_display = ['invoice_number', 'customer', 'date_created', 'date_due', 'status', 'total']
-    list_filter = ['status', 'date_created']
+    list_select_related = ['customer']
+    list_filter = ['status']
+    date_hierarchy = 'date_created'
+    ordering = ['-date_created', '-id']
+    # Shows the search box; get_search_results() does the searching
     search_fields = ['invoice_number', 'customer__name']
+    autocomplete_fields = ['company', 'customer']
     inlines = [InvoiceItemInline]
+    actions = [status_action(status, label) for status, label in Invoice.STATUS_CHOICES]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_search_results(self, request, queryset, search_term):
+        # The indexed word-prefix search of invoice_list, rather than an
+        # icontains OR across the customer join
+        if not search_term:
+            return queryset, False
+        queryset, _ = filter_invoices(queryset, search_term)
+        return queryset, False
 
 @admin.register(InvoiceItem)
 class InvoiceItemAdmin(admin.ModelAdmin):
-    list_display = ['description', 'invoice', 'quantity', 'unit_price', 'total']
\ No newline at end of file
+    list_display = ['description', 'invoice', 'quantity', 'unit_price', 'line_total']
+    list_select_related = ['invoice']
+    raw_id_fields = ['invoice']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(line_total=LINE_TOTAL)
+    
+    @admin.display(description='Total', ordering='line_total')
+    def line_total(self, obj):
+        return Decimal(obj.line_total).quantize(Decimal('0.01'))
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'run_after', 'created_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['locked_at', 'result', 'error', 'created_at', 'updated_at']
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""JSON API over the invoices, for integrations that sync many at once.
+
+Responses are plain dicts read straight off the model instances; no forms,
+templates or serializer framework are involved. ``fields`` picks the keys of
+each invoice and only their columns are loaded, customer and company are
+joined in only when asked for, and items are embedded with one
+prefetch_related query per response however many invoices it holds.
+"""
+from django.db.models import Prefetch
+
+from .models import InvoiceItem
+
+# Keys an invoice can have besides its id, in output order
+INVOICE_FIELDS = (
+    'invoice_number', 'company', 'customer', 'date_created', 'date_due', 'status',
+    'notes', 'subtotal', 'discount_amount', 'shipping_amount', 'total', 'updated_at',
+    'items',
+)
+# Embedded company/customer keys besides their id
+RELATED_FIELDS = {
+    'company': ('name', 'email', 'phone', 'address'),
+    'customer': ('name', 'email', 'phone', 'address'),
+}
+ITEM_FIELDS = ('description', 'quantity', 'unit_price')
+# Largest id a bigint primary key can hold
+MAX_ID = 2**63 - 1
+
+
+class InvalidParameter(ValueError):
+    def __init__(self, name, message):
+        super().__init__(message)
+        self.name = name
+
+
+def parse_fields(value):
+    """The invoice keys named in a ``fields=`` parameter, all of them if blank"""
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields:
+        return INVOICE_FIELDS
+    unknown = [field for field in fields if field not in INVOICE_FIELDS]
+    if unknown:
+        raise InvalidParameter('fields', f"Unknown fields: {', '.join(unknown)}.")
+    return tuple(dict.fromkeys(fields))
+
+
+def parse_ids(value, limit):
+    """The invoice ids of an ``ids=`` parameter in request order, None if absent"""
+    if not value:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in value.split(',')))
+    except ValueError:
+        raise InvalidParameter('ids', "Enter a comma-separated list of invoice ids.")
+    if not all(1 <= pk <= MAX_ID for pk in ids):
+        raise InvalidParameter('ids', f"Invoice ids run from 1 to {MAX_ID}.")
+    if len(ids) > limit:
+        raise InvalidParameter('ids', f"Ask for at most {limit} invoices at a time.")
+    return ids
+
+
+def select(invoices, fields, ordering=()):
+    """``invoices`` loading just what serialize() needs for ``fields``.
+
+    The (non-annotated) ``ordering`` columns are loaded too, so a keyset
+    paginator can build its cursors without going back to the database.
+    """
+    annotations = invoices.query.annotations
+    columns = ['id'] + [f.lstrip('-') for f in ordering if f.lstrip('-') not in annotations]
+    related = []
+    for field in fields:
+        if field in RELATED_FIELDS:
+            related.append(field)
+            columns += [f'{field}__{name}' for name in RELATED_FIELDS[field]]
+        elif field != 'items':
+            columns.append(field)
+    invoices = invoices.select_related(None)
+    if related:
+        invoices = invoices.select_related(*related)
+    if 'items' in fields:
+        items = InvoiceItem.objects.only('invoice_id', *ITEM_FIELDS).order_by('id')
+        invoices = invoices.prefetch_related(Prefetch('items', queryset=items))
+    return invoices.only(*columns)
+
+
+def serialize(invoice, fields):
+    """``invoice`` as a JSON-ready dict with its id and ``fields``"""
+    data = {'id': invoice.pk}
+    for field in fields:
+        if field == 'items':
+            data['items'] = [
+                {
+                    'id': item.pk,
+                    'description': item.description,
+                    'quantity': item.quantity,
+                    'unit_price': item.unit_price,
+                    'total': item.total,
+                }
+                for item in invoice.items.all()
+            ]
+        elif field in RELATED_FIELDS:
+            related = getattr(invoice, field)
+            data[field] = {'id': related.pk}
+            for name in RELATED_FIELDS[field]:
+                data[field][name] = getattr(related, name)
+        else:
+            data[field] = getattr(invoice, field)
+    return data
@@ -0,0 +1,73 @@
+"""Name prefix search behind the company and customer selects of the invoice form.
+
+Matches are read from the name indexes on LOWER(name), so a lookup reads
+only the matching index entries however many rows the table holds. That
+needs an ordering in which every name with the prefix sorts together:
+SQLite compares code points, so a range of LOWER(name) will do. Postgres
+collations usually skip punctuation at first, which would scatter "a-b"
+away from "a-", so there the indexes are built on LOWER(name) COLLATE "C"
+(see migration 0015) and the lookup is a LIKE under that collation.
+AutocompleteSelect renders just the selected option; the rest are fetched
+from the autocomplete view as the user types.
+"""
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models.functions import Collate, Lower
+
+
+def limit():
+    return getattr(settings, 'INVOICES_AUTOCOMPLETE_LIMIT', 20)
+
+
+def _upper_bound(prefix):
+    """The smallest string after every string starting with ``prefix``"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def name_prefix(queryset, prefix):
+    """``queryset`` narrowed to names starting with ``prefix`` (any case), by name"""
+    prefix = prefix.strip().lower()
+    if connections[queryset.db].vendor == 'postgresql':
+        queryset = queryset.alias(name_lower=Collate(Lower('name'), 'C'))
+        if prefix:
+            # Postgres reads the LIKE prefix off the index as a range
+            queryset = queryset.filter(name_lower__startswith=prefix)
+        return queryset.order_by('name_lower', 'id')
+
+    queryset = queryset.alias(name_lower=Lower('name'))
+    if prefix:
+        queryset = queryset.filter(
+            name_lower__gte=prefix, name_lower__lt=_upper_bound(prefix)
+        )
+    return queryset.order_by('name_lower', 'id')
+
+
+class AutocompleteSelect(forms.Select):
+    """Select rendering only its selected option, with ``url`` supplying the rest"""
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = str(self.url)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        groups = []
+        field = self.choices.field
+        if field.empty_label is not None:
+            groups.append((None, [self.create_option(name, '', field.empty_label, False, 0)], 0))
+        selected = [v for v in value if v not in (None, '')]
+        try:
+            objs = list(self.choices.queryset.filter(pk__in=selected)) if selected else []
+        except (ValueError, TypeError, ValidationError):
+            # Garbage posted back; the field reports it
+            objs = []
+        for index, obj in enumerate(objs, start=len(groups)):
+            option = self.create_option(name, self.choices.choice(obj)[0], str(obj), True, index)
+            groups.append((None, [option], index))
+        return groups
@@ -0,0 +1,347 @@
+"""Latency and query-count benchmarks for the invoice views.
+
+A scale seeds a deterministic dataset with the generator, then every case is
+requested ``repeat`` times through the test client. Each case reports its
+SQL query count and p50/p95 latency; compare() checks a run against a stored
+baseline so an N+1 or a lost index fails loudly instead of shipping.
+
+The streaming exports and the job endpoints are left out: the former read
+the whole table by design, the latter depend on queue state.
+
+run_concurrency() instead drives the list, detail and PDF views through the real
+WSGI and ASGI handlers with many requests in flight, the way a threaded WSGI
+server and a single-process ASGI server would, and reports throughput.
+"""
+import asyncio
+import json
+import math
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from io import BytesIO
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from . import pdf_cache
+from .generator import generate
+from .models import Invoice
+
+SCALES = {
+    '1k': {'invoices': 1_000, 'companies': 5, 'customers': 200},
+    '100k': {'invoices': 100_000, 'companies': 20, 'customers': 5_000},
+    '1m': {'invoices': 1_000_000, 'companies': 50, 'customers': 20_000},
+}
+SEED = 0
+END_DATE = date(2026, 1, 1)
+
+DEFAULT_BUDGET = {
+    # A case fails when its p95 exceeds the baseline's by this factor...
+    'latency_ratio': 1.5,
+    # ...and by at least this many milliseconds, so sub-millisecond noise passes
+    'latency_slack_ms': 5.0,
+    # Extra queries allowed over the baseline
+    'queries': 0,
+}
+
+
+def budget():
+    return {**DEFAULT_BUDGET, **getattr(settings, 'INVOICES_BENCHMARK_BUDGET', {})}
+
+
+def seed(scale, using='default'):
+    """Generate the dataset for ``scale`` unless it is already there.
+
+    Raises ValueError when the database holds some other dataset, which the
+    generator's numbering would collide with.
+    """
+    spec = SCALES[scale]
+    count = Invoice.objects.using(using).count()
+    if count == spec['invoices']:
+        return False
+    if count:
+        raise ValueError(
+            f"The database holds {count} invoices, not the {spec['invoices']} of "
+            f"the {scale} dataset; start from an empty one"
+        )
+    generate(seed=SEED, items='1-5', end_date=END_DATE, using=using, **spec)
+    return True
+
+
+def cases(using='default'):
+    """``(name, url, before_each)`` for every benchmarked request"""
+    invoices = Invoice.objects.using(using)
+    pk = invoices.order_by('pk').values_list('pk', flat=True)[invoices.count() // 2]
+    sample = invoices.select_related('customer').get(pk=pk)
+    list_url = reverse('invoice_list')
+    by_number = urlencode({'search': sample.invoice_number})
+    by_customer = urlencode({'search': sample.customer.name})
+    return [
+        ('invoice_list', list_url, None),
+        ('invoice_list:status', f'{list_url}?status=paid', None),
+        ('invoice_list:search_number', f'{list_url}?{by_number}', None),
+        ('invoice_list:search_customer', f'{list_url}?{by_customer}', None),
+        ('invoice_detail', reverse('invoice_detail', args=[pk]), None),
+        ('invoice_create', reverse('invoice_create'), None),
+        ('invoice_update', reverse('invoice_update', args=[pk]), None),
+        ('invoice_delete', reverse('invoice_delete', args=[pk]), None),
+        ('invoice_pdf', reverse('invoice_pdf', args=[pk]), None),
+        ('invoice_pdf:uncached', reverse('invoice_pdf', args=[pk]),
+         lambda: pdf_cache.invalidate(pk)),
+    ]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def measure(client, url, repeat, before_each=None, using='default'):
+    timings = []
+    queries = status = None
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        with CaptureQueriesContext(connections[using]) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                # Drain streamed bodies so their queries and time are counted
+                b''.join(response)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(captured)
+        status = response.status_code
+    return {
+        'status': status,
+        'queries': queries,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+    }
+
+
+def run(scale, repeat=20, using='default', progress=None):
+    """Benchmark every case against the current database; returns the results"""
+    client = Client()
+    views = {}
+    with tempfile.TemporaryDirectory() as cache, override_settings(INVOICES_PDF_CACHE_DIR=cache):
+        for name, url, before_each in cases(using):
+            views[name] = measure(client, url, repeat, before_each, using)
+            if progress:
+                progress(name, views[name])
+    return {
+        'scale': scale,
+        'invoices': Invoice.objects.using(using).count(),
+        'repeat': repeat,
+        'vendor': connections[using].vendor,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'views': views,
+    }
+
+
+def concurrency_cases(requests, using='default'):
+    """``(name, urls)`` for the concurrency benchmark, ``requests`` URLs each.
+
+    The PDF case asks for a different invoice every time, so each request
+    renders instead of hitting the cache.
+    """
+    pks = list(Invoice.objects.using(using).order_by('pk').values_list('pk', flat=True)[:requests])
+    middle = pks[len(pks) // 2]
+    return [
+        ('invoice_list', [reverse('invoice_list')] * requests),
+        ('invoice_detail', [reverse('invoice_detail', args=[middle])] * requests),
+        ('invoice_pdf:uncached', [
+            reverse('invoice_pdf', args=[pks[i % len(pks)]]) for i in range(requests)
+        ]),
+    ]
+
+
+def _wsgi_get(handler, url):
+    """GET ``url`` through a WSGI application; returns the status code"""
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    status = []
+    body = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()
+    return int(status[0].split()[0])
+
+
+async def _asgi_get(handler, url):
+    """GET ``url`` through an ASGI application; returns the status code"""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'headers': [(b'host', b'testserver')],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    requested = False
+    status = []
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b''}
+        # The client stays connected until the handler is done with it
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+def _serve_wsgi(urls, concurrency):
+    """Serve ``urls`` from ``concurrency`` threads; returns ``[(status, ms)]``"""
+    handler = WSGIHandler()
+
+    def get(url):
+        started = time.perf_counter()
+        status = _wsgi_get(handler, url)
+        return status, (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(get, urls))
+
+
+def _serve_asgi(urls, concurrency):
+    """Serve ``urls`` on one event loop, ``concurrency`` at a time"""
+    handler = ASGIHandler()
+
+    async def serve():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def get(url):
+            async with slots:
+                started = time.perf_counter()
+                status = await _asgi_get(handler, url)
+                return status, (time.perf_counter() - started) * 1000
+
+        return await asyncio.gather(*(get(url) for url in urls))
+
+    return asyncio.run(serve())
+
+
+SERVERS = {'wsgi': _serve_wsgi, 'asgi': _serve_asgi}
+
+
+def run_concurrency(requests=200, concurrency=16, using='default', progress=None):
+    """Throughput and latency of each server and case under concurrent load"""
+    servers = {}
+    for server, serve in SERVERS.items():
+        results = servers[server] = {}
+        for name, urls in concurrency_cases(requests, using):
+            # Warm up the URL resolver, templates and PDF render pool first
+            with tempfile.TemporaryDirectory() as cache, \
+                    override_settings(INVOICES_PDF_CACHE_DIR=cache):
+                serve(urls[:concurrency], concurrency)
+            with tempfile.TemporaryDirectory() as cache, \
+                    override_settings(INVOICES_PDF_CACHE_DIR=cache):
+                started = time.perf_counter()
+                responses = serve(urls, concurrency)
+                elapsed = time.perf_counter() - started
+            timings = [ms for _, ms in responses]
+            results[name] = {
+                'errors': sum(status != 200 for status, _ in responses),
+                'requests_per_second': round(len(urls) / elapsed, 1),
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+            }
+            if progress:
+                progress(server, name, results[name])
+    return {
+        'invoices': Invoice.objects.using(using).count(),
+        'requests': requests,
+        'concurrency': concurrency,
+        'vendor': connections[using].vendor,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'servers': servers,
+    }
+
+
+def compare(results, baseline, limits=None):
+    """List the budget violations of ``results`` against ``baseline``"""
+    limits = limits or budget()
+    failures = []
+    for name, current in results['views'].items():
+        previous = baseline.get('views', {}).get(name)
+        if previous is None:
+            continue
+        if current['status'] != previous['status']:
+            failures.append(f"{name}: status {current['status']} (baseline {previous['status']})")
+        allowed = previous['queries'] + limits['queries']
+        if current['queries'] > allowed:
+            failures.append(
+                f"{name}: {current['queries']} queries (baseline {previous['queries']})"
+            )
+        allowed = max(
+            previous['p95_ms'] * limits['latency_ratio'],
+            previous['p95_ms'] + limits['latency_slack_ms'],
+        )
+        if current['p95_ms'] > allowed:
+            failures.append(
+                f"{name}: p95 {current['p95_ms']:.1f}ms (baseline {previous['p95_ms']:.1f}ms)"
+            )
+    return failures
+
+
+def load_baseline(path, scale):
+    """The stored baseline for ``scale``, or None"""
+    try:
+        with open(path) as f:
+            return json.load(f).get(scale)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    """Store ``results`` as the baseline for their scale, keeping the others"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(path) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+    baselines[results['scale']] = results
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -0,0 +1,53 @@
+"""Validators for conditional GETs of the HTML invoice pages.
+
+A page's ETag covers the rows it shows (id and versions), the template
+sources and the client's CSRF cookie, which the forms on the page embed, so
+it changes whenever the rendered HTML could. Revalidations are answered from
+one indexed query before anything else is loaded or rendered.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .fragments import template_version
+
+
+def is_conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def etag(request, template_name, rows):
+    parts = [
+        template_version(template_name),
+        template_version('invoices/base.html'),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        *rows,
+    ]
+    return '"%s"' % hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 when the client's copy is current, else None.
+
+    Pages with flash messages waiting are always sent in full, since the
+    client's copy doesn't show them.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    response = get_conditional_response(
+        request, etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    return set_validators(response, etag, last_modified) if response is not None else None
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Cacheable, but only per user and after revalidating
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,289 @@
+import csv
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+from django.utils import timezone
+
+from . import pdf_cache
+from .models import LINE_TOTAL, InvoiceItem
+from .pdf import INVOICE_PDF_TEMPLATE, convert_html, html_to_pdf, observe_render
+
+
+# (column name, ORM path) pairs for the tabular exports
+INVOICE_COLUMNS = [
+    ('id', 'id'),
+    ('invoice_number', 'invoice_number'),
+    ('company', 'company__name'),
+    ('customer', 'customer__name'),
+    ('date_created', 'date_created'),
+    ('date_due', 'date_due'),
+    ('status', 'status'),
+    ('subtotal', 'subtotal'),
+    ('discount_amount', 'discount_amount'),
+    ('shipping_amount', 'shipping_amount'),
+    ('total', 'total'),
+]
+ITEM_COLUMNS = [
+    ('invoice_id', 'invoice_id'),
+    ('invoice_number', 'invoice__invoice_number'),
+    ('id', 'id'),
+    ('description', 'description'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'unit_price'),
+    ('line_total', 'line_total'),
+]
+
+CHUNK_SIZE = 2000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def invoice_rows(invoices):
+    """Tuples of INVOICE_COLUMNS for ``invoices``, streamed in chunks"""
+    paths = [path for _, path in INVOICE_COLUMNS]
+    return invoices.values_list(*paths).iterator(chunk_size=CHUNK_SIZE)
+
+
+def item_rows(invoices):
+    """Tuples of ITEM_COLUMNS for the items of ``invoices``, line totals in SQL"""
+    paths = [path for _, path in ITEM_COLUMNS]
+    items = (
+        InvoiceItem.objects
+        .filter(invoice__in=invoices.values('pk'))
+        .annotate(line_total=LINE_TOTAL)
+        .order_by('invoice_id', 'id')
+        .values_list(*paths)
+    )
+    return items.iterator(chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _batched(lines, size=500):
+    """Join lines into larger chunks so the response isn't written row by row"""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow([name for name, _ in columns])
+        for row in rows:
+            yield writer.writerow(row)
+
+    return _batched(lines())
+
+
+def stream_jsonl(columns, rows):
+    names = [name for name, _ in columns]
+    return _batched(
+        json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n' for row in rows
+    )
+
+
+_DONE = object()
+
+
+async def aiterate(chunks):
+    """Async iterator over the sync iterable ``chunks``, a chunk at a time.
+
+    Each chunk is produced in the ORM's thread, so queries and server-side
+    cursors behave as in a sync view, and only one chunk is held at a time.
+    """
+    chunks = iter(chunks)
+    try:
+        while (chunk := await sync_to_async(next)(chunks, _DONE)) is not _DONE:
+            yield chunk
+    finally:
+        # A client that disconnects early still gets the generator's cleanup
+        if hasattr(chunks, 'close'):
+            await sync_to_async(chunks.close)()
+
+
+def streaming_response(request, chunks, content_type):
+    """A StreamingHttpResponse of ``chunks`` that streams under ASGI too.
+
+    Django buffers a sync iterator completely before an ASGI server sends a
+    byte of it, so requests served over ASGI get an async iterator instead.
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = aiterate(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
+
+
+class _StreamBuffer:
+    """Write-only file object collecting what zipfile writes between yields"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """Yield the bytes of a ZIP archive built from ``(name, data)`` pairs.
+
+    Only the current entry is held in memory; zipfile writes data descriptors
+    because the output can't be seeked.
+    """
+    buffer = _StreamBuffer()
+    date_time = timezone.localtime().timetuple()[:6]
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(zipfile.ZipInfo(name, date_time), data)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def pdf_filename(invoice, taken=None):
+    """ZIP entry name for ``invoice``, made unique against the names in ``taken``"""
+    base = re.sub(r'[^\w.-]', '_', f"Invoice_{invoice.invoice_number}")
+    name = base
+    if taken is not None:
+        # Numbers like INV/1 and INV_1 sanitize to the same name, and the
+        # name with the pk added can be another invoice's too
+        attempt = 1
+        while name + '.pdf' in taken:
+            name = f"{base}_{invoice.pk}" if attempt == 1 else f"{base}_{invoice.pk}_{attempt}"
+            attempt += 1
+    return name + '.pdf'
+
+
+def _spawn_pool(workers):
+    # Spawned, not forked: the server process may have threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _export_workers():
+    return getattr(settings, 'INVOICES_EXPORT_WORKERS', None) or os.cpu_count()
+
+
+def export_executor():
+    """The process pool shared by every bulk export, started on first use.
+
+    INVOICES_EXPORT_WORKERS (default one per core) bounds the processes of all
+    concurrent exports together rather than per export.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = _spawn_pool(_export_workers())
+        return _executor
+
+
+def _discard_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def iter_invoice_pdfs(queryset, workers=None):
+    """Yield ``(filename, pdf_bytes)`` for every invoice in ``queryset``.
+
+    Templates render here, where the ORM is; the xhtml2pdf step runs in worker
+    processes: the shared export_executor() by default, a pool of its own for
+    an explicit ``workers``, or inline for 0 (also INVOICES_EXPORT_WORKERS=0).
+    PDFs are yielded as they finish, with at most two per worker in flight.
+    Cached PDFs are reused. Invoices that fail to render are listed in a
+    trailing ``errors.txt``.
+    """
+    if workers is None and getattr(settings, 'INVOICES_EXPORT_WORKERS', None) == 0:
+        workers = 0
+    template = get_template(INVOICE_PDF_TEMPLATE)
+    invoices = queryset.with_totals().prefetch_related('items').iterator(chunk_size=200)
+    names = set()
+    errors = []
+
+    def finished(name, pdf):
+        if pdf is None:
+            errors.append(name)
+            return []
+        return [(name, pdf)]
+
+    def observed(future):
+        try:
+            pdf, seconds = future.result()
+        except BrokenProcessPool:
+            if pool is not private:
+                # A worker died and took the pool with it; the next export starts a new one
+                _discard_executor(pool)
+            raise
+        observe_render(pdf, seconds)
+        return pdf
+
+    if workers == 0:
+        pool = private = None
+    elif workers is None:
+        pool, private = export_executor(), None
+        workers = _export_workers()
+    else:
+        pool = private = _spawn_pool(workers)
+    pending = {}
+    try:
+        for invoice in invoices:
+            name = pdf_filename(invoice, names)
+            names.add(name)
+            path = pdf_cache.get(invoice.pk, pdf_cache.invoice_digest(invoice))
+            if path is not None:
+                yield name, path.read_bytes()
+                continue
+            html = template.render({'invoice': invoice})
+            if pool is None:
+                yield from finished(name, html_to_pdf(html))
+                continue
+            # Workers only convert; the timing is recorded here, by the
+            # process whose metrics get reported
+            pending[pool.submit(convert_html, html)] = name
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from finished(pending.pop(future), observed(future))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from finished(pending.pop(future), observed(future))
+    finally:
+        # An abandoned download leaves the shared pool to other exports
+        for future in pending:
+            future.cancel()
+        if private is not None:
+            private.shutdown(wait=True, cancel_futures=True)
+
+    if errors:
+        yield 'errors.txt', ('Could not render:\n' + '\n'.join(errors) + '\n').encode()
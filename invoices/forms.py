@@ -1,6 +1,14 @@
 from django import forms
-from django.forms import inlineformset_factory
-from .models import Invoice, InvoiceItem
+from django.conf import settings
+from django.db import transaction
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from django.urls import reverse_lazy
+from .api import MAX_ID
+from .autocomplete import AutocompleteSelect
+from .models import Company, Invoice, InvoiceItem
+from .rollups import GROUPS
+from .search import filter_invoices
+from .signals import deferring_totals
 
 class InvoiceForm(forms.ModelForm):
     class Meta:
@@ -8,19 +16,119 @@ class InvoiceForm(forms.ModelForm):
         fields = ['invoice_number', 'company', 'customer', 'date_due', 
                   'discount_amount', 'shipping_amount', 'status', 'notes']
         widgets = {
+            # Rendering every company/customer as an <option> doesn't scale
+            'company': AutocompleteSelect(reverse_lazy('autocomplete', args=['companies'])),
+            'customer': AutocompleteSelect(reverse_lazy('autocomplete', args=['customers'])),
             'date_due': forms.DateInput(attrs={'type': 'date'}),
             'notes': forms.Textarea(attrs={'rows': 3}),
         }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is None:
+            # Left blank, invoice_create assigns the next number
+            self.fields['invoice_number'].required = False
+            self.fields['invoice_number'].widget.attrs['placeholder'] = 'Next number'
 
 class InvoiceItemForm(forms.ModelForm):
     class Meta:
         model = InvoiceItem
         fields = ['description', 'quantity', 'unit_price']
 
+class BaseInvoiceItemFormSet(BaseInlineFormSet):
+    """Item formset that writes only the changed rows, in bulk.
+    
+    A plain formset saves each changed item on its own, and every item save
+    recalculates the invoice totals through the signals. This one diffs the
+    forms against the stored items, then applies one DELETE, a bulk_create
+    and a bulk_update in a single transaction and recalculates the totals
+    once.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extra = getattr(settings, 'INVOICES_ITEM_FORMSET_EXTRA', 3)
+    
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+        # Fills new_objects/changed_objects/deleted_objects without writing
+        saved = super().save(commit=False)
+        if not (self.new_objects or self.changed_objects or self.deleted_objects):
+            return saved
+        items = InvoiceItem.objects.all()
+        with transaction.atomic():
+            if self.deleted_objects:
+                # The totals are recalculated once below
+                with deferring_totals():
+                    items.filter(pk__in=[item.pk for item in self.deleted_objects]).delete()
+            if self.new_objects:
+                items.bulk_create(self.new_objects)
+            if self.changed_objects:
+                fields = sorted({
+                    name for _, changed in self.changed_objects for name in changed
+                    if name in self.form._meta.fields
+                })
+                items.bulk_update([item for item, _ in self.changed_objects], fields)
+            self.instance.recalculate_totals()
+        return saved
+
 InvoiceItemFormSet = inlineformset_factory(
     Invoice, 
     InvoiceItem, 
     form=InvoiceItemForm,
-    extra=3, 
+    formset=BaseInvoiceItemFormSet,
     can_delete=True
 )
+
+class RevenueReportForm(forms.Form):
+    group = forms.ChoiceField(
+        choices=[(group, group.title()) for group in GROUPS], required=False
+    )
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    status = forms.ChoiceField(
+        choices=[('', 'All Status')] + Invoice.STATUS_CHOICES, required=False
+    )
+    company = forms.ModelChoiceField(
+        queryset=Company.objects.order_by('name'), required=False, empty_label='All Companies'
+    )
+
+class AgingReportForm(forms.Form):
+    as_of = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+class BulkStatusForm(forms.Form):
+    """Target status plus either invoice ids or the invoice_list filters"""
+    to = forms.ChoiceField(choices=Invoice.STATUS_CHOICES)
+    ids = forms.CharField(required=False)
+    search = forms.CharField(required=False)
+    status = forms.ChoiceField(
+        choices=[('', 'All Status')] + Invoice.STATUS_CHOICES, required=False
+    )
+    
+    def clean_ids(self):
+        value = self.cleaned_data['ids']
+        try:
+            ids = [int(pk) for pk in value.split(',') if pk.strip()]
+        except ValueError:
+            raise forms.ValidationError("Enter a comma-separated list of invoice ids.")
+        if not all(1 <= pk <= MAX_ID for pk in ids):
+            raise forms.ValidationError(f"Invoice ids run from 1 to {MAX_ID}.")
+        return ids
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if not any(cleaned_data.get(name) for name in ('ids', 'search', 'status')):
+            # An empty selection would otherwise mean every invoice
+            raise forms.ValidationError("Select invoices by ids, search or status.")
+        return cleaned_data
+    
+    def invoices(self):
+        """The invoices selected by the cleaned form"""
+        invoices = Invoice.objects.all()
+        if self.cleaned_data['ids']:
+            invoices = invoices.filter(pk__in=self.cleaned_data['ids'])
+        invoices, _ = filter_invoices(
+            invoices, self.cleaned_data['search'], self.cleaned_data['status']
+        )
+        return invoices
@@ -0,0 +1,108 @@
+"""Cached template fragments for the invoice list rows and the detail page.
+
+A fragment is cached under the invoice's id and its versions: the
+updated_at of the invoice, its customer and its company. Together they move
+on every change the fragment can show: invoice saves (including item
+changes, which re-save the totals), customer and company edits, and the bulk
+writers (which set updated_at in their UPDATEs). The versions are read in
+the same query as the rest of the row, so a fragment is always stored under
+the version of the data it was rendered from; a change landing between the
+query and the cache write leaves the new version uncached rather than
+caching old markup under it. Anything that writes invoices, customers or
+companies must therefore move their updated_at.
+
+The template's source is part of the key too, so a deploy never serves
+markup from an older template. Entries expire after
+INVOICES_FRAGMENT_CACHE_TIMEOUT seconds.
+
+Views call aprime() to fetch the fragments of a page in one round trip,
+render, then astore() the misses in one more.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+
+from .metrics import registry
+
+
+def cache():
+    return caches[getattr(settings, 'INVOICES_FRAGMENT_CACHE', 'default')]
+
+
+def timeout():
+    return getattr(settings, 'INVOICES_FRAGMENT_CACHE_TIMEOUT', 600)
+
+
+@lru_cache(maxsize=None)
+def template_version(template_name):
+    if template_name is None:
+        return 'inline'
+    source = get_template(template_name).template.source
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def _fragment_key(template_name, name, invoice):
+    version = '/'.join(moment.isoformat() for moment in invoice.versions)
+    return f'invoices:fragment:{name}:{template_version(template_name)}:{invoice.pk}:{version}'
+
+
+def _count(name, outcome, amount=1):
+    if amount:
+        registry.inc('invoices_fragment_cache_requests_total', {
+            'fragment': name, 'outcome': outcome,
+        }, amount)
+
+
+async def aprime(template_name, name, invoices):
+    """Look up fragment ``name`` for every invoice ahead of rendering"""
+    fragment_keys = {invoice.pk: _fragment_key(template_name, name, invoice) for invoice in invoices}
+    found = await cache().aget_many(fragment_keys.values())
+    for invoice in invoices:
+        key = fragment_keys[invoice.pk]
+        if not hasattr(invoice, '_fragments'):
+            invoice._fragments = {}
+        invoice._fragments[name] = {'key': key, 'html': found.get(key), 'stored': key in found}
+    _count(name, 'hit', len(found))
+    _count(name, 'miss', len(fragment_keys) - len(found))
+
+
+def missing(invoice, name):
+    """True when aprime() found no cached fragment ``name`` for ``invoice``"""
+    fragment = getattr(invoice, '_fragments', {}).get(name)
+    return fragment is None or fragment['html'] is None
+
+
+async def astore(invoices, name):
+    """Cache the fragments rendered since aprime()"""
+    fresh = {}
+    for invoice in invoices:
+        fragment = getattr(invoice, '_fragments', {}).get(name)
+        if fragment and fragment['html'] is not None and not fragment['stored']:
+            fresh[fragment['key']] = fragment['html']
+            fragment['stored'] = True
+    if fresh:
+        await cache().aset_many(fresh, timeout=timeout())
+
+
+def render(template_name, name, invoice, render_fragment):
+    """The markup of fragment ``name`` for ``invoice``, from the cache if possible"""
+    fragment = getattr(invoice, '_fragments', {}).get(name)
+    if fragment is not None:
+        if fragment['html'] is None:
+            fragment['html'] = render_fragment()
+        return fragment['html']
+
+    # Not primed: look it up and store it on the spot
+    store = cache()
+    key = _fragment_key(template_name, name, invoice)
+    html = store.get(key)
+    if html is None:
+        _count(name, 'miss')
+        html = render_fragment()
+        store.set(key, html, timeout())
+    else:
+        _count(name, 'hit')
+    return html
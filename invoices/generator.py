@@ -0,0 +1,197 @@
+"""Deterministic synthetic data for benchmarks and load tests.
+
+Every batch of invoices draws from its own RNG seeded with ``(seed, batch)``,
+so the generated content depends only on the parameters, not on how many
+worker processes produced it or in which order the batches finished.
+"""
+import multiprocessing
+import os
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import rollups
+from .importer import write_items
+from .models import Company, Customer, Invoice
+
+WORDS = [
+    'Consulting', 'Design', 'Hosting', 'Support', 'License', 'Training', 'Audit',
+    'Development', 'Maintenance', 'Migration', 'Analytics', 'Storage', 'Shipping',
+    'Hardware', 'Integration', 'Review', 'Research', 'Testing', 'Setup', 'Subscription',
+]
+CITIES = ['Accra', 'Kumasi', 'Lagos', 'Nairobi', 'London', 'Berlin', 'Toronto', 'Austin']
+
+
+def parse_items(spec):
+    """Parse an items-per-invoice spec: ``N``, ``LOW-HIGH`` or ``geometric:MEAN``"""
+    if spec.startswith('geometric:'):
+        mean = float(spec.split(':', 1)[1])
+        if mean < 1:
+            raise ValueError("geometric mean must be at least 1")
+        return ('geometric', mean)
+    low, _, high = spec.partition('-')
+    low, high = int(low), int(high or low)
+    if not 0 <= low <= high:
+        raise ValueError(f"bad items range {spec!r}")
+    return ('uniform', low, high)
+
+
+def parse_status_mix(spec):
+    """Parse ``draft=10,sent=30,...`` into ``(statuses, weights)``"""
+    valid = dict(Invoice.STATUS_CHOICES)
+    statuses, weights = [], []
+    for part in spec.split(','):
+        status, _, weight = part.partition('=')
+        if status not in valid:
+            raise ValueError(f"unknown status {status!r}")
+        statuses.append(status)
+        weights.append(float(weight or 1))
+    if not any(weights):
+        raise ValueError("status weights are all zero")
+    return statuses, weights
+
+
+def _item_count(rng, items):
+    if items[0] == 'geometric':
+        # Geometric on {1, 2, ...} with the requested mean, capped for sanity
+        p = 1 / items[1]
+        count = 1
+        while rng.random() > p and count < 1000:
+            count += 1
+        return count
+    return rng.randint(items[1], items[2])
+
+
+def _contact(rng, model, n, label):
+    city = rng.choice(CITIES)
+    return model(
+        name=f"{label} {n:06d}",
+        address=f"{rng.randint(1, 999)} {rng.choice(WORDS)} Street\n{city}",
+        phone=f"555-{rng.randint(0, 9999):04d}",
+        email=f"{label.lower()}{n}@example.com",
+    )
+
+
+def _create_parties(rng, model, count, label, using, chunk=10000):
+    pks = []
+    for start in range(0, count, chunk):
+        objs = [_contact(rng, model, n, label) for n in range(start, min(start + chunk, count))]
+        model.objects.using(using).bulk_create(objs, batch_size=1000)
+        pks.extend(obj.pk for obj in objs)
+    return pks
+
+
+def generate_batch(params, batch):
+    """Create one batch of invoices and their items; returns ``(invoices, items)``"""
+    rng = random.Random(f"{params['seed']}:{batch}")
+    using = params['using']
+    first = batch * params['batch_size']
+    last = min(first + params['batch_size'], params['invoices'])
+    company_pks, customer_pks = params['company_pks'], params['customer_pks']
+
+    invoices, item_specs = [], []
+    for n in range(first, last):
+        created = params['end_date'] - timedelta(days=rng.randrange(params['days']))
+        items = [
+            (f"{rng.choice(WORDS)} {rng.choice(WORDS).lower()}",
+             rng.randint(1, 20),
+             Decimal(rng.randint(100, 100000)) / 100)
+            for _ in range(_item_count(rng, params['items']))
+        ]
+        discount = Decimal(rng.choice([0, 0, 0, 500, 1000, 2500])) / 100
+        shipping = Decimal(rng.choice([0, 0, 999, 1999])) / 100
+        subtotal = sum((quantity * price for _, quantity, price in items), Decimal('0.00'))
+        invoices.append(Invoice(
+            invoice_number=f"GEN-{params['seed']}-{n:09d}",
+            company_id=company_pks[rng.randrange(len(company_pks))],
+            customer_id=customer_pks[rng.randrange(len(customer_pks))],
+            date_created=created,
+            date_due=created + timedelta(days=rng.choice([15, 30, 45, 60])),
+            status=rng.choices(params['statuses'], params['weights'])[0],
+            discount_amount=discount,
+            shipping_amount=shipping,
+            subtotal=subtotal,
+            total=subtotal - discount + shipping,
+        ))
+        item_specs.append(items)
+
+    with transaction.atomic(using=using):
+        Invoice.objects.using(using).bulk_create(invoices, batch_size=1000)
+        rows = [
+            (invoice.pk, description, quantity, price)
+            for invoice, items in zip(invoices, item_specs)
+            for description, quantity, price in items
+        ]
+        write_items(rows, using=using, batch_size=1000)
+    return len(invoices), len(rows)
+
+
+_worker_params = None
+
+
+def _init_worker(params):
+    global _worker_params
+    _worker_params = params
+
+
+def _worker(batch):
+    return generate_batch(_worker_params, batch)
+
+
+def generate(seed=0, companies=1, customers=1, invoices=1, items='1-5',
+             status_mix='draft=1,sent=3,paid=5,cancelled=1', days=365, end_date=None,
+             batch_size=5000, workers=None, using='default', progress=None):
+    """Generate a dataset; returns ``(invoices, items)`` created.
+
+    Batches are spread over ``workers`` processes when the backend allows
+    concurrent writers (Postgres); SQLite always runs in-process.
+    """
+    statuses, weights = parse_status_mix(status_mix)
+    rng = random.Random(f"{seed}:parties")
+    company_pks = _create_parties(rng, Company, companies, 'Company', using)
+    customer_pks = _create_parties(rng, Customer, customers, 'Customer', using)
+    params = {
+        'seed': seed,
+        'using': using,
+        'invoices': invoices,
+        'batch_size': batch_size,
+        'items': parse_items(items),
+        'statuses': statuses,
+        'weights': weights,
+        'days': max(days, 1),
+        'end_date': end_date or timezone.localdate(),
+        'company_pks': company_pks,
+        'customer_pks': customer_pks,
+    }
+    batches = range(-(-invoices // batch_size))
+
+    connection = connections[using]
+    if workers is None:
+        workers = os.cpu_count() if connection.vendor == 'postgresql' else 1
+    if connection.vendor == 'sqlite' or 'fork' not in multiprocessing.get_all_start_methods():
+        workers = 1
+
+    created = [0, 0]
+
+    def tally(result):
+        created[0] += result[0]
+        created[1] += result[1]
+        if progress:
+            progress(*created)
+
+    if workers > 1 and len(batches) > 1:
+        # Forked children must open their own connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_init_worker, initargs=(params,)) as pool:
+            for result in pool.imap_unordered(_worker, batches):
+                tally(result)
+    else:
+        for batch in batches:
+            tally(generate_batch(params, batch))
+    # Bulk inserts skip the signals that keep the rollups current
+    rollups.rebuild(using=using)
+    return tuple(created)
@@ -0,0 +1,281 @@
+"""Bulk loader for invoices with nested line items.
+
+Records are validated with the model fields' own clean() (so the
+MinValueValidator rules apply) without touching the database, then written a
+chunk at a time. Companies/customers are resolved through in-memory name maps
+and records without an invoice_number are given the next one (see
+invoices.numbering), both committed ahead of the chunk so its rollback can't
+leave stale ids or reissue numbers. Then one transaction per chunk writes the
+invoices via bulk_create and the items via COPY on Postgres or bulk_create
+elsewhere. Stored totals are computed here, because bulk writes skip the
+signals; for the same reason the revenue rollups of every day touched are
+refreshed once the run ends, rather than per chunk.
+"""
+import csv
+import io
+import json
+import time
+from decimal import Decimal
+from itertools import groupby, islice
+
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from . import numbering, rollups
+from .models import Company, Customer, Invoice, InvoiceItem
+
+INVOICE_FIELDS = [
+    'invoice_number', 'date_created', 'date_due', 'status',
+    'discount_amount', 'shipping_amount', 'notes',
+]
+ITEM_FIELDS = ['description', 'quantity', 'unit_price']
+CONTACT_FIELDS = ['address', 'phone', 'email']
+
+
+class RecordError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def read_jsonl(f):
+    """Yield ``(line, record)`` from one JSON invoice per line"""
+    for line, text in enumerate(f, start=1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as e:
+                yield line, RecordError(line, f"invalid JSON ({e})")
+
+
+def read_csv(f):
+    """Yield ``(line, record)`` from one row per item, grouped by invoice.
+
+    Rows of one invoice must be consecutive and share an ``invoice_ref``, or
+    failing that an ``invoice_number``; invoices left to be numbered on import
+    need the ``invoice_ref`` column. Rows with neither are rejected rather
+    than merged. Company and customer contact details are read from
+    ``company_<field>`` / ``customer_<field>`` columns.
+    """
+    def key(row):
+        line, row = row
+        return row.get('invoice_ref') or row.get('invoice_number') or line
+
+    rows = enumerate(csv.DictReader(f), start=2)
+    for _, group in groupby(rows, key=key):
+        group = list(group)
+        line, first = group[0]
+        if not (first.get('invoice_ref') or first.get('invoice_number')):
+            yield line, RecordError(line, "invoice_ref or invoice_number is required.")
+            continue
+        record = {name: first[name] for name in INVOICE_FIELDS if first.get(name)}
+        for party in ('company', 'customer'):
+            record[party] = {'name': first.get(party, '')}
+            for field in CONTACT_FIELDS:
+                record[party][field] = first.get(f'{party}_{field}', '')
+        record['items'] = [
+            {name: row[name] for name in ITEM_FIELDS}
+            for _, row in group if row.get('description')
+        ]
+        yield line, record
+
+
+class InvoiceImporter:
+    def __init__(self, chunk_size=1000, using=DEFAULT_DB_ALIAS, max_errors=100):
+        self.chunk_size = chunk_size
+        self.using = using
+        self.max_errors = max_errors
+        self.companies = {}
+        self.customers = {}
+        self.invoices = 0
+        self.items = 0
+        self.errors = []
+        self.days = set()
+        self.elapsed = 0.0
+
+    @property
+    def skipped(self):
+        return len(self.errors)
+
+    def run(self, records, progress=None):
+        """Import ``(line, record)`` pairs; returns the importer for its stats"""
+        started = time.monotonic()
+        records = iter(records)
+        try:
+            while chunk := list(islice(records, self.chunk_size)):
+                self._import_chunk(chunk)
+                self.elapsed = time.monotonic() - started
+                if progress:
+                    progress(self)
+        finally:
+            # Also covers the chunks committed before an abort
+            rollups.refresh_days(self.days, using=self.using)
+            self.elapsed = time.monotonic() - started
+        return self
+
+    def _error(self, error):
+        self.errors.append(error)
+        if self.max_errors is not None and len(self.errors) >= self.max_errors:
+            raise RecordError(error.line, f"too many errors, last: {error}")
+
+    def _import_chunk(self, chunk):
+        valid = []
+        for line, record in chunk:
+            try:
+                if isinstance(record, RecordError):
+                    raise record
+                valid.append(self._clean(line, record))
+            except RecordError as e:
+                self._error(e)
+        self._drop_duplicates(valid)
+        if not valid:
+            return
+
+        self._resolve(Company, self.companies, [r['company'] for r in valid])
+        self._resolve(Customer, self.customers, [r['customer'] for r in valid])
+        for record in valid:
+            if 'invoice_number' not in record['invoice']:
+                record['invoice']['invoice_number'] = numbering.allocate(
+                    self.companies[record['company']['name']],
+                    record['invoice'].get('date_created'),
+                    using=self.using,
+                )
+
+        with transaction.atomic(using=self.using):
+            invoices = []
+            for record in valid:
+                invoice = Invoice(
+                    company_id=self.companies[record['company']['name']],
+                    customer_id=self.customers[record['customer']['name']],
+                    **record['invoice'],
+                )
+                invoice.subtotal = sum(
+                    (item['quantity'] * item['unit_price'] for item in record['items']),
+                    Decimal('0.00'),
+                )
+                invoice.total = invoice.subtotal - invoice.total_discount + invoice.shipping_cost
+                invoices.append(invoice)
+            Invoice.objects.using(self.using).bulk_create(invoices)
+
+            rows = [
+                (invoice.pk, item['description'], item['quantity'], item['unit_price'])
+                for invoice, record in zip(invoices, valid)
+                for item in record['items']
+            ]
+            write_items(rows, using=self.using, batch_size=self.chunk_size)
+
+        self.days.update(invoice.date_created for invoice in invoices)
+        self.invoices += len(invoices)
+        self.items += len(rows)
+
+    def _clean(self, line, record):
+        """Validate one record with the model fields, without queries"""
+        def clean(model, name, value):
+            field = model._meta.get_field(name)
+            try:
+                return field.clean(value, None)
+            except ValidationError as e:
+                raise RecordError(line, f"{name}: {' '.join(e.messages)}")
+
+        if not isinstance(record, dict):
+            raise RecordError(line, "expected an object")
+        invoice = {
+            name: clean(Invoice, name, record[name])
+            for name in INVOICE_FIELDS if record.get(name) not in (None, '')
+        }
+        if 'date_due' not in invoice:
+            raise RecordError(line, "date_due: This field is required.")
+
+        parties = {}
+        for party, model in (('company', Company), ('customer', Customer)):
+            data = record.get(party)
+            if isinstance(data, str):
+                data = {'name': data}
+            if not isinstance(data, dict) or not data.get('name'):
+                raise RecordError(line, f"{party}: a name is required.")
+            parties[party] = {'name': clean(model, 'name', data['name'])}
+            for field in CONTACT_FIELDS:
+                if data.get(field):
+                    parties[party][field] = clean(model, field, data[field])
+
+        items = record.get('items') or []
+        if not all(isinstance(item, dict) for item in items):
+            raise RecordError(line, "items: expected a list of objects")
+        items = [
+            {name: clean(InvoiceItem, name, item.get(name)) for name in ITEM_FIELDS}
+            for item in items
+        ]
+        return {'line': line, 'invoice': invoice, 'items': items, **parties}
+
+    def _drop_duplicates(self, records):
+        """Reject invoice numbers already stored or repeated within the chunk"""
+        numbers = [r['invoice'].get('invoice_number') for r in records]
+        taken = set(
+            Invoice.objects.using(self.using)
+            .filter(invoice_number__in=numbers)
+            .values_list('invoice_number', flat=True)
+        )
+        kept = []
+        for record in records:
+            number = record['invoice'].get('invoice_number')
+            if number is None:
+                # _import_chunk gives it the next number
+                kept.append(record)
+            elif number in taken:
+                self._error(RecordError(record['line'], f"invoice_number {number!r} already exists"))
+            else:
+                taken.add(number)
+                kept.append(record)
+        records[:] = kept
+
+    def _resolve(self, model, lookup, parties):
+        """Fill ``lookup`` (name -> pk) for ``parties``, creating missing rows"""
+        missing = {p['name']: p for p in parties if p['name'] not in lookup}
+        if not missing:
+            return
+        existing = (
+            model.objects.using(self.using)
+            .filter(name__in=missing)
+            .order_by('-pk')
+            .values_list('name', 'pk')
+        )
+        lookup.update(existing)
+        new = [
+            model(**{**dict.fromkeys(CONTACT_FIELDS, ''), **data})
+            for name, data in missing.items() if name not in lookup
+        ]
+        model.objects.using(self.using).bulk_create(new)
+        lookup.update((obj.name, obj.pk) for obj in new)
+
+
+def write_items(rows, using=DEFAULT_DB_ALIAS, batch_size=1000):
+    """Insert ``(invoice_id, description, quantity, unit_price)`` rows in bulk.
+
+    Uses COPY on Postgres and bulk_create elsewhere. No signals are sent, so
+    callers are responsible for the invoices' stored totals.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        sql = (
+            f"COPY {InvoiceItem._meta.db_table} "
+            "(invoice_id, description, quantity, unit_price) FROM STDIN WITH (FORMAT csv)"
+        )
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):
+                raw.copy_expert(sql, buffer)
+            else:
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+    else:
+        InvoiceItem.objects.using(using).bulk_create(
+            [
+                InvoiceItem(invoice_id=invoice_id, description=description,
+                            quantity=quantity, unit_price=unit_price)
+                for invoice_id, description, quantity, unit_price in rows
+            ],
+            batch_size=batch_size,
+        )
@@ -0,0 +1,164 @@
+"""Database-backed job queue.
+
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED where the backend
+supports it, so any number of them can poll the same table without blocking
+each other. On SQLite, which has no row locks, a claim is a compare-and-set
+UPDATE on the status column instead.
+
+While a job runs, its worker refreshes locked_at from a heartbeat thread;
+requeue_stale() hands jobs whose heartbeat stopped to another worker. A
+worker that is alive but can't reach the database for that long will still
+see its job run twice, so handlers must be safe to repeat.
+"""
+import logging
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the handler for jobs of ``kind``"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload, max_attempts=3):
+    """Queue a job, reusing an identical one that is still queued or running"""
+    if kind not in HANDLERS:
+        raise ValueError(f"No job handler registered for {kind!r}")
+    pending = Job.objects.filter(kind=kind, payload=payload, status__in=['queued', 'running'])
+    job = pending.order_by('pk').first()
+    if job is None:
+        job = Job.objects.create(kind=kind, payload=payload, max_attempts=max_attempts)
+    return job
+
+
+def claim():
+    """Mark the next runnable job as running and return it, or None"""
+    db = router.db_for_write(Job)
+    now = timezone.now()
+    ready = Job.objects.using(db).filter(
+        status='queued', run_after__lte=now
+    ).order_by('run_after', 'pk')
+
+    if connections[db].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=db):
+            job = ready.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status = 'running'
+            job.attempts += 1
+            job.locked_at = now
+            job.save(update_fields=['status', 'attempts', 'locked_at', 'updated_at'])
+            return job
+
+    for pk in ready.values_list('pk', flat=True)[:10]:
+        claimed = Job.objects.using(db).filter(pk=pk, status='queued').update(
+            status='running', attempts=F('attempts') + 1, locked_at=now, updated_at=now
+        )
+        if claimed:
+            return Job.objects.using(db).get(pk=pk)
+    return None
+
+
+class _Heartbeat(threading.Thread):
+    """Refreshes a running job's locked_at every ``interval`` seconds"""
+
+    def __init__(self, job, interval):
+        super().__init__(name=f'job-{job.pk}-heartbeat', daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        db = router.db_for_write(Job)
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    Job.objects.using(db).filter(pk=self.job.pk, status='running').update(
+                        locked_at=timezone.now()
+                    )
+                except DatabaseError:
+                    logger.warning("Heartbeat of job %s failed", self.job, exc_info=True)
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run(job, heartbeat=None):
+    """Execute a claimed job and record its outcome.
+
+    With ``heartbeat``, locked_at is refreshed every that many seconds while
+    the handler runs, so requeue_stale() doesn't take the job away.
+    """
+    beat = _Heartbeat(job, heartbeat) if heartbeat else None
+    if beat is not None:
+        beat.start()
+    try:
+        result = HANDLERS[job.kind](**job.payload)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = timezone.now() + timedelta(seconds=2 ** job.attempts)
+        else:
+            job.status = 'failed'
+        logger.warning("Job %s failed (attempt %s)", job, job.attempts, exc_info=True)
+    else:
+        job.status = 'done'
+        job.result = result
+        job.error = ''
+    finally:
+        if beat is not None:
+            beat.stop()
+    job.locked_at = None
+    job.save(update_fields=['status', 'result', 'error', 'run_after', 'locked_at', 'updated_at'])
+    return job
+
+
+def requeue_stale(timeout):
+    """Recover jobs whose worker has been silent more than ``timeout`` seconds.
+
+    The job is queued again, or failed once it has used up its attempts, so a
+    job that keeps killing its worker isn't retried forever. Returns the
+    number requeued.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=timeout))
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_at=None, updated_at=now,
+        error="The worker stopped responding during the last attempt",
+    )
+    return stale.update(status='queued', locked_at=None, updated_at=now)
+
+
+def work(once=False, poll_interval=1.0, stale_after=600):
+    """Process jobs until stopped; with ``once``, return when the queue is empty"""
+    processed = 0
+    while True:
+        requeue_stale(stale_after)
+        job = claim()
+        if job is not None:
+            # Several beats per stale_after, so one slow UPDATE doesn't lose the job
+            run(job, heartbeat=stale_after / 3)
+            processed += 1
+            continue
+        if once:
+            return processed
+        time.sleep(poll_interval)
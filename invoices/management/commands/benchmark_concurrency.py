@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from invoices import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a test database at the given scale and compare the throughput of "
+        "the invoice views behind the WSGI and the ASGI handler under concurrent load"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=benchmark.SCALES, default='1k')
+        parser.add_argument('--requests', type=int, default=200, help="Requests per view")
+        parser.add_argument(
+            '--concurrency', type=int, default=16,
+            help="Requests in flight at once (WSGI threads / ASGI tasks)",
+        )
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help="Keep the seeded test database, so the next run can skip seeding",
+        )
+
+    def handle(self, *args, scale, requests, concurrency, output, keepdb, **options):
+        verbosity = options['verbosity']
+        setup_test_environment()
+        old_config = setup_databases(verbosity, interactive=False, keepdb=keepdb)
+        try:
+            try:
+                seeded = benchmark.seed(scale)
+            except ValueError as e:
+                raise CommandError(f"{e} (drop --keepdb)")
+            if seeded:
+                self.stdout.write(f"Seeded the {scale} dataset")
+
+            def progress(server, name, result):
+                if verbosity:
+                    self.stdout.write(
+                        f"{server:5} {name:24} {result['requests_per_second']:8.1f} req/s  "
+                        f"p50 {result['p50_ms']:8.1f}ms  p95 {result['p95_ms']:8.1f}ms  "
+                        f"{result['errors']} errors"
+                    )
+
+            results = benchmark.run_concurrency(requests, concurrency, progress=progress)
+        finally:
+            teardown_databases(old_config, verbosity, keepdb=keepdb)
+            teardown_test_environment()
+
+        results['scale'] = scale
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
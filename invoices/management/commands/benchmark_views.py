@@ -0,0 +1,76 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from invoices import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a test database at the given scale, time the invoice views and "
+        "compare the results with the stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=benchmark.SCALES, default='1k')
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per view")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument(
+            '--baseline', default=getattr(settings, 'INVOICES_BENCHMARK_BASELINE', None),
+            help="Baseline JSON file (default: INVOICES_BENCHMARK_BASELINE)",
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help="Store these results as the new baseline instead of comparing",
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help="Keep the seeded test database, so the next run can skip seeding",
+        )
+
+    def handle(self, *args, scale, repeat, output, baseline, save_baseline, keepdb, **options):
+        verbosity = options['verbosity']
+        setup_test_environment()
+        old_config = setup_databases(verbosity, interactive=False, keepdb=keepdb)
+        try:
+            try:
+                seeded = benchmark.seed(scale)
+            except ValueError as e:
+                raise CommandError(f"{e} (drop --keepdb)")
+            if seeded:
+                self.stdout.write(f"Seeded the {scale} dataset")
+
+            def progress(name, result):
+                if verbosity:
+                    self.stdout.write(
+                        f"{name:32} {result['queries']:4} queries  "
+                        f"p50 {result['p50_ms']:8.1f}ms  p95 {result['p95_ms']:8.1f}ms"
+                    )
+
+            results = benchmark.run(scale, repeat=repeat, progress=progress)
+        finally:
+            teardown_databases(old_config, verbosity, keepdb=keepdb)
+            teardown_test_environment()
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+        if not baseline:
+            return
+        if save_baseline:
+            benchmark.save_baseline(baseline, results)
+            self.stdout.write(self.style.SUCCESS(f"Saved the {scale} baseline to {baseline}"))
+            return
+        previous = benchmark.load_baseline(baseline, scale)
+        if previous is None:
+            self.stdout.write(self.style.WARNING(f"No {scale} baseline in {baseline}"))
+            return
+        failures = benchmark.compare(results, previous)
+        if failures:
+            raise CommandError("Benchmark budget exceeded:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Within the benchmark budget"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from invoices import query_plans
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the key invoice queries and fail if one scans or sorts a large table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help="Refresh the planner statistics (ANALYZE) first",
+        )
+
+    def handle(self, *args, analyze, **options):
+        if not Invoice.objects.exists():
+            raise CommandError("No invoices to plan against; run generate_data first")
+        if analyze:
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+        failed = []
+        for name, plan, problems in query_plans.check():
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{name}:\n{plan}\n")
+            if problems:
+                failed.append(f"{name}: {', '.join(sorted(problems))}")
+                self.stdout.write(self.style.ERROR(f"{name}: {', '.join(sorted(problems))}"))
+            else:
+                self.stdout.write(f"{name}: ok")
+        if failed:
+            raise CommandError(f"{len(failed)} queries fell back to a scan or sort")
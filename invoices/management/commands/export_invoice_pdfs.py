@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.exports import iter_invoice_pdfs, stream_zip
+from invoices.models import Invoice
+from invoices.search import filter_invoices
+
+
+class Command(BaseCommand):
+    help = "Write the PDFs of all invoices matching the list filters to a ZIP file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the ZIP file to write")
+        parser.add_argument('--search', default='', help="Same as the invoice list search box")
+        parser.add_argument('--status', default='', help="Only export invoices with this status")
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Rendering processes (default: one per core, 0: render inline)",
+        )
+
+    def handle(self, *args, output, search, status, workers, **options):
+        invoices, ordering = filter_invoices(Invoice.objects.with_totals(), search, status)
+        started = time.monotonic()
+        count = 0
+
+        def counted(entries):
+            nonlocal count
+            for entry in entries:
+                count += 1
+                yield entry
+
+        with open(output, 'wb') as f:
+            entries = iter_invoice_pdfs(invoices.order_by(*ordering), workers=workers)
+            for chunk in stream_zip(counted(entries)):
+                f.write(chunk)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} files to {output} in {elapsed:.1f}s"
+        ))
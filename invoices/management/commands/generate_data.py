@@ -0,0 +1,75 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.generator import generate, parse_items, parse_status_mix
+
+
+class Command(BaseCommand):
+    help = "Generate a reproducible synthetic dataset of companies, customers and invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--companies', type=int, default=1)
+        parser.add_argument('--customers', type=int, default=1)
+        parser.add_argument('--invoices', type=int, default=1)
+        parser.add_argument(
+            '--items', default='1-5',
+            help="Items per invoice: N, LOW-HIGH (uniform) or geometric:MEAN",
+        )
+        parser.add_argument(
+            '--status-mix', default='draft=1,sent=3,paid=5,cancelled=1',
+            help="Relative weights of each status",
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help="Spread date_created over this many days up to --end-date",
+        )
+        parser.add_argument(
+            '--end-date', type=date.fromisoformat, default=None,
+            help="Latest date_created (default: today; fix it for reproducible dates)",
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Writer processes (default: one per core on Postgres, 1 on SQLite)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            parse_items(options['items'])
+            parse_status_mix(options['status_mix'])
+        except ValueError as e:
+            raise CommandError(e)
+        for name in ('companies', 'customers', 'days', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+        if options['invoices'] < 0:
+            raise CommandError("--invoices can't be negative")
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        def progress(invoices, items):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{invoices} invoices, {items} items")
+
+        started = time.monotonic()
+        invoices, items = generate(
+            seed=options['seed'],
+            companies=options['companies'],
+            customers=options['customers'],
+            invoices=options['invoices'],
+            items=options['items'],
+            status_mix=options['status_mix'],
+            days=options['days'],
+            end_date=options['end_date'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            progress=progress,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['companies']} companies, {options['customers']} customers, "
+            f"{invoices} invoices and {items} items in {elapsed:.1f}s"
+        ))
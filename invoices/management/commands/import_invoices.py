@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.importer import InvoiceImporter, RecordError, read_csv, read_jsonl
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+class Command(BaseCommand):
+    help = "Bulk import invoices with nested items from CSV (one row per item) or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import")
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help="Input format (default: from the file extension)",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Invoices written per transaction",
+        )
+        parser.add_argument(
+            '--max-errors', type=int, default=100,
+            help="Abort after this many rejected records",
+        )
+
+    def handle(self, *args, path, format, chunk_size, max_errors, **options):
+        format = format or path.rsplit('.', 1)[-1].lower()
+        if format not in READERS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format")
+
+        importer = InvoiceImporter(chunk_size=chunk_size, max_errors=max_errors)
+
+        def progress(importer):
+            if options['verbosity'] > 1:
+                self.stdout.write(self._rate(importer))
+
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                importer.run(READERS[format](f), progress=progress)
+        except RecordError as e:
+            self._report_errors(importer)
+            raise CommandError(f"Import aborted at {e}")
+
+        self._report_errors(importer)
+        self.stdout.write(self.style.SUCCESS(self._rate(importer)))
+
+    def _rate(self, importer):
+        elapsed = max(importer.elapsed, 1e-9)
+        return (
+            f"Imported {importer.invoices} invoices and {importer.items} items "
+            f"in {importer.elapsed:.1f}s ({importer.invoices / elapsed:.0f} invoices/s, "
+            f"{importer.items / elapsed:.0f} items/s), skipped {importer.skipped}"
+        )
+
+    def _report_errors(self, importer):
+        for error in importer.errors:
+            self.stderr.write(str(error))
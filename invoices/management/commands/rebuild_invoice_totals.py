@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from invoices import rollups
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored Invoice.subtotal/total columns from their items, then the rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of invoices updated per transaction",
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report invoices whose stored totals disagree with their items",
+        )
+
+    def handle(self, *args, batch_size, check, **options):
+        if check:
+            drifted = (
+                Invoice.objects.with_computed_totals()
+                .exclude(subtotal=F('computed_subtotal'), total=F('computed_total'))
+                .values_list('invoice_number', flat=True)
+            )
+            count = 0
+            for invoice_number in drifted.iterator(chunk_size=batch_size):
+                self.stdout.write(invoice_number)
+                count += 1
+            self.stdout.write(f"{count} invoices have stale totals")
+            return
+
+        pks = Invoice.objects.order_by('pk').values_list('pk', flat=True)
+        last_pk = 0
+        rebuilt = 0
+        while True:
+            batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                rebuilt += Invoice.objects.filter(pk__in=batch).rebuild_totals()
+            last_pk = batch[-1]
+        # The UPDATEs bypass the signals that keep the revenue rollups current
+        rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt totals for {rebuilt} invoices"))
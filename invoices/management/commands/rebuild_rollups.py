@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the revenue rollups (day x company x status) from the invoice table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Rollup rows inserted per query",
+        )
+
+    def handle(self, *args, batch_size, **options):
+        started = time.monotonic()
+        created = rollups.rebuild(batch_size=batch_size)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} rollup rows in {elapsed:.1f}s"))
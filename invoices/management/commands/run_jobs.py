@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from invoices import jobs
+
+
+class Command(BaseCommand):
+    help = "Run the background job worker (PDF rendering and other queued work)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once no job is ready instead of polling forever",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=600,
+            help="Requeue running jobs whose worker has been silent this many seconds "
+                 "(workers check in every third of it)",
+        )
+
+    def handle(self, *args, once, poll_interval, stale_after, **options):
+        processed = jobs.work(once=once, poll_interval=poll_interval, stale_after=stale_after)
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs"))
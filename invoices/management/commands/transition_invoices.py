@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices import transitions
+from invoices.models import Invoice
+from invoices.search import filter_invoices
+
+
+class Command(BaseCommand):
+    help = "Move invoices chosen by id or by the list filters to another status in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'to', choices=[status for status, _ in Invoice.STATUS_CHOICES],
+            help="Status to move the invoices to",
+        )
+        parser.add_argument('--ids', default='', help="Comma-separated invoice ids")
+        parser.add_argument('--search', default='', help="Same as the invoice list search box")
+        parser.add_argument('--status', default='', help="Only move invoices with this status")
+        parser.add_argument(
+            '--batch-size', type=int, default=transitions.BATCH_SIZE,
+            help="Number of invoices updated per transaction",
+        )
+
+    def handle(self, *args, to, ids, search, status, batch_size, **options):
+        if not (ids or search or status):
+            raise CommandError("Select invoices with --ids, --search or --status")
+        invoices = Invoice.objects.all()
+        if ids:
+            try:
+                invoices = invoices.filter(pk__in=[int(pk) for pk in ids.split(',') if pk.strip()])
+            except ValueError:
+                raise CommandError("--ids must be a comma-separated list of invoice ids")
+        invoices, _ = filter_invoices(invoices, search, status)
+        moved, skipped = transitions.transition(invoices, to, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} invoices to {to}, skipped {skipped}"))
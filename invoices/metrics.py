@@ -0,0 +1,269 @@
+"""Prometheus-style request and PDF metrics.
+
+Each process aggregates into an in-memory registry. With several WSGI
+workers, set INVOICES_METRICS_DIR to a directory they share: every process
+then writes its totals to ``<pid>.json`` there, at most once per
+INVOICES_METRICS_FLUSH_INTERVAL seconds, and the /metrics view sums all
+the files. Only counters and histograms are kept, so summing is exact. The
+directory should be emptied when the server restarts.
+"""
+import atexit
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'invoices_http_requests_total': (
+        'counter', "Requests served, by view, method and status", None),
+    'invoices_http_request_duration_seconds': (
+        'histogram', "Time spent producing the response", LATENCY_BUCKETS),
+    'invoices_http_db_queries': (
+        'histogram', "SQL queries run per request", QUERY_BUCKETS),
+    'invoices_http_db_duration_seconds': (
+        'histogram', "Time spent in SQL per request", LATENCY_BUCKETS),
+    'invoices_http_response_size_bytes': (
+        'histogram', "Response body size, when known up front", SIZE_BUCKETS),
+    'invoices_pdf_render_duration_seconds': (
+        'histogram', "Time spent converting invoice HTML to PDF", LATENCY_BUCKETS),
+    'invoices_fragment_cache_requests_total': (
+        'counter', "Cached template fragment lookups, by fragment and hit/miss", None),
+}
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.last_flush = 0.0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.maybe_flush()
+
+    def observe(self, name, labels, value):
+        """Record ``value`` in a histogram: per-bucket counts, then sum and count"""
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(buckets) + 3)
+            series[bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in self.values.items()
+            }
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'INVOICES_METRICS_FLUSH_INTERVAL', 1.0)
+        if time.monotonic() - self.last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's totals to the shared directory, if configured"""
+        self.last_flush = time.monotonic()
+        if not self.values:
+            # Processes that record nothing, like the PDF render workers,
+            # leave no file behind
+            return
+        directory = metrics_dir()
+        if directory is None:
+            return
+        data = [[name, labels, value] for (name, labels), value in self.snapshot().items()]
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, directory / f'{os.getpid()}.json')
+
+    def reset(self):
+        """Start empty; a forked child would otherwise report its parent's totals too"""
+        self.lock = threading.Lock()
+        self.values = {}
+        self.last_flush = 0.0
+
+
+registry = Registry()
+atexit.register(registry.flush)
+os.register_at_fork(after_in_child=registry.reset)
+
+
+def metrics_dir():
+    directory = getattr(settings, 'INVOICES_METRICS_DIR', None)
+    if directory is None:
+        return None
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def collect():
+    """Totals summed over every process sharing INVOICES_METRICS_DIR"""
+    directory = metrics_dir()
+    if directory is None:
+        return registry.snapshot()
+    registry.flush()
+    totals = {}
+    for path in directory.glob('*.json'):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Replaced or removed while we were reading it
+            continue
+        for name, labels, value in data:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if isinstance(value, list):
+                current = totals.setdefault(key, [0] * len(value))
+                totals[key] = [a + b for a, b in zip(current, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def exposition(totals=None):
+    """Render ``totals`` in the Prometheus text format"""
+    totals = collect() if totals is None else totals
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((key, value) for key, value in totals.items() if key[0] == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (_, labels), value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value[:-2]):
+                cumulative += count
+                bucket_labels = _format_labels((*labels, ('le', bound)))
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryTimer:
+    """Queries of one request and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# The timer of the request being handled. Async requests share the ORM's one
+# thread and its connections, so per-request execute_wrappers would stack up;
+# instead one wrapper stays on each connection and adds to whichever timer
+# the query's context carries (sync_to_async copies it into that thread).
+_current_timer = contextvars.ContextVar('invoices_query_timer', default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.seconds += time.perf_counter() - started
+        timer.count += 1
+
+
+def _watch_queries():
+    for connection in connections.all():
+        if _time_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_time_query)
+
+
+class MetricsMiddleware:
+    """Record latency, SQL and response size per URL name.
+
+    Works in both the sync (WSGI) and async (ASGI) handler, so async views
+    aren't pushed into a thread just for this middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        _watch_queries()
+        token = _current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        self._record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        # Connections belong to the thread the ORM runs queries in, not to
+        # the event loop, so the wrapper is installed from that thread
+        await sync_to_async(_watch_queries)()
+        token = _current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        self._record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def _record(self, request, response, elapsed, timer):
+        match = request.resolver_match
+        view = {'view': match.view_name if match else '<unresolved>'}
+        registry.inc('invoices_http_requests_total', {
+            **view, 'method': request.method, 'status': response.status_code,
+        })
+        registry.observe('invoices_http_request_duration_seconds', view, elapsed)
+        registry.observe('invoices_http_db_queries', view, timer.count)
+        registry.observe('invoices_http_db_duration_seconds', view, timer.seconds)
+        if response.has_header('Content-Length'):
+            size = int(response['Content-Length'])
+        elif not response.streaming:
+            size = len(response.content)
+        else:
+            size = None
+        if size is not None:
+            registry.observe('invoices_http_response_size_bytes', view, size)
@@ -0,0 +1,54 @@
+# Generated by Django 6.0.1 on 2026-10-16 20:26
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_totals(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+    InvoiceItem = apps.get_model("invoices", "InvoiceItem")
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    item_subtotal = (
+        InvoiceItem.objects.filter(invoice=OuterRef("pk"))
+        .values("invoice")
+        .annotate(
+            subtotal=Sum(
+                ExpressionWrapper(F("quantity") * F("unit_price"), output_field=money)
+            )
+        )
+        .values("subtotal")
+    )
+    Invoice.objects.update(
+        subtotal=Coalesce(Subquery(item_subtotal), Decimal("0.00"), output_field=money)
+    )
+    Invoice.objects.update(
+        total=F("subtotal") - F("discount_amount") + F("shipping_amount")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0002_alter_invoiceitem_description"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="subtotal",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="total",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+SQLITE_FTS_TABLE_SQL = """CREATE VIRTUAL TABLE IF NOT EXISTS invoices_invoice_fts
+    USING fts5(invoice_number, customer_name)"""
+
+# invoices.search matches UPPER(col::text) against a regex, which pg_trgm can
+# answer from a trigram index, so the indexes are built on that exact
+# expression.
+POSTGRES_TRGM_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS invoices_invoice_number_trgm
+        ON invoices_invoice USING gin ((UPPER(invoice_number::text)) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS invoices_customer_name_trgm
+        ON invoices_customer USING gin ((UPPER(name::text)) gin_trgm_ops)""",
+]
+
+
+def forwards(apps, schema_editor):
+    # The SQLite triggers, and the first fill of the FTS table, come from the
+    # post_migrate hook in invoices.signals
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_FTS_TABLE_SQL)
+    elif vendor == 'postgresql':
+        for sql in POSTGRES_TRGM_SQL:
+            schema_editor.execute(sql)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au', 'customer_au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS invoices_invoice_fts_{suffix}")
+        schema_editor.execute("DROP TABLE IF EXISTS invoices_invoice_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS invoices_invoice_number_trgm")
+        schema_editor.execute("DROP INDEX IF EXISTS invoices_customer_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0003_invoice_stored_totals"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
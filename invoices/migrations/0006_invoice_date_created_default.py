@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-16 20:33
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0005_job"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="invoice",
+            name="date_created",
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+    ]
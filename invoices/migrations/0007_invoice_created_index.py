@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-16 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0006_invoice_date_created_default"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["date_created", "id"], name="invoices_inv_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 6.0.1 on 2026-10-16 20:42
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_rollups(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+    RevenueRollup = apps.get_model("invoices", "RevenueRollup")
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    buckets = (
+        Invoice.objects.order_by()
+        .values("date_created", "company_id", "status")
+        .annotate(
+            invoice_count=Count("pk"),
+            subtotal_sum=Coalesce(Sum("subtotal"), Decimal("0"), output_field=money),
+            discount_sum=Coalesce(Sum("discount_amount"), Decimal("0"), output_field=money),
+            shipping_sum=Coalesce(Sum("shipping_amount"), Decimal("0"), output_field=money),
+            total_sum=Coalesce(Sum("total"), Decimal("0"), output_field=money),
+        )
+    )
+    RevenueRollup.objects.bulk_create(
+        (
+            RevenueRollup(
+                day=bucket["date_created"],
+                company_id=bucket["company_id"],
+                status=bucket["status"],
+                invoice_count=bucket["invoice_count"],
+                subtotal=bucket["subtotal_sum"],
+                discount=bucket["discount_sum"],
+                shipping=bucket["shipping_sum"],
+                total=bucket["total_sum"],
+            )
+            for bucket in buckets.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0007_invoice_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevenueRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("draft", "Draft"),
+                            ("sent", "Sent"),
+                            ("paid", "Paid"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("invoice_count", models.PositiveIntegerField(default=0)),
+                (
+                    "subtotal",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "discount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "shipping",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="invoices.company",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("day", "company", "status"),
+                        name="invoices_rollup_bucket_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-16 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0008_revenuerollup"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                condition=models.Q(("status", "sent")),
+                fields=["customer", "date_due", "total"],
+                name="invoices_inv_open_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-16 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0009_invoice_open_due_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["status", "date_created", "id"], name="invoices_inv_status_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-16 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0010_invoice_status_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-16 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0011_invoice_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoiceNumberSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scope", models.CharField(max_length=200, unique=True)),
+                ("next_value", models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+    ]
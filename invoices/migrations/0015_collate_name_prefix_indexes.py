@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# index name -> table of the LOWER(name) indexes added in 0013
+NAME_INDEXES = {
+    'invoices_company_name_idx': 'invoices_company',
+    'invoices_customer_name_idx': 'invoices_customer',
+}
+
+
+def _rebuild(schema_editor, key):
+    # Postgres only: SQLite already compares code points
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in NAME_INDEXES.items():
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+        schema_editor.execute(f"CREATE INDEX {name} ON {table} ({key}, id)")
+
+
+def forwards(apps, schema_editor):
+    _rebuild(schema_editor, '(LOWER(name) COLLATE "C")')
+
+
+def backwards(apps, schema_editor):
+    _rebuild(schema_editor, 'LOWER(name)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0014_party_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Lower
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+from datetime import date
 from decimal import Decimal
 
 # Create your models here.
@@ -11,9 +15,16 @@ class Company(models.Model):
     address = models.TextField()
     phone = models.CharField(max_length=20)
     email = models.EmailField()
+    # Part of the version of its invoices' pages (see Invoice.versions)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = "Companies"
+        indexes = [
+            # Name prefix search for the invoice form's autocomplete; built
+            # with COLLATE "C" on Postgres (see invoices.autocomplete)
+            models.Index(Lower('name'), F('id'), name='invoices_company_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -23,10 +34,75 @@ class Customer(models.Model):
     email = models.EmailField()
     phone = models.CharField(max_length=20)
     address = models.TextField()
+    # Part of the version of its invoices' pages (see Invoice.versions)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Name prefix search for the invoice form's autocomplete; built
+            # with COLLATE "C" on Postgres (see invoices.autocomplete)
+            models.Index(Lower('name'), F('id'), name='invoices_customer_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
+# quantity * unit_price for a single InvoiceItem row, evaluated in SQL
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('unit_price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2)
+)
+
+# The columns behind Invoice.versions, for queries loading only those
+VERSION_FIELDS = ['updated_at', 'customer__updated_at', 'company__updated_at']
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Everything a list row needs (customer, company, totals) in one query.
+
+        subtotal/total are stored columns, so no join against the items is
+        needed; use with_computed_totals() to derive them from the items.
+        """
+        return self.select_related('customer', 'company')
+    
+    def with_computed_totals(self):
+        """Annotate computed_subtotal/computed_total summed from the items in SQL"""
+        money = DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            computed_subtotal=Coalesce(
+                Sum(F('items__quantity') * F('items__unit_price'), output_field=money),
+                Decimal('0.00'),
+                output_field=money
+            ),
+        ).annotate(
+            computed_total=ExpressionWrapper(
+                F('computed_subtotal') - F('discount_amount') + F('shipping_amount'),
+                output_field=money
+            ),
+        )
+    
+    def rebuild_totals(self):
+        """Recompute the stored subtotal/total columns from the items in SQL"""
+        item_subtotal = (
+            InvoiceItem.objects
+            .filter(invoice=OuterRef('pk'))
+            .values('invoice')
+            .annotate(subtotal=Sum(LINE_TOTAL))
+            .values('subtotal')
+        )
+        updated = self.update(subtotal=Coalesce(
+            Subquery(item_subtotal), Decimal('0.00'),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ))
+        # update() skips auto_now, so updated_at is set by hand
+        self.update(
+            total=F('subtotal') - F('discount_amount') + F('shipping_amount'),
+            updated_at=timezone.now(),
+        )
+        return updated
+
+
 class Invoice(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -38,17 +114,54 @@ class Invoice(models.Model):
     invoice_number = models.CharField(max_length=50, unique=True)
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
-    date_created = models.DateField(auto_now_add=True)
+    # Defaults to today like auto_now_add did, but bulk loads may supply a date
+    date_created = models.DateField(default=date.today, editable=False)
     date_due = models.DateField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     notes = models.TextField(blank=True)
     
+    objects = InvoiceQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # invoice_list and the admin changelist: newest first, keyset
+            # pages, date hierarchy ranges
+            models.Index(fields=['date_created', 'id'], name='invoices_inv_created_idx'),
+            # The same ordering filtered by status (list filter, admin filter)
+            models.Index(fields=['status', 'date_created', 'id'], name='invoices_inv_status_idx'),
+            # Covers the aging report, which only reads open invoices
+            models.Index(
+                fields=['customer', 'date_due', 'total'],
+                condition=models.Q(status='sent'),
+                name='invoices_inv_open_due_idx',
+            ),
+        ]
+    
     def __str__(self):
         return f"Invoice {self.invoice_number}"
     
+    def save(self, *args, **kwargs):
+        self.total = self.subtotal - self.total_discount + self.shipping_cost
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'total', 'updated_at'}
+        super().save(*args, **kwargs)
+    
     @property
-    def subtotal(self):
-        return sum(item.total for item in self.items.all())
+    def versions(self):
+        """updated_at of the invoice, its customer and its company.
+
+        Together they change whenever anything the invoice pages show does.
+        Load the invoice with with_totals() so this doesn't query.
+        """
+        return (self.updated_at, self.customer.updated_at, self.company.updated_at)
+    
+    def recalculate_totals(self):
+        """Refresh the stored subtotal/total after the items changed"""
+        self.subtotal = self.items.aggregate(
+            subtotal=Coalesce(Sum(LINE_TOTAL), Decimal('0.00'))
+        )['subtotal']
+        self.save(update_fields=['subtotal', 'total'])
     
     @property
     def total_discount(self):
@@ -58,10 +171,6 @@ class Invoice(models.Model):
     def shipping_cost(self):
         return self.shipping_amount or Decimal('0.00')
     
-    @property
-    def total(self):
-        return self.subtotal - self.total_discount + self.shipping_cost
-    
     discount_amount = models.DecimalField(
         max_digits=10, 
         decimal_places=2, 
@@ -74,6 +183,12 @@ class Invoice(models.Model):
         default=0,
         validators=[MinValueValidator(Decimal('0.00'))]
     )
+    # Stored copies of the item sums, kept current by recalculate_totals()
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    # Last change to the invoice or its items, which re-save the totals;
+    # customer and company edits move their own updated_at (see versions)
+    updated_at = models.DateTimeField(auto_now=True)
 
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(Invoice, related_name='items', on_delete=models.CASCADE)
@@ -90,4 +205,65 @@ class InvoiceItem(models.Model):
     
     @property
     def total(self):
-        return self.quantity * self.unit_price
\ No newline at end of file
+        return self.quantity * self.unit_price
+
+
+class InvoiceNumberSequence(models.Model):
+    """Next unreserved invoice number per scope, handed out in blocks by invoices.numbering"""
+    scope = models.CharField(max_length=200, unique=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+    
+    def __str__(self):
+        return f"{self.scope} (next {self.next_value})"
+
+
+class RevenueRollup(models.Model):
+    """Invoice totals per day, company and status, kept current by invoices.rollups"""
+    day = models.DateField()
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    invoice_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    shipping = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'company', 'status'], name='invoices_rollup_bucket_uniq'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.company_id} {self.status}"
+
+
+class Job(models.Model):
+    """A unit of background work claimed by the run_jobs worker"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='invoices_job_claim_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
@@ -0,0 +1,100 @@
+"""Invoice numbers from per-scope sequences, reserved a block at a time.
+
+INVOICES_NUMBER_FORMAT is a str.format() pattern over ``seq`` (the sequence
+number), ``year``, ``month`` and ``company`` (the company's id). Everything
+but ``seq`` makes up the scope, so ``INV-{year}-{seq:06d}`` numbers each year
+from 1 and ``{company}/{year}/{seq}`` each company's year.
+
+Each process takes INVOICES_NUMBER_BLOCK_SIZE numbers of a scope at once,
+with one short UPDATE of its InvoiceNumberSequence row, and hands them out
+from memory until they run out. Concurrent writers therefore never wait on
+each other per invoice and can't be given the same number. Numbers reserved
+by a process that exits unused are skipped, so the sequence has gaps but
+never repeats; numbers typed in by hand are skipped when a block is taken.
+"""
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Invoice, InvoiceNumberSequence
+
+
+def number_format():
+    return getattr(settings, 'INVOICES_NUMBER_FORMAT', 'INV-{year}-{seq:06d}')
+
+
+def block_size():
+    return getattr(settings, 'INVOICES_NUMBER_BLOCK_SIZE', 20)
+
+
+class _Seq:
+    """Renders as ``{seq}`` in place of the number, leaving a format's scope"""
+
+    def __format__(self, spec):
+        return '{seq}'
+
+
+class Allocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._pid = os.getpid()
+
+    def allocate(self, company_id=None, day=None, using=DEFAULT_DB_ALIAS):
+        """The next free invoice number for ``company_id`` on ``day`` (today).
+
+        Taking a new block commits on its own, so it must not happen inside
+        an atomic block: one that rolled back would put numbers already
+        handed out back into the sequence. Allocate before opening one.
+        """
+        day = day or timezone.localdate()
+        fields = {'year': day.year, 'month': day.month, 'company': company_id}
+        pattern = number_format()
+        scope = pattern.format(seq=_Seq(), **fields)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent may hand out the same blocks
+                self._blocks = {}
+                self._pid = os.getpid()
+            numbers = self._blocks.setdefault((using, scope), deque())
+            while not numbers:
+                numbers.extend(self._reserve(pattern, scope, fields, using))
+            return numbers.popleft()
+
+    def discard(self):
+        """Forget the reserved blocks; their unused numbers are skipped"""
+        with self._lock:
+            self._blocks = {}
+
+    def _reserve(self, pattern, scope, fields, using):
+        """Take the next block of ``scope``; returns its numbers not taken by hand"""
+        size = block_size()
+        sequences = InvoiceNumberSequence.objects.using(using)
+        with transaction.atomic(using=using, durable=True):
+            sequences.get_or_create(scope=scope)
+            sequences.filter(scope=scope).update(next_value=F('next_value') + size)
+            end = sequences.filter(scope=scope).values_list('next_value', flat=True).get()
+        candidates = [pattern.format(seq=seq, **fields) for seq in range(end - size, end)]
+        taken = set(
+            Invoice.objects.using(using)
+            .filter(invoice_number__in=candidates)
+            .values_list('invoice_number', flat=True)
+        )
+        return [number for number in candidates if number not in taken]
+
+
+_allocator = Allocator()
+
+
+def allocate(company_id=None, day=None, using=DEFAULT_DB_ALIAS):
+    """The next invoice number from this process's allocator; see Allocator.allocate()"""
+    return _allocator.allocate(company_id, day, using)
+
+
+def discard():
+    _allocator.discard()
@@ -0,0 +1,195 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    """Paginate a queryset by the values of its ordering columns instead of OFFSET.
+
+    ``ordering`` must end in a unique column (normally ``-id``) so every row has
+    a distinct position. Each page costs one ``LIMIT per_page + 1`` query no
+    matter how deep it is, and no COUNT(*) is ever issued.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        direction, ordering, values = self._query(cursor)
+        return self._page(direction, list(self.window(ordering, values)))
+
+    async def apage(self, cursor=None, fields=None):
+        """page() for async views, fetching the rows with the async ORM.
+
+        ``fields`` limits the columns loaded (to those plus the ordering), for
+        callers that only need to know which rows the page holds.
+        """
+        direction, ordering, values = self._query(cursor)
+        window = self.window(ordering, values)
+        if fields is not None:
+            annotations = self.queryset.query.annotations
+            names = [f.lstrip('-') for f in ordering if f.lstrip('-') not in annotations]
+            window = window.select_related(None).only(*fields, *names)
+            related = {field.split('__')[0] for field in fields if '__' in field}
+            if related:
+                window = window.select_related(*related)
+        rows = [row async for row in window]
+        return self._page(direction, rows)
+
+    def _query(self, cursor):
+        """``(direction, ordering, values)`` of the window ``cursor`` points at"""
+        if not cursor:
+            return None, self.ordering, None
+        direction, values = self._decode(cursor)
+        if direction == 'n':
+            return direction, self.ordering, values
+        return direction, self._reversed(self.ordering), values
+
+    def _page(self, direction, rows):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction is None:
+            return KeysetPage(
+                rows,
+                next_cursor=self._cursor('n', rows[-1]) if has_more else None,
+            )
+        if direction == 'p':
+            rows = rows[::-1]
+        if not rows:
+            return KeysetPage(rows)
+        if direction == 'n':
+            return KeysetPage(
+                rows,
+                next_cursor=self._cursor('n', rows[-1]) if has_more else None,
+                prev_cursor=self._cursor('p', rows[0]),
+            )
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor('n', rows[-1]),
+            prev_cursor=self._cursor('p', rows[0]) if has_more else None,
+        )
+
+    def window(self, ordering=None, values=None):
+        """The query for one page: ``per_page + 1`` rows sorting after ``values``"""
+        ordering = ordering or self.ordering
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values))
+        return queryset[:self.per_page + 1]
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(f[1:] if f.startswith('-') else f'-{f}' for f in ordering)
+
+    @staticmethod
+    def _after(ordering, values):
+        """WHERE clause selecting the rows that sort after ``values``"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _cursor(self, direction, row):
+        values = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps([direction, values], cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def _decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded))
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        if (direction not in ('n', 'p') or not isinstance(values, list)
+                or len(values) != len(self.ordering)):
+            raise InvalidCursor(cursor)
+        try:
+            return direction, [
+                self._output_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+
+    def _output_field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+
+def estimated_count(queryset):
+    """The planner's row estimate for ``queryset`` on Postgres, None elsewhere.
+
+    An unfiltered queryset reads pg_class.reltuples (kept current by
+    autovacuum); a filtered one asks EXPLAIN, which costs no table scan.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where and not queryset.query.distinct:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # -1 until the table has been vacuumed or analyzed
+        return row[0] if row and row[0] >= 0 else None
+    plan = json.loads(queryset.explain(format='json'))
+    if isinstance(plan, list):
+        plan = plan[0]
+    return int(plan['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that trusts the planner's estimate for large result sets.
+
+    Estimates under ``threshold`` are replaced by an exact COUNT, so small
+    tables and selective filters still show exact figures.
+    """
+    threshold = 100_000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= self.threshold:
+            return estimate
+        return super().count
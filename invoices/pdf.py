@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from django.conf import settings
+from django.template.loader import get_template
+from xhtml2pdf import pisa
+
+from .metrics import registry
+
+INVOICE_PDF_TEMPLATE = 'invoices/invoice_pdf.html'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def convert_html(html):
+    """xhtml2pdf over ``html``; returns ``(PDF bytes or None, seconds taken)``.
+
+    Records nothing, so it can run in worker processes whose metrics aren't
+    reported; the caller passes the result to observe_render().
+    """
+    started = time.perf_counter()
+    result = BytesIO()
+    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result)
+    return (None if pdf.err else result.getvalue()), time.perf_counter() - started
+
+
+def observe_render(pdf, seconds):
+    """Record a convert_html() outcome in the PDF render histogram"""
+    outcome = 'error' if pdf is None else 'ok'
+    registry.observe('invoices_pdf_render_duration_seconds', {'outcome': outcome}, seconds)
+
+
+def html_to_pdf(html):
+    """Run the xhtml2pdf pipeline over ``html``; returns the PDF bytes or None"""
+    pdf, seconds = convert_html(html)
+    observe_render(pdf, seconds)
+    return pdf
+
+
+def render_pdf(template_src, context_dict):
+    """Render a template to PDF bytes, or None if xhtml2pdf reported an error"""
+    html = get_template(template_src).render(context_dict)
+    return html_to_pdf(html)
+
+
+def render_executor():
+    """The process pool behind ahtml_to_pdf(), started on first use.
+
+    xhtml2pdf is pure Python, so a thread would still hold the GIL the event
+    loop needs; separate processes keep the loop serving other requests, and
+    INVOICES_PDF_RENDER_WORKERS bounds how many renders run at once. Workers
+    are spawned rather than forked, as the server process may have threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'INVOICES_PDF_RENDER_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _discard_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+async def ahtml_to_pdf(html):
+    """html_to_pdf() for async views: the render runs in the render pool"""
+    executor = render_executor()
+    try:
+        pdf, seconds = await asyncio.get_running_loop().run_in_executor(executor, convert_html, html)
+    except BrokenProcessPool:
+        # A worker died and took the pool with it; the next render starts a new one
+        _discard_executor(executor)
+        raise
+    observe_render(pdf, seconds)
+    return pdf
+
+
+async def arender_pdf(template_src, context_dict):
+    """render_pdf() for async views. The context must not need any more queries."""
+    html = get_template(template_src).render(context_dict)
+    return await ahtml_to_pdf(html)
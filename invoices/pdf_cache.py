@@ -0,0 +1,141 @@
+"""On-disk cache of rendered invoice PDFs.
+
+Entries are content-addressed: the file name carries a digest of everything
+the PDF template reads (invoice, items, company, customer) plus the template
+source, so an edit anywhere produces a new key and the old file is never
+served again. Saving or deleting an invoice also drops its files eagerly; the
+rest are evicted least-recently-used once the directory exceeds
+INVOICES_PDF_CACHE_MAX_BYTES.
+"""
+import hashlib
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.template.loader import get_template
+
+from .pdf import INVOICE_PDF_TEMPLATE, arender_pdf, render_pdf
+
+
+def cache_dir():
+    path = Path(getattr(settings, 'INVOICES_PDF_CACHE_DIR', settings.BASE_DIR / 'pdf_cache'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@lru_cache(maxsize=None)
+def template_version():
+    source = get_template(INVOICE_PDF_TEMPLATE).template.source
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def invoice_digest(invoice):
+    """Digest of every value the PDF template renders for ``invoice``"""
+    company = invoice.company
+    customer = invoice.customer
+    parts = [
+        template_version(),
+        invoice.pk, invoice.invoice_number, invoice.date_created, invoice.date_due,
+        invoice.status, invoice.notes, invoice.discount_amount,
+        invoice.shipping_amount, invoice.subtotal, invoice.total,
+        company.pk, company.name, company.address, company.phone, company.email,
+        customer.pk, customer.name, customer.address, customer.phone, customer.email,
+    ]
+    for item in invoice.items.all():
+        parts += [item.pk, item.description, item.quantity, item.unit_price]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def _path(invoice_pk, digest):
+    return cache_dir() / f"{invoice_pk}-{digest}.pdf"
+
+
+def get(invoice_pk, digest):
+    """Path of the cached PDF, or None. A hit refreshes the entry's LRU age."""
+    path = _path(invoice_pk, digest)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def put(invoice_pk, digest, data):
+    """Store ``data`` atomically and return its path"""
+    invalidate(invoice_pk)
+    path = _path(invoice_pk, digest)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    evict()
+    return path
+
+
+def get_or_render(invoice, digest):
+    """Path of ``invoice``'s PDF, rendering it on a miss; None if rendering failed"""
+    path = get(invoice.pk, digest)
+    if path is None:
+        pdf = render_pdf(INVOICE_PDF_TEMPLATE, {'invoice': invoice})
+        if pdf is None:
+            return None
+        path = put(invoice.pk, digest, pdf)
+    return path
+
+
+def _read(invoice_pk, digest):
+    """The cached PDF bytes, or None"""
+    path = get(invoice_pk, digest)
+    if path is None:
+        return None
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        # Evicted since get()
+        return None
+
+
+async def aread_or_render(invoice, digest):
+    """The PDF bytes of ``invoice`` for async views; None if rendering failed.
+
+    File I/O runs in a worker thread and rendering in the render pool, so the
+    event loop is never blocked. ``invoice`` needs its items prefetched.
+    """
+    pdf = await sync_to_async(_read, thread_sensitive=False)(invoice.pk, digest)
+    if pdf is not None:
+        return pdf
+    pdf = await arender_pdf(INVOICE_PDF_TEMPLATE, {'invoice': invoice})
+    if pdf is not None:
+        await sync_to_async(put, thread_sensitive=False)(invoice.pk, digest, pdf)
+    return pdf
+
+
+def invalidate(invoice_pk):
+    for path in cache_dir().glob(f"{invoice_pk}-*.pdf"):
+        path.unlink(missing_ok=True)
+
+
+def evict(max_bytes=None):
+    """Delete least-recently-used entries until the cache fits in ``max_bytes``"""
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'INVOICES_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    entries = []
+    total = 0
+    with os.scandir(cache_dir()) as it:
+        for entry in it:
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
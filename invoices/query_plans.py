@@ -0,0 +1,101 @@
+"""EXPLAIN-based checks that the key queries keep using their indexes.
+
+KEY_QUERIES builds the queries behind invoice_list and its searches, the
+admin changelist, invoice_detail, the reports and the invoice form
+autocomplete from a sample invoice. plan_problems() runs EXPLAIN and reports
+a full scan of a large table or an explicit sort, both of which grow with the
+row count. Planners only pick indexes with statistics to go on, so check
+against a seeded, ANALYZEd database.
+"""
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+
+from . import aging
+from .autocomplete import name_prefix
+from .models import Company, Customer, Invoice, InvoiceItem
+from .pagination import KeysetPaginator
+from .search import LIST_ORDERING, filter_invoices
+
+# Tables that grow with the business; scans of the small ones are fine
+LARGE_TABLES = {Invoice._meta.db_table, InvoiceItem._meta.db_table, Customer._meta.db_table}
+
+
+def _list_window(queryset, after=None, ordering=LIST_ORDERING):
+    paginator = KeysetPaginator(
+        queryset, ordering, getattr(settings, 'INVOICES_PAGE_SIZE', 50)
+    )
+    return paginator.window(values=after)
+
+
+def _search_window(queryset, search):
+    queryset, ordering = filter_invoices(queryset, search)
+    return _list_window(queryset, ordering=ordering)
+
+
+def key_queries(sample):
+    """``(name, queryset, allowed problems)`` for every checked query"""
+    invoices = Invoice.objects.with_totals()
+    after = [sample.date_created, sample.pk]
+    month = sample.date_created.replace(day=1)
+    return [
+        ('invoice_list', _list_window(invoices), set()),
+        ('invoice_list:next_page', _list_window(invoices, after), set()),
+        ('invoice_list:status', _list_window(invoices.filter(status=sample.status)), set()),
+        ('invoice_list:status_next_page',
+         _list_window(invoices.filter(status=sample.status), after), set()),
+        # Ranked by match quality, so the matches themselves get sorted
+        ('invoice_list:search_number', _search_window(invoices, sample.invoice_number), {'sort'}),
+        ('invoice_list:search_customer', _search_window(invoices, sample.customer.name), {'sort'}),
+        ('admin:date_hierarchy', _list_window(
+            invoices.filter(date_created__gte=month, date_created__lt=month + timedelta(days=31))
+        ), set()),
+        ('invoice_detail', invoices.filter(pk=sample.pk), set()),
+        ('invoice_detail:items', InvoiceItem.objects.filter(invoice=sample.pk), set()),
+        ('rollups:bucket', Invoice.objects.filter(
+            date_created=sample.date_created, company_id=sample.company_id, status=sample.status
+        ).values('pk'), set()),
+        ('autocomplete:customers', name_prefix(Customer.objects.all(), sample.customer.name[:3])[:20],
+         set()),
+        ('autocomplete:companies', name_prefix(Company.objects.all(), sample.company.name[:3])[:20],
+         set()),
+        # Ordered by the aggregated balance, which no index can provide
+        ('aging_report', aging.aging_by_customer(sample.date_due), {'sort'}),
+    ]
+
+
+def plan_problems(queryset):
+    """Set of 'scan:<table>' / 'sort' entries found in the plan of ``queryset``"""
+    connection = connections[queryset.db]
+    problems = set()
+    if connection.vendor == 'postgresql':
+        plan = json.loads(queryset.explain(format='json'))
+        nodes = [plan[0]['Plan'] if isinstance(plan, list) else plan['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in LARGE_TABLES:
+                problems.add(f"scan:{node['Relation Name']}")
+            if node['Node Type'] == 'Sort':
+                problems.add('sort')
+            nodes.extend(node.get('Plans', []))
+    elif connection.vendor == 'sqlite':
+        for line in queryset.explain().splitlines():
+            words = line.split()
+            if 'SCAN' in words:
+                table = words[words.index('SCAN') + 1]
+                if table in LARGE_TABLES and 'USING' not in words:
+                    problems.add(f'scan:{table}')
+            if 'TEMP B-TREE' in line:
+                problems.add('sort')
+    return problems
+
+
+def check(sample=None):
+    """``(name, plan, unexpected problems)`` for every key query"""
+    sample = sample or Invoice.objects.order_by('pk')[Invoice.objects.count() // 2]
+    results = []
+    for name, queryset, allowed in key_queries(sample):
+        results.append((name, queryset.explain(), plan_problems(queryset) - allowed))
+    return results
@@ -0,0 +1,144 @@
+"""Send the queries of read-only views to a read replica.
+
+Views decorated with @replica_reads run with a context variable naming the
+INVOICES_READ_REPLICA alias, and ReplicaRouter sends every read made while
+it is set there. Writes always go to the primary. After a successful
+POST/PUT/DELETE, ReplicaStickinessMiddleware sets a short-lived cookie that
+keeps the client reading from the primary, so it sees its own writes
+despite replication lag.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'invoices_primary'
+
+_read_alias = contextvars.ContextVar('invoices_read_alias', default=None)
+
+
+def replica_alias():
+    """The configured replica alias, or None when reads stay on the primary"""
+    alias = getattr(settings, 'INVOICES_READ_REPLICA', None)
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def reading_from(alias):
+    """Route the reads in this block (and threads it hands work to) to ``alias``"""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Named explicitly: otherwise an instance loaded from the replica
+        # would be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def _read_alias_for(request):
+    if request.COOKIES.get(STICKY_COOKIE):
+        return None
+    return replica_alias()
+
+
+def _pinned(alias, chunks):
+    """Iterate ``chunks`` with reads routed to ``alias``.
+
+    Streamed bodies run their queries after the view has returned.
+    """
+    chunks = iter(chunks)
+    while True:
+        with reading_from(alias):
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+        yield chunk
+
+
+async def _apinned(alias, chunks):
+    """_pinned() for the async iterators of responses served over ASGI"""
+    chunks = aiter(chunks)
+    while True:
+        with reading_from(alias):
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def _pin_streaming(response, alias):
+    if alias is not None and response.streaming:
+        pinned = _apinned if response.is_async else _pinned
+        response.streaming_content = pinned(alias, response.streaming_content)
+    return response
+
+
+def replica_reads(view):
+    """Run ``view``'s queries on the read replica, unless the client just wrote"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            alias = _read_alias_for(request)
+            with reading_from(alias):
+                response = await view(request, *args, **kwargs)
+            return _pin_streaming(response, alias)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            alias = _read_alias_for(request)
+            with reading_from(alias):
+                response = view(request, *args, **kwargs)
+            return _pin_streaming(response, alias)
+    return wrapper
+
+
+class ReplicaStickinessMiddleware:
+    """Pin a client to the primary for INVOICES_REPLICA_STICKY_SECONDS after it writes"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._stick(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._stick(request, await self.get_response(request))
+
+    def _stick(self, request, response):
+        if (
+            request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+            and response.status_code < 400
+            and replica_alias() is not None
+        ):
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=getattr(settings, 'INVOICES_REPLICA_STICKY_SECONDS', 10),
+                httponly=True, samesite='Lax',
+            )
+        return response
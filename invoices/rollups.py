@@ -0,0 +1,193 @@
+"""Revenue rollups: invoice totals per (day, company, status) bucket.
+
+Saving or deleting an invoice recomputes the buckets it left and entered from
+the invoice table (one indexed day's worth of rows each), so a bucket is
+always an exact aggregate rather than a running sum that could drift. The
+recompute waits for the saving transaction to commit and runs once for all
+the buckets it touched, so the lock on a bucket row is never held for the
+rest of someone else's transaction, and an invoice saved several times in it
+(as item edits re-save the totals) is aggregated once. Saves that change
+neither the bucket nor a measure skip it. The bucket row is locked first; a
+concurrent writer to the same bucket waits for the first to commit and then
+aggregates what it committed. Bulk writers,
+which bypass signals, call refresh() for the buckets they touched, or
+refresh_days() for whole days only they write to, or rebuild() for
+everything.
+
+Reports read only from the rollups, so their cost depends on the number of
+days and companies in range, not the number of invoices.
+"""
+import threading
+from decimal import Decimal
+from functools import partial
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import Company, Invoice, RevenueRollup
+
+MEASURES = ['invoice_count', 'subtotal', 'discount', 'shipping', 'total']
+
+GROUPS = ['day', 'month', 'status', 'company']
+
+
+def bucket(invoice):
+    return (invoice.date_created, invoice.company_id, invoice.status)
+
+
+def _invoice_sums():
+    """Aggregates of the invoice columns behind each measure, as ``sum_<measure>``"""
+    money = DecimalField(max_digits=14, decimal_places=2)
+    zero = Decimal('0.00')
+    return {
+        'sum_invoice_count': Count('pk'),
+        'sum_subtotal': Coalesce(Sum('subtotal'), zero, output_field=money),
+        'sum_discount': Coalesce(Sum('discount_amount'), zero, output_field=money),
+        'sum_shipping': Coalesce(Sum('shipping_amount'), zero, output_field=money),
+        'sum_total': Coalesce(Sum('total'), zero, output_field=money),
+    }
+
+
+def refresh(buckets, using=DEFAULT_DB_ALIAS):
+    """Recompute the given ``(day, company_id, status)`` buckets"""
+    rollups = RevenueRollup.objects.using(using)
+    # A fixed lock order keeps two writers moving invoices between the same
+    # buckets from deadlocking
+    for day, company_id, status in sorted(set(buckets)):
+        key = {'day': day, 'company_id': company_id, 'status': status}
+        with transaction.atomic(using=using):
+            rollups.get_or_create(**key)
+            row = rollups.select_for_update().get(**key)
+            totals = (
+                Invoice.objects.using(using)
+                .filter(date_created=day, company_id=company_id, status=status)
+                .aggregate(**_invoice_sums())
+            )
+            if totals['sum_invoice_count']:
+                for name in MEASURES:
+                    setattr(row, name, totals[f'sum_{name}'])
+                row.save(update_fields=MEASURES)
+            else:
+                row.delete()
+
+
+# Buckets waiting for the open transaction to commit, per thread and database
+_pending = threading.local()
+
+
+def refresh_on_commit(buckets, using=DEFAULT_DB_ALIAS):
+    """refresh() the given buckets once the current transaction commits"""
+    pending = _pending.__dict__.setdefault(using, set())
+    pending.update(buckets)
+    # Every call registers a flush (a rolled back transaction drops its
+    # callbacks), but the first to run takes all the buckets queued so far
+    transaction.on_commit(partial(_flush, using), using=using)
+
+
+def _flush(using):
+    buckets = _pending.__dict__.pop(using, None)
+    if buckets:
+        refresh(buckets, using=using)
+
+
+def _insert(invoices, using, batch_size):
+    """Create the rollup rows aggregating ``invoices``; returns how many"""
+    buckets = (
+        invoices.order_by()
+        .values('date_created', 'company_id', 'status')
+        .annotate(**_invoice_sums())
+    )
+    created = 0
+    batch = []
+    for values in buckets.iterator(chunk_size=batch_size):
+        batch.append(RevenueRollup(
+            day=values['date_created'],
+            company_id=values['company_id'],
+            status=values['status'],
+            **{name: values[f'sum_{name}'] for name in MEASURES},
+        ))
+        if len(batch) >= batch_size:
+            RevenueRollup.objects.using(using).bulk_create(batch)
+            created += len(batch)
+            batch = []
+    RevenueRollup.objects.using(using).bulk_create(batch)
+    return created + len(batch)
+
+
+def refresh_days(days, using=DEFAULT_DB_ALIAS, batch_size=1000):
+    """Recompute every bucket of the given days in a few set-based queries.
+
+    Meant for bulk writers touching many buckets at once; unlike refresh()
+    it doesn't lock, so don't race it against edits of the same days.
+    """
+    days = set(days)
+    with transaction.atomic(using=using):
+        RevenueRollup.objects.using(using).filter(day__in=days).delete()
+        invoices = Invoice.objects.using(using).filter(date_created__in=days)
+        return _insert(invoices, using, batch_size)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS, batch_size=1000):
+    """Replace every rollup with a fresh aggregate of the invoice table"""
+    with transaction.atomic(using=using):
+        RevenueRollup.objects.using(using).all().delete()
+        return _insert(Invoice.objects.using(using), using, batch_size)
+
+
+def report(group='month', start=None, end=None, status='', company=None):
+    """``(rows, totals)`` of the measures summed per ``group``, from the rollups only.
+
+    Each row has the group ``key``, a display ``label`` and the MEASURES.
+    """
+    if group not in GROUPS:
+        raise ValueError(f"group must be one of {', '.join(GROUPS)}")
+    rollups = RevenueRollup.objects.order_by()
+    if start:
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+    if status:
+        rollups = rollups.filter(status=status)
+    if company:
+        rollups = rollups.filter(company_id=company)
+
+    key = {
+        'day': F('day'), 'month': TruncMonth('day'), 'status': F('status'), 'company': F('company_id'),
+    }
+    money = DecimalField(max_digits=16, decimal_places=2)
+    sums = {f'sum_{name}': Sum(name, output_field=money) for name in MEASURES[1:]}
+    rows = list(
+        rollups.annotate(key=key[group]).values('key')
+        .annotate(sum_invoice_count=Sum('invoice_count'), **sums)
+        .order_by('key')
+    )
+
+    if group == 'company':
+        labels = dict(
+            Company.objects.filter(pk__in=[row['key'] for row in rows]).values_list('pk', 'name')
+        )
+    elif group == 'status':
+        labels = dict(Invoice.STATUS_CHOICES)
+    else:
+        labels = {}
+
+    cent = Decimal('0.01')
+    report_rows = []
+    totals = {name: Decimal('0.00') for name in MEASURES[1:]}
+    totals['invoice_count'] = 0
+    for row in rows:
+        label = labels.get(row['key'])
+        if label is None:
+            label = row['key'].strftime('%Y-%m') if group == 'month' else str(row['key'])
+        entry = {'key': row['key'], 'label': label}
+        for name in MEASURES:
+            value = row[f'sum_{name}'] or 0
+            if name != 'invoice_count':
+                value = Decimal(value).quantize(cent)
+            entry[name] = value
+            totals[name] += value
+        report_rows.append(entry)
+    if group == 'company':
+        report_rows.sort(key=lambda entry: entry['label'])
+    return report_rows, totals
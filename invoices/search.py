@@ -0,0 +1,136 @@
+import re
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Upper
+from django.db.models.lookups import Regex
+
+from .models import Customer, Invoice
+
+# Default invoice_list ordering; searches are ranked first, then use this.
+LIST_ORDERING = ('-date_created', '-id')
+
+FTS_TABLE = 'invoices_invoice_fts'
+
+SQLITE_FTS_TABLE_SQL = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(invoice_number, customer_name)"""
+
+SQLITE_FTS_FILL_SQL = f"""INSERT INTO {FTS_TABLE}(rowid, invoice_number, customer_name)
+    SELECT i.id, i.invoice_number, c.name
+    FROM invoices_invoice i JOIN invoices_customer c ON c.id = i.customer_id"""
+
+SQLITE_FTS_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""AFTER INSERT ON invoices_invoice BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, invoice_number, customer_name)
+        VALUES (new.id, new.invoice_number,
+                (SELECT name FROM invoices_customer WHERE id = new.customer_id));
+    END""",
+    f'{FTS_TABLE}_ad': f"""AFTER DELETE ON invoices_invoice BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f'{FTS_TABLE}_au': f"""AFTER UPDATE OF invoice_number, customer_id ON invoices_invoice BEGIN
+        UPDATE {FTS_TABLE}
+        SET invoice_number = new.invoice_number,
+            customer_name = (SELECT name FROM invoices_customer WHERE id = new.customer_id)
+        WHERE rowid = new.id;
+    END""",
+    f'{FTS_TABLE}_customer_au': f"""AFTER UPDATE OF name ON invoices_customer BEGIN
+        UPDATE {FTS_TABLE} SET customer_name = new.name
+        WHERE rowid IN (SELECT id FROM invoices_invoice WHERE customer_id = new.id);
+    END""",
+}
+
+
+def install_search_index(connection):
+    """Create the SQLite FTS5 table and its triggers (idempotent).
+
+    Migration 0004 creates the table (and the Postgres trigram indexes). The
+    triggers keeping it in sync are installed after migrations rather than by
+    them, because SQLite rebuilds a table on most schema changes and a
+    trigger naming a table mid-rebuild aborts the migration; see
+    drop_search_triggers(). Whenever the triggers had to be
+    (re)created the FTS table is refilled, since writes may have gone unseen.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(SQLITE_FTS_TABLE_SQL)
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{FTS_TABLE}_%'],
+        )
+        existing = {name for name, in cursor.fetchall()}
+        if existing == set(SQLITE_FTS_TRIGGERS):
+            return
+        for name, body in SQLITE_FTS_TRIGGERS.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(SQLITE_FTS_FILL_SQL)
+
+
+def drop_search_triggers(connection):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name in SQLITE_FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def _word_prefix(term):
+    """Postgres regex for ``term`` at the start of a word, matched against UPPER(col)"""
+    return r'\m' + re.escape(term.upper())
+
+
+def search_invoices(queryset, search):
+    """Filter ``queryset`` to invoices matching ``search``, annotated with a ``rank``.
+
+    Every word in ``search`` must prefix-match a word of the invoice number or
+    customer name. SQLite answers this from the FTS5 shadow table; Postgres
+    from the trigram indexes on UPPER(col::text) built by migration 0004,
+    with the number and customer matches of each word as a UNION so each
+    side is read from its own table's index. rank is 3 for an exact invoice
+    number, 2 for an invoice number prefix, 1 for a customer name prefix and
+    0 otherwise.
+    """
+    terms = re.findall(r'\w+', search)
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite' and terms:
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,)
+        ))
+    elif vendor == 'postgresql' and terms:
+        invoices = Invoice.objects.using(queryset.db)
+        customers = Customer.objects.using(queryset.db)
+        for term in terms:
+            pattern = _word_prefix(term)
+            by_number = invoices.filter(Regex(Upper('invoice_number'), pattern))
+            by_customer = invoices.filter(
+                customer_id__in=customers.filter(Regex(Upper('name'), pattern)).values('pk')
+            )
+            queryset = queryset.filter(
+                pk__in=by_number.values('pk').union(by_customer.values('pk'))
+            )
+    else:
+        for term in terms or [search]:
+            queryset = queryset.filter(
+                Q(invoice_number__icontains=term) | Q(customer__name__icontains=term)
+            )
+    return queryset.annotate(rank=Case(
+        When(invoice_number__iexact=search, then=Value(3)),
+        When(invoice_number__istartswith=search, then=Value(2)),
+        When(customer__name__istartswith=search, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+
+
+def filter_invoices(queryset, search='', status=''):
+    """Apply the invoice_list filters; returns ``(queryset, ordering)``"""
+    ordering = LIST_ORDERING
+    if search:
+        queryset = search_invoices(queryset, search)
+        ordering = ('-rank',) + LIST_ORDERING
+    if status:
+        queryset = queryset.filter(status=status)
+    return queryset, ordering
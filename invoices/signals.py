@@ -0,0 +1,136 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate, pre_save
+from django.dispatch import receiver
+
+from . import pdf_cache, rollups
+from .models import Invoice, InvoiceItem
+from .search import FTS_TABLE, drop_search_triggers, install_search_index
+
+
+_totals_deferred = contextvars.ContextVar('invoices_totals_deferred', default=False)
+
+
+@contextmanager
+def deferring_totals():
+    """Skip the per-item totals recalculation of item deletes in this block.
+
+    For callers that delete several items and recalculate the invoice once
+    themselves.
+    """
+    token = _totals_deferred.set(True)
+    try:
+        yield
+    finally:
+        _totals_deferred.reset(token)
+
+
+def _deleting_invoice(origin):
+    """True when an item delete is part of deleting its invoice"""
+    return isinstance(origin, Invoice) or getattr(origin, 'model', None) is Invoice
+
+
+@receiver(pre_save, sender=InvoiceItem)
+def remember_item_invoice(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Note the invoice an item is being moved off, for item_saved"""
+    instance._previous_invoice_id = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not {'invoice', 'invoice_id'}.intersection(update_fields):
+        return
+    instance._previous_invoice_id = (
+        InvoiceItem.objects.using(using).filter(pk=instance.pk)
+        .values_list('invoice_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=InvoiceItem)
+def item_saved(sender, instance, using=None, **kwargs):
+    instance.invoice.recalculate_totals()
+    previous = getattr(instance, '_previous_invoice_id', None)
+    if previous is not None and previous != instance.invoice_id:
+        invoice = Invoice.objects.using(using).filter(pk=previous).first()
+        if invoice is not None:
+            invoice.recalculate_totals()
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def item_deleted(sender, instance, origin=None, **kwargs):
+    if _deleting_invoice(origin) or _totals_deferred.get():
+        return
+    instance.invoice.recalculate_totals()
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def drop_cached_pdf(sender, instance, **kwargs):
+    pdf_cache.invalidate(instance.pk)
+
+
+# The fields whose save can move an invoice to another rollup bucket or
+# change one of its measures
+_ROLLUP_FIELDS = {
+    'date_created', 'company', 'company_id', 'status',
+    'subtotal', 'discount_amount', 'shipping_amount', 'total',
+}
+
+
+def _rollup_state(invoice):
+    """The invoice's rollup bucket and the columns behind its measures"""
+    return (
+        *rollups.bucket(invoice),
+        invoice.subtotal, invoice.discount_amount, invoice.shipping_amount, invoice.total,
+    )
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_rollup_state(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Note the bucket and measures the invoice is leaving, for update_rollups"""
+    instance._previous_rollup_state = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not _ROLLUP_FIELDS.intersection(update_fields):
+        return
+    instance._previous_rollup_state = (
+        Invoice.objects.using(using).filter(pk=instance.pk)
+        .values_list(
+            'date_created', 'company_id', 'status',
+            'subtotal', 'discount_amount', 'shipping_amount', 'total',
+        ).first()
+    )
+
+
+@receiver(post_save, sender=Invoice)
+def update_rollups(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    if raw or update_fields is not None and not _ROLLUP_FIELDS.intersection(update_fields):
+        return
+    previous = getattr(instance, '_previous_rollup_state', None)
+    if previous == _rollup_state(instance):
+        return
+    buckets = {rollups.bucket(instance)}
+    if previous:
+        buckets.add(previous[:3])
+    rollups.refresh_on_commit(buckets, using=using)
+
+
+@receiver(post_delete, sender=Invoice)
+def remove_from_rollups(sender, instance, using=None, **kwargs):
+    rollups.refresh_on_commit([rollups.bucket(instance)], using=using)
+
+
+@receiver(pre_migrate)
+def drop_search_triggers_for_migrate(sender, app_config, using, **kwargs):
+    """SQLite table rebuilds fail while the FTS5 triggers reference the table"""
+    if app_config.name == 'invoices':
+        drop_search_triggers(connections[using])
+
+
+@receiver(post_migrate)
+def install_search_triggers(sender, app_config, using, **kwargs):
+    connection = connections[using]
+    if app_config.name != 'invoices' or connection.vendor != 'sqlite':
+        return
+    if FTS_TABLE in connection.introspection.table_names():
+        install_search_index(connection)
@@ -0,0 +1,13 @@
+from . import pdf_cache
+from .jobs import handler
+from .models import Invoice
+
+
+@handler('render_invoice_pdf')
+def render_invoice_pdf(invoice_id):
+    """Render an invoice's PDF into the PDF cache"""
+    invoice = Invoice.objects.with_totals().prefetch_related('items').get(pk=invoice_id)
+    digest = pdf_cache.invoice_digest(invoice)
+    if pdf_cache.get_or_render(invoice, digest) is None:
+        raise RuntimeError(f"Error generating PDF for {invoice}")
+    return {'invoice_id': invoice.pk, 'digest': digest}
@@ -0,0 +1,46 @@
+from django import template
+
+from .. import fragments
+
+register = template.Library()
+
+
+class InvoiceFragmentNode(template.Node):
+    def __init__(self, nodelist, name, invoice, template_name):
+        self.nodelist = nodelist
+        self.name = name
+        self.invoice = invoice
+        self.template_name = template_name
+
+    def render(self, context):
+        return fragments.render(
+            self.template_name,
+            self.name.resolve(context),
+            self.invoice.resolve(context),
+            lambda: self.nodelist.render(context),
+        )
+
+
+@register.tag
+def invoice_fragment(parser, token):
+    """Cache the enclosed markup per invoice version; see invoices.fragments.
+
+    Usage::
+
+        {% invoice_fragment "row" invoice %}...{% endinvoice_fragment %}
+
+    The markup may only depend on the invoice, its items, customer and company.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' takes a fragment name and an invoice"
+        )
+    nodelist = parser.parse(('endinvoice_fragment',))
+    parser.delete_first_token()
+    return InvoiceFragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        parser.origin.template_name,
+    )
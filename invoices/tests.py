@@ -1,10 +1,41 @@
-from django.test import TestCase, Client
+from django.conf import settings
+from django.contrib.auth.models import User
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.template import Context, Template, TemplateSyntaxError
 from django.urls import reverse
+from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
 from decimal import Decimal
 from datetime import date, timedelta
-from .models import Company, Customer, Invoice, InvoiceItem
-from .forms import InvoiceForm, InvoiceItemForm
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
+import csv
+import json
+from unittest import mock, skipUnless
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from django.db import connection, connections
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from .importer import InvoiceImporter
+from .models import (
+    Company, Customer, Invoice, InvoiceItem, InvoiceNumberSequence, Job, RevenueRollup,
+)
+from .forms import InvoiceForm, InvoiceItemForm, InvoiceItemFormSet
+from .pagination import EstimatedCountPaginator, KeysetPaginator
+from .search import filter_invoices
+from . import (
+    aging, autocomplete, benchmark, exports, fragments, jobs, metrics, numbering, pdf, pdf_cache,
+    query_plans, replicas, rollups, transitions,
+)
 
 
 class CompanyModelTest(TestCase):
@@ -149,6 +180,86 @@ class InvoiceModelTest(TestCase):
         # total = 100 - 10 + 5 = 95
         self.assertEqual(self.invoice.total, Decimal('95.00'))
     
+    def test_invoice_totals_follow_item_changes(self):
+        """Test stored totals are refreshed when items are updated or deleted"""
+        item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Item 1",
+            quantity=2,
+            unit_price=Decimal('50.00')
+        )
+        item.quantity = 4
+        item.save()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.subtotal, Decimal('200.00'))
+        self.assertEqual(self.invoice.total, Decimal('195.00'))
+        
+        item.delete()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.subtotal, Decimal('0.00'))
+        self.assertEqual(self.invoice.total, Decimal('-5.00'))
+    
+    def test_invoice_total_follows_discount_change(self):
+        """Test total is recomputed when discount or shipping change"""
+        InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Item 1",
+            quantity=1,
+            unit_price=Decimal('100.00')
+        )
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        invoice.discount_amount = Decimal('20.00')
+        invoice.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total, Decimal('85.00'))
+    
+    def test_invoice_totals_read_without_item_query(self):
+        """Test reading totals is a column fetch, not an items query"""
+        InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Item 1",
+            quantity=1,
+            unit_price=Decimal('100.00')
+        )
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(invoice.subtotal, Decimal('100.00'))
+            self.assertEqual(invoice.total, Decimal('95.00'))
+    
+    def test_rebuild_invoice_totals_command(self):
+        """Test the rebuild command repairs drifted stored totals"""
+        InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Item 1",
+            quantity=3,
+            unit_price=Decimal('10.00')
+        )
+        Invoice.objects.filter(pk=self.invoice.pk).update(subtotal=0, total=0)
+        call_command('rebuild_invoice_totals', stdout=StringIO())
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.subtotal, Decimal('30.00'))
+        self.assertEqual(self.invoice.total, Decimal('25.00'))
+    
+    def test_with_computed_totals(self):
+        """Test totals summed from the items in SQL match the stored ones"""
+        InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Item 1",
+            quantity=2,
+            unit_price=Decimal('50.00')
+        )
+        invoice = Invoice.objects.with_computed_totals().get(pk=self.invoice.pk)
+        self.assertEqual(invoice.computed_subtotal, Decimal('100.00'))
+        self.assertEqual(invoice.computed_total, invoice.total)
+    
+    def test_rebuild_invoice_totals_check(self):
+        """Test --check lists invoices with stale totals without fixing them"""
+        Invoice.objects.filter(pk=self.invoice.pk).update(total=Decimal('1.00'))
+        out = StringIO()
+        call_command('rebuild_invoice_totals', check=True, stdout=out)
+        self.assertIn('INV-001', out.getvalue())
+        self.assertIn('1 invoices have stale totals', out.getvalue())
+    
     def test_invoice_negative_discount_validation(self):
         """Test that negative discount amounts are not allowed"""
         invoice = Invoice(
@@ -203,6 +314,21 @@ class InvoiceItemModelTest(TestCase):
             unit_price=Decimal('25.00')
         )
     
+    def test_moving_item_updates_both_invoices(self):
+        """Test moving an item to another invoice recalculates the one it left"""
+        other = Invoice.objects.create(
+            invoice_number="INV-002",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        self.item.invoice = other
+        self.item.save()
+        self.invoice.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.invoice.subtotal, Decimal('0.00'))
+        self.assertEqual(other.subtotal, Decimal('75.00'))
+    
     def test_invoice_item_creation(self):
         """Test that an invoice item can be created successfully"""
         self.assertEqual(self.item.description, "Test Item")
@@ -283,7 +409,8 @@ class InvoiceFormTest(TestCase):
         """Test form with missing required fields"""
         form = InvoiceForm(data={})
         self.assertFalse(form.is_valid())
-        self.assertIn('invoice_number', form.errors)
+        # A new invoice left without a number is given the next one
+        self.assertNotIn('invoice_number', form.errors)
         self.assertIn('company', form.errors)
         self.assertIn('customer', form.errors)
 
@@ -438,6 +565,8 @@ class InvoiceViewsTest(TestCase):
         self.invoice.refresh_from_db()
         self.assertEqual(self.invoice.invoice_number, 'INV-001-UPDATED')
         self.assertEqual(self.invoice.status, 'sent')
+        self.assertEqual(self.invoice.subtotal, Decimal('225.00'))
+        self.assertEqual(self.invoice.total, Decimal('230.00'))
         self.assertRedirects(response, reverse('invoice_detail', kwargs={'pk': self.invoice.pk}))
     
     def test_invoice_delete_view_get(self):
@@ -471,3 +600,2323 @@ class InvoiceViewsTest(TestCase):
         response = self.client.get(reverse('invoice_pdf', kwargs={'pk': 9999}))
         self.assertEqual(response.status_code, 404)
 
+
+
+@override_settings(INVOICES_PAGE_SIZE=2)
+class InvoiceListPaginationTest(TestCase):
+    """Test cases for keyset pagination of the invoice list"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        for n in range(1, 6):
+            Invoice.objects.create(
+                invoice_number=f"INV-00{n}",
+                company=self.company,
+                customer=self.customer,
+                date_due=date.today() + timedelta(days=30),
+                status='paid' if n % 2 else 'draft'
+            )
+    
+    def numbers(self, response):
+        return [invoice.invoice_number for invoice in response.context['invoices']]
+    
+    def test_first_page(self):
+        """Test the first page holds the newest invoices and a next cursor"""
+        response = self.client.get(reverse('invoice_list'))
+        self.assertEqual(self.numbers(response), ['INV-005', 'INV-004'])
+        self.assertFalse(response.context['page'].has_previous())
+        self.assertTrue(response.context['page'].has_next())
+    
+    def test_walk_forward_and_back(self):
+        """Test following next cursors to the end and prev cursors back"""
+        url = reverse('invoice_list')
+        page = self.client.get(url).context['page']
+        second = self.client.get(url, {'cursor': page.next_cursor})
+        self.assertEqual(self.numbers(second), ['INV-003', 'INV-002'])
+        third = self.client.get(url, {'cursor': second.context['page'].next_cursor})
+        self.assertEqual(self.numbers(third), ['INV-001'])
+        self.assertFalse(third.context['page'].has_next())
+        back = self.client.get(url, {'cursor': third.context['page'].prev_cursor})
+        self.assertEqual(self.numbers(back), ['INV-003', 'INV-002'])
+        first = self.client.get(url, {'cursor': back.context['page'].prev_cursor})
+        self.assertEqual(self.numbers(first), ['INV-005', 'INV-004'])
+        self.assertFalse(first.context['page'].has_previous())
+    
+    def test_cursor_keeps_filters(self):
+        """Test pages stay filtered and links carry the filters"""
+        url = reverse('invoice_list')
+        response = self.client.get(url, {'status': 'paid'})
+        self.assertEqual(self.numbers(response), ['INV-005', 'INV-003'])
+        self.assertContains(response, 'status=paid&amp;cursor=')
+        cursor = response.context['page'].next_cursor
+        response = self.client.get(url, {'status': 'paid', 'cursor': cursor})
+        self.assertEqual(self.numbers(response), ['INV-001'])
+    
+    def test_list_query_count_is_constant(self):
+        """Test a page of invoices is rendered from a single query"""
+        with self.assertNumQueries(1):
+            self.client.get(reverse('invoice_list'))
+    
+    def test_invalid_cursor(self):
+        """Test a tampered cursor returns 404"""
+        response = self.client.get(reverse('invoice_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+    
+    def test_cursor_values_must_be_a_list(self):
+        """Test a well-formed cursor carrying non-list values returns 404"""
+        for payload in (['n', 5], ['n', None], 'n'):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            response = self.client.get(reverse('invoice_list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, payload)
+
+
+class InvoiceSearchTest(TestCase):
+    """Test cases for the indexed invoice search"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.john = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.acme = Customer.objects.create(
+            name="Acme Industries",
+            email="billing@acme.com",
+            phone="555-0000",
+            address="1 Acme Way"
+        )
+        for number, customer in [('INV-100', self.john), ('INV-1001', self.acme), ('ACME-7', self.john)]:
+            Invoice.objects.create(
+                invoice_number=number,
+                company=self.company,
+                customer=customer,
+                date_due=date.today() + timedelta(days=30)
+            )
+    
+    def search(self, term):
+        response = self.client.get(reverse('invoice_list'), {'search': term})
+        return [invoice.invoice_number for invoice in response.context['invoices']]
+    
+    def test_exact_number_ranks_first(self):
+        """Test an exact invoice number outranks longer prefix matches"""
+        self.assertEqual(self.search('INV-100'), ['INV-100', 'INV-1001'])
+    
+    def test_prefix_match(self):
+        """Test words match by prefix, case-insensitively"""
+        self.assertEqual(self.search('jo'), ['ACME-7', 'INV-100'])
+        self.assertEqual(self.search('indust'), ['INV-1001'])
+        self.assertEqual(self.search('1001'), ['INV-1001'])
+    
+    def test_no_match_inside_words(self):
+        """Test a term only matches at the start of a word, not inside one"""
+        self.assertEqual(self.search('ohn'), [])
+        self.assertEqual(self.search('001'), [])
+    
+    def test_number_prefix_outranks_customer_prefix(self):
+        """Test an invoice number prefix ranks above a customer name prefix"""
+        self.assertEqual(self.search('acme'), ['ACME-7', 'INV-1001'])
+    
+    def test_index_follows_customer_rename(self):
+        """Test renaming a customer updates the search index"""
+        self.acme.name = "Globex"
+        self.acme.save()
+        self.assertEqual(self.search('globex'), ['INV-1001'])
+        self.assertEqual(self.search('indust'), [])
+    
+    def test_index_follows_invoice_changes(self):
+        """Test renumbered and deleted invoices are reflected in search"""
+        invoice = Invoice.objects.get(invoice_number='INV-100')
+        invoice.invoice_number = 'ZZ-1'
+        invoice.save()
+        self.assertEqual(self.search('zz'), ['ZZ-1'])
+        invoice.delete()
+        self.assertEqual(self.search('zz'), [])
+    
+    def test_search_combines_with_status(self):
+        """Test search and status filters apply together"""
+        Invoice.objects.filter(invoice_number='INV-1001').update(status='paid')
+        response = self.client.get(reverse('invoice_list'), {'search': 'inv', 'status': 'paid'})
+        self.assertEqual([i.invoice_number for i in response.context['invoices']], ['INV-1001'])
+    
+    @override_settings(INVOICES_PAGE_SIZE=1)
+    def test_ranked_results_paginate(self):
+        """Test cursors walk ranked search results in rank order"""
+        url = reverse('invoice_list')
+        response = self.client.get(url, {'search': 'INV-100'})
+        self.assertEqual([i.invoice_number for i in response.context['invoices']], ['INV-100'])
+        cursor = response.context['page'].next_cursor
+        response = self.client.get(url, {'search': 'INV-100', 'cursor': cursor})
+        self.assertEqual([i.invoice_number for i in response.context['invoices']], ['INV-1001'])
+        self.assertFalse(response.context['page'].has_next())
+
+
+class InvoicePdfCacheTest(TestCase):
+    """Test cases for the rendered PDF cache"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = override_settings(INVOICES_PDF_CACHE_DIR=self.cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.invoice = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Test Item",
+            quantity=2,
+            unit_price=Decimal('50.00')
+        )
+        self.url = reverse('invoice_pdf', kwargs={'pk': self.invoice.pk})
+    
+    def test_repeat_download_is_not_rendered_again(self):
+        """Test the second request is served from disk without rendering"""
+        with mock.patch('invoices.pdf.ahtml_to_pdf', wraps=pdf.ahtml_to_pdf) as render:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    def test_if_none_match_returns_304(self):
+        """Test a matching If-None-Match is answered with 304"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_item_change_invalidates(self):
+        """Test editing an item changes the ETag and drops the old file"""
+        etag = self.client.get(self.url)['ETag']
+        self.item.quantity = 3
+        self.item.save()
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_customer_change_changes_key(self):
+        """Test the key covers the customer shown on the PDF"""
+        etag = self.client.get(self.url)['ETag']
+        self.customer.name = "Jane Doe"
+        self.customer.save()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], etag)
+    
+    def test_lru_eviction(self):
+        """Test the least recently used entries are evicted past the size limit"""
+        pdf_cache.put(1, 'a', b'x' * 10)
+        pdf_cache.put(2, 'b', b'x' * 10)
+        os.utime(pdf_cache.get(1, 'a'), (0, 0))
+        pdf_cache.put(3, 'c', b'x' * 10)
+        pdf_cache.evict(max_bytes=20)
+        self.assertIsNone(pdf_cache.get(1, 'a'))
+        self.assertIsNotNone(pdf_cache.get(2, 'b'))
+        self.assertIsNotNone(pdf_cache.get(3, 'c'))
+    
+    def test_async_hit_is_read_off_the_event_loop(self):
+        """Test aread_or_render looks up and reads a cached PDF in a worker thread"""
+        pdf_cache.put(self.invoice.pk, 'd', b'%PDF-cached')
+        threads = []
+        real_get = pdf_cache.get
+        
+        def get(*args):
+            threads.append(threading.get_ident())
+            return real_get(*args)
+        
+        async def read():
+            return threading.get_ident(), await pdf_cache.aread_or_render(self.invoice, 'd')
+        
+        with mock.patch('invoices.pdf_cache.get', side_effect=get):
+            loop_thread, data = asyncio.run(read())
+        self.assertEqual(data, b'%PDF-cached')
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(loop_thread, threads)
+
+
+class JobQueueTest(TestCase):
+    """Test cases for the background job queue"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = override_settings(INVOICES_PDF_CACHE_DIR=self.cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.invoice = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        self.calls = []
+        
+        def flaky(fail_times):
+            self.calls.append(fail_times)
+            if len(self.calls) <= fail_times:
+                raise RuntimeError("boom")
+            return {'calls': len(self.calls)}
+        
+        jobs.HANDLERS['test_flaky'] = flaky
+        self.addCleanup(jobs.HANDLERS.pop, 'test_flaky')
+    
+    def test_enqueue_reuses_pending_job(self):
+        """Test enqueuing the same work twice returns the pending job"""
+        first = jobs.enqueue('test_flaky', {'fail_times': 0})
+        second = jobs.enqueue('test_flaky', {'fail_times': 0})
+        self.assertEqual(first.pk, second.pk)
+    
+    def test_enqueue_unknown_kind(self):
+        """Test enqueuing a job with no handler is rejected"""
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nope', {})
+    
+    def test_claim_is_exclusive(self):
+        """Test a claimed job cannot be claimed again"""
+        job = jobs.enqueue('test_flaky', {'fail_times': 0})
+        claimed = jobs.claim()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, 'running')
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(jobs.claim())
+    
+    def test_retry_then_succeed(self):
+        """Test a failing job is retried after a backoff and then completes"""
+        job = jobs.enqueue('test_flaky', {'fail_times': 1})
+        with self.assertLogs('invoices.jobs', 'WARNING'):
+            jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('RuntimeError', job.error)
+        self.assertGreater(job.run_after, job.updated_at - timedelta(seconds=1))
+        
+        Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.result, {'calls': 2})
+        self.assertEqual(job.attempts, 2)
+    
+    def test_gives_up_after_max_attempts(self):
+        """Test a job that keeps failing ends up failed"""
+        job = jobs.enqueue('test_flaky', {'fail_times': 5}, max_attempts=1)
+        with self.assertLogs('invoices.jobs', 'WARNING'):
+            jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+    
+    def test_requeue_stale(self):
+        """Test jobs abandoned by a dead worker are queued again"""
+        job = jobs.enqueue('test_flaky', {'fail_times': 0})
+        jobs.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=job.created_at - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(timeout=60), 1)
+        self.assertEqual(jobs.claim().pk, job.pk)
+    
+    def test_stale_job_out_of_attempts_fails(self):
+        """Test a job whose last attempt took its worker down is not retried"""
+        job = jobs.enqueue('test_flaky', {'fail_times': 0}, max_attempts=1)
+        jobs.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=job.created_at - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(timeout=60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('stopped responding', job.error)
+        self.assertIsNone(jobs.claim())
+    
+    def test_async_pdf_flow(self):
+        """Test enqueue, poll and download of an asynchronously rendered PDF"""
+        response = self.client.post(reverse('invoice_pdf_async', kwargs={'pk': self.invoice.pk}))
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+        
+        call_command('run_jobs', once=True, stdout=StringIO())
+        data = self.client.get(status_url).json()
+        self.assertEqual(data['status'], 'done')
+        
+        with mock.patch('invoices.pdf.html_to_pdf') as render:
+            response = self.client.get(data['result_url'], follow=True)
+        render.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('attachment', response['Content-Disposition'])
+    
+    def test_result_before_done(self):
+        """Test asking for the result of an unfinished job returns 409"""
+        job = jobs.enqueue('test_flaky', {'fail_times': 0})
+        response = self.client.get(reverse('job_result', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 409)
+    
+    def test_async_pdf_requires_post(self):
+        """Test the enqueue endpoint rejects GET"""
+        response = self.client.get(reverse('invoice_pdf_async', kwargs={'pk': self.invoice.pk}))
+        self.assertEqual(response.status_code, 405)
+
+
+class JobHeartbeatTest(TransactionTestCase):
+    """Test cases for the heartbeat of running jobs"""
+    
+    def test_heartbeat_keeps_long_job(self):
+        """Test a job running past the stale timeout isn't handed to another worker"""
+        def slow():
+            time.sleep(0.5)
+            return {'requeued': jobs.requeue_stale(timeout=0.2)}
+        
+        jobs.HANDLERS['test_slow'] = slow
+        self.addCleanup(jobs.HANDLERS.pop, 'test_slow')
+        jobs.enqueue('test_slow', {})
+        job = jobs.run(jobs.claim(), heartbeat=0.05)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.result, {'requeued': 0})
+
+
+class InvoiceBulkPdfExportTest(TestCase):
+    """Test cases for the streamed ZIP export of invoice PDFs"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = override_settings(INVOICES_PDF_CACHE_DIR=self.cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        for n, status in enumerate(['draft', 'sent', 'sent'], start=1):
+            invoice = Invoice.objects.create(
+                invoice_number=f"INV/00{n}",
+                company=company,
+                customer=customer,
+                date_due=date.today() + timedelta(days=30),
+                status=status
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice,
+                description="Test Item",
+                quantity=1,
+                unit_price=Decimal('10.00')
+            )
+    
+    def export(self, **params):
+        response = self.client.get(reverse('invoice_export_pdfs'), params)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        return archive
+    
+    @override_settings(INVOICES_EXPORT_WORKERS=0)
+    async def test_export_streams_under_asgi(self):
+        """Test ASGI requests get the ZIP as an async body, not a buffered one"""
+        response = await self.async_client.get(reverse('invoice_export_pdfs'))
+        self.assertTrue(response.is_async)
+        archive = zipfile.ZipFile(BytesIO(b''.join([chunk async for chunk in response.streaming_content])))
+        self.assertEqual(len(archive.namelist()), 3)
+    
+    @override_settings(INVOICES_EXPORT_WORKERS=0)
+    def test_export_respects_filters(self):
+        """Test only invoices matching the list filters are exported"""
+        archive = self.export(status='sent')
+        self.assertEqual(archive.namelist(), ['Invoice_INV_003.pdf', 'Invoice_INV_002.pdf'])
+        for name in archive.namelist():
+            self.assertTrue(archive.read(name).startswith(b'%PDF'))
+    
+    @override_settings(INVOICES_EXPORT_WORKERS=2)
+    def test_export_with_process_pool(self):
+        """Test rendering across worker processes yields every invoice"""
+        archive = self.export()
+        self.assertEqual(len(archive.namelist()), 3)
+        self.assertIsNone(archive.testzip())
+    
+    @override_settings(INVOICES_EXPORT_WORKERS=0)
+    def test_export_names_are_unique(self):
+        """Test invoice numbers that sanitize alike get distinct entries"""
+        invoice = Invoice.objects.get(invoice_number='INV/001')
+        twin = Invoice.objects.create(
+            invoice_number='INV_001', company=invoice.company, customer=invoice.customer,
+            date_due=invoice.date_due, status='draft',
+        )
+        first, second = self.export(status='draft').namelist()
+        self.assertEqual(first, 'Invoice_INV_001.pdf')
+        self.assertIn(second, [f'Invoice_INV_001_{pk}.pdf' for pk in (invoice.pk, twin.pk)])
+    
+    def test_export_names_with_pk_stay_unique(self):
+        """Test a name with the pk added is checked against the names taken too"""
+        taken = set()
+        for number, pk in [('INV_1_2', 5), ('INV_1', 1), ('INV/1', 2)]:
+            taken.add(exports.pdf_filename(Invoice(pk=pk, invoice_number=number), taken))
+        self.assertEqual(taken, {'Invoice_INV_1_2.pdf', 'Invoice_INV_1.pdf', 'Invoice_INV_1_2_2.pdf'})
+    
+    def test_exports_share_one_spawned_pool(self):
+        """Test concurrent exports render on one pool of spawned processes"""
+        with mock.patch('invoices.exports._spawn_pool', wraps=exports._spawn_pool) as spawn_pool:
+            exports._discard_executor(exports.export_executor())
+            self.addCleanup(lambda: exports._discard_executor(exports.export_executor()))
+            first = exports.iter_invoice_pdfs(Invoice.objects.all())
+            second = exports.iter_invoice_pdfs(Invoice.objects.all())
+            next(first), next(second)
+            self.assertEqual(len(list(first)) + len(list(second)), 4)
+        spawn_pool.assert_called_once()
+        self.assertEqual(exports.export_executor()._mp_context.get_start_method(), 'spawn')
+    
+    @override_settings(INVOICES_EXPORT_WORKERS=2)
+    def test_export_workers_do_not_report_parent_metrics(self):
+        """Test render workers leave the shared metrics to the parent process"""
+        metrics.registry.values.clear()
+        with tempfile.TemporaryDirectory() as tmp, override_settings(INVOICES_METRICS_DIR=tmp):
+            for _ in range(5):
+                metrics.registry.inc('invoices_http_requests_total', {'view': 'x', 'method': 'GET', 'status': 200})
+            list(exports.iter_invoice_pdfs(Invoice.objects.all()))
+            totals = metrics.collect()
+        self.assertEqual(totals[('invoices_http_requests_total', (('method', 'GET'), ('status', 200), ('view', 'x')))], 5)
+        self.assertEqual(totals[('invoices_pdf_render_duration_seconds', (('outcome', 'ok'),))][-1], 3)
+    
+    @override_settings(INVOICES_EXPORT_WORKERS=0)
+    def test_export_reports_render_errors(self):
+        """Test invoices that fail to render are listed in errors.txt"""
+        with mock.patch('invoices.exports.html_to_pdf', return_value=None):
+            archive = self.export(search='INV/001')
+        self.assertEqual(archive.namelist(), ['errors.txt'])
+        self.assertIn('Invoice_INV_001.pdf', archive.read('errors.txt').decode())
+    
+    def test_export_command(self):
+        """Test the management command writes the same archive to disk"""
+        output = os.path.join(self.cache_dir.name, 'out.zip')
+        call_command('export_invoice_pdfs', output, status='draft', workers=0, stdout=StringIO())
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(archive.namelist(), ['Invoice_INV_001.pdf'])
+
+
+class InvoiceTabularExportTest(TestCase):
+    """Test cases for the streamed CSV/JSONL exports"""
+    
+    def setUp(self):
+        company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.paid = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=company,
+            customer=customer,
+            date_due=date.today() + timedelta(days=30),
+            status='paid',
+            shipping_amount=Decimal('5.00')
+        )
+        InvoiceItem.objects.create(invoice=self.paid, description="Widget", quantity=3, unit_price=Decimal('2.50'))
+        InvoiceItem.objects.create(invoice=self.paid, description="Gadget", quantity=1, unit_price=Decimal('10.00'))
+        draft = Invoice.objects.create(
+            invoice_number="INV-002",
+            company=company,
+            customer=customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        InvoiceItem.objects.create(invoice=draft, description="Other", quantity=1, unit_price=Decimal('1.00'))
+    
+    def export(self, dataset, fmt, **params):
+        response = self.client.get(
+            reverse('invoice_export', kwargs={'dataset': dataset, 'fmt': fmt}), params
+        )
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+    
+    async def test_streams_under_asgi(self):
+        """Test ASGI requests get an async body instead of a buffered one"""
+        response = await self.async_client.get(
+            reverse('invoice_export', kwargs={'dataset': 'invoices', 'fmt': 'csv'})
+        )
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(list(csv.DictReader(StringIO(body)))), 2)
+    
+    def test_invoices_csv(self):
+        """Test invoice CSV rows carry SQL-side totals and honour filters"""
+        rows = list(csv.DictReader(StringIO(self.export('invoices', 'csv', status='paid'))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['invoice_number'], 'INV-001')
+        self.assertEqual(rows[0]['customer'], 'John Doe')
+        self.assertEqual(rows[0]['subtotal'], '17.50')
+        self.assertEqual(rows[0]['total'], '22.50')
+    
+    def test_items_jsonl(self):
+        """Test item JSONL lines carry the line total for filtered invoices"""
+        lines = self.export('items', 'jsonl', search='INV-001').splitlines()
+        items = [json.loads(line) for line in lines]
+        self.assertEqual([item['description'] for item in items], ['Widget', 'Gadget'])
+        self.assertEqual(Decimal(items[0]['line_total']), Decimal('7.50'))
+        self.assertEqual(items[0]['invoice_number'], 'INV-001')
+    
+    def test_export_query_count(self):
+        """Test an export runs one query however many invoices match"""
+        with self.assertNumQueries(1):
+            self.export('items', 'csv')
+        with self.assertNumQueries(1):
+            self.export('invoices', 'jsonl')
+    
+    def test_unknown_export(self):
+        """Test unknown datasets or formats return 404"""
+        response = self.client.get(reverse('invoice_export', kwargs={'dataset': 'customers', 'fmt': 'csv'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ImportInvoicesCommandTest(TestCase):
+    """Test cases for the bulk import command"""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+    
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', newline='') as f:
+            f.write(content)
+        return path
+    
+    def run_import(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_invoices', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+    
+    def test_import_csv(self):
+        """Test CSV rows are grouped into invoices with items and totals"""
+        path = self.write('invoices.csv', (
+            "invoice_number,company,customer,customer_email,date_created,date_due,status,"
+            "discount_amount,shipping_amount,description,quantity,unit_price\n"
+            "INV-1,Test Company,Acme,a@acme.com,2026-01-05,2026-02-05,sent,5.00,0,Widget,2,10.00\n"
+            "INV-1,Test Company,Acme,a@acme.com,2026-01-05,2026-02-05,sent,5.00,0,Gadget,1,3.50\n"
+            "INV-2,New Co,Acme,a@acme.com,2026-01-06,2026-02-06,draft,0,0,Widget,1,10.00\n"
+        ))
+        out, err = self.run_import(path)
+        self.assertIn('Imported 2 invoices and 3 items', out)
+        self.assertEqual(err, '')
+        
+        invoice = Invoice.objects.get(invoice_number='INV-1')
+        self.assertEqual(invoice.company, self.company)
+        self.assertEqual(invoice.customer.email, 'a@acme.com')
+        self.assertEqual(invoice.date_created, date(2026, 1, 5))
+        self.assertEqual(invoice.items.count(), 2)
+        self.assertEqual(invoice.subtotal, Decimal('23.50'))
+        self.assertEqual(invoice.total, Decimal('18.50'))
+        self.assertEqual(Customer.objects.filter(name='Acme').count(), 1)
+        self.assertTrue(Company.objects.filter(name='New Co').exists())
+    
+    def test_import_jsonl_with_validation_errors(self):
+        """Test invalid and duplicate records are skipped and reported"""
+        records = [
+            {'invoice_number': 'INV-1', 'company': 'Test Company', 'customer': {'name': 'Acme'},
+             'date_due': '2026-02-05', 'items': [{'description': 'Widget', 'quantity': 2, 'unit_price': '1.00'}]},
+            {'invoice_number': 'INV-2', 'company': 'Test Company', 'customer': 'Acme',
+             'date_due': '2026-02-05', 'items': [{'description': 'Free', 'quantity': 0, 'unit_price': '1.00'}]},
+            {'invoice_number': 'INV-1', 'company': 'Test Company', 'customer': 'Acme', 'date_due': '2026-02-05'},
+            {'invoice_number': 'INV-3', 'company': 'Test Company', 'customer': 'Acme',
+             'date_due': '2026-02-05', 'discount_amount': '-1'},
+        ]
+        path = self.write('invoices.jsonl', '\n'.join(json.dumps(r) for r in records) + '\nnot json\n')
+        out, err = self.run_import(path, chunk_size=2)
+        self.assertIn('Imported 1 invoices and 1 items', out)
+        self.assertIn('skipped 4', out)
+        self.assertIn('line 2: quantity', err)
+        self.assertIn("line 3: invoice_number 'INV-1' already exists", err)
+        self.assertIn('line 4: discount_amount', err)
+        self.assertIn('line 5: invalid JSON', err)
+        self.assertEqual(Invoice.objects.get().total, Decimal('2.00'))
+    
+    def test_import_aborts_after_max_errors(self):
+        """Test the import stops once too many records are rejected"""
+        path = self.write('bad.jsonl', '{}\n{}\n{}\n')
+        with self.assertRaises(CommandError):
+            self.run_import(path, max_errors=2)
+    
+    def test_imported_invoices_are_searchable(self):
+        """Test bulk-inserted invoices reach the search index"""
+        path = self.write('invoices.jsonl', json.dumps({
+            'invoice_number': 'BULK-9', 'company': 'Test Company', 'customer': 'Initech',
+            'date_due': '2026-02-05',
+        }))
+        self.run_import(path)
+        response = self.client.get(reverse('invoice_list'), {'search': 'initech'})
+        self.assertContains(response, 'BULK-9')
+
+
+class GenerateDataCommandTest(TestCase):
+    """Test cases for the synthetic data generator"""
+    
+    def snapshot(self):
+        return list(
+            Invoice.objects.order_by('invoice_number').values_list(
+                'invoice_number', 'company__name', 'customer__name', 'date_created',
+                'status', 'subtotal', 'total'
+            )
+        ), list(
+            InvoiceItem.objects.order_by('invoice__invoice_number', 'id').values_list(
+                'description', 'quantity', 'unit_price'
+            )
+        )
+    
+    def generate(self, **options):
+        options = {
+            'seed': 7, 'companies': 2, 'customers': 5, 'invoices': 25,
+            'end_date': date(2026, 6, 30), 'batch_size': 10, **options
+        }
+        call_command('generate_data', stdout=StringIO(), **options)
+    
+    def test_counts_and_totals(self):
+        """Test the requested volumes are created with consistent totals"""
+        self.generate(items='2-4')
+        self.assertEqual(Company.objects.count(), 2)
+        self.assertEqual(Customer.objects.count(), 5)
+        self.assertEqual(Invoice.objects.count(), 25)
+        counts = Invoice.objects.annotate(n=Count('items')).values_list('n', flat=True)
+        self.assertTrue(all(2 <= n <= 4 for n in counts))
+        for invoice in Invoice.objects.with_computed_totals():
+            self.assertEqual(invoice.total, Decimal(invoice.computed_total).quantize(Decimal('0.01')))
+    
+    def test_same_seed_same_data(self):
+        """Test a seed reproduces the same dataset, independent of batching"""
+        self.generate()
+        first = self.snapshot()
+        Invoice.objects.all().delete()
+        Company.objects.all().delete()
+        Customer.objects.all().delete()
+        self.generate(batch_size=10)
+        self.assertEqual(self.snapshot(), first)
+        Invoice.objects.all().delete()
+        self.generate(seed=8)
+        self.assertNotEqual(self.snapshot(), first)
+    
+    def test_status_mix_and_date_spread(self):
+        """Test statuses follow the weights and dates stay in the window"""
+        self.generate(status_mix='paid=1,cancelled=0', days=10)
+        self.assertEqual(set(Invoice.objects.values_list('status', flat=True)), {'paid'})
+        dates = Invoice.objects.values_list('date_created', flat=True)
+        self.assertTrue(all(date(2026, 6, 21) <= d <= date(2026, 6, 30) for d in dates))
+    
+    def test_invalid_options(self):
+        """Test malformed distributions and empty pools are rejected"""
+        with self.assertRaises(CommandError):
+            self.generate(status_mix='overdue=1')
+        with self.assertRaises(CommandError):
+            self.generate(items='5-1')
+        for options in [{'companies': 0}, {'customers': 0}, {'days': 0}, {'invoices': -1}]:
+            with self.assertRaises(CommandError):
+                self.generate(**options)
+        self.assertFalse(Company.objects.exists())
+
+
+class ViewBenchmarkTest(TestCase):
+    """Test cases for the view benchmark harness"""
+    
+    def result(self, queries=5, p95_ms=10.0, status=200):
+        return {'views': {'invoice_list': {
+            'status': status, 'queries': queries, 'p50_ms': p95_ms / 2, 'p95_ms': p95_ms,
+        }}}
+    
+    def test_percentile(self):
+        """Test the nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 95), 95)
+        self.assertEqual(benchmark.percentile([3.0], 95), 3.0)
+    
+    def test_compare_against_baseline(self):
+        """Test extra queries, slow views and new errors break the budget"""
+        limits = {'latency_ratio': 1.5, 'latency_slack_ms': 5.0, 'queries': 0}
+        baseline = self.result()
+        self.assertEqual(benchmark.compare(self.result(p95_ms=14.0), baseline, limits), [])
+        self.assertEqual(len(benchmark.compare(self.result(queries=6), baseline, limits)), 1)
+        self.assertEqual(len(benchmark.compare(self.result(p95_ms=16.0), baseline, limits)), 1)
+        self.assertEqual(len(benchmark.compare(self.result(status=500), baseline, limits)), 1)
+        self.assertEqual(benchmark.compare(self.result(queries=9), {'views': {}}, limits), [])
+    
+    def test_baseline_file_keeps_other_scales(self):
+        """Test saving one scale's baseline leaves the others in place"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'benchmarks', 'baseline.json')
+            self.assertIsNone(benchmark.load_baseline(path, '1k'))
+            benchmark.save_baseline(path, {'scale': '1k', 'views': {}})
+            benchmark.save_baseline(path, {'scale': '100k', 'views': {'a': {}}})
+            self.assertEqual(benchmark.load_baseline(path, '1k'), {'scale': '1k', 'views': {}})
+            with open(path) as f:
+                self.assertIn('100k', json.load(f))
+    
+    def test_seed_refuses_other_datasets(self):
+        """Test seeding over rows from another dataset fails before writing"""
+        call_command(
+            'generate_data', companies=1, customers=1, invoices=3, items='1', stdout=StringIO()
+        )
+        with self.assertRaises(ValueError):
+            benchmark.seed('1k')
+        self.assertEqual(Invoice.objects.count(), 3)
+    
+    def test_query_counts_do_not_grow_with_rows(self):
+        """Test the benchmarked views run a constant number of queries"""
+        call_command(
+            'generate_data', companies=2, customers=5, invoices=10, items='1',
+            stdout=StringIO()
+        )
+        small = benchmark.run('tiny', repeat=1)['views']
+        call_command(
+            'generate_data', seed=1, companies=2, customers=5, invoices=30, items='6',
+            stdout=StringIO()
+        )
+        large = benchmark.run('tiny', repeat=1)['views']
+        for name, result in small.items():
+            self.assertEqual(result['status'], 200, name)
+            self.assertEqual(large[name]['queries'], result['queries'], name)
+
+
+@skipUnless(os.environ.get('INVOICES_BENCHMARK_SCALE'), "set INVOICES_BENCHMARK_SCALE to run")
+class ViewBenchmarkSuiteTest(TestCase):
+    """Opt-in benchmark run, e.g. INVOICES_BENCHMARK_SCALE=100k manage.py test invoices"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.scale = os.environ['INVOICES_BENCHMARK_SCALE']
+        benchmark.seed(cls.scale)
+    
+    def test_within_budget(self):
+        """Test every view stays within the budget of the stored baseline"""
+        repeat = int(os.environ.get('INVOICES_BENCHMARK_REPEAT', 20))
+        results = benchmark.run(self.scale, repeat=repeat)
+        if os.environ.get('INVOICES_BENCHMARK_OUTPUT'):
+            with open(os.environ['INVOICES_BENCHMARK_OUTPUT'], 'w') as f:
+                json.dump(results, f, indent=2)
+        baseline = benchmark.load_baseline(settings.INVOICES_BENCHMARK_BASELINE, self.scale)
+        if baseline is None:
+            self.skipTest(f"no {self.scale} baseline stored")
+        self.assertEqual(benchmark.compare(results, baseline), [])
+
+
+class MetricsTest(TestCase):
+    """Test cases for the request metrics middleware and /metrics"""
+    
+    def setUp(self):
+        metrics.registry.values.clear()
+        self.client = Client()
+        company = Company.objects.create(name="Metrics Co")
+        customer = Customer.objects.create(name="Metrics Customer")
+        self.invoice = Invoice.objects.create(
+            invoice_number="MET-001", company=company, customer=customer,
+            date_due=date.today()
+        )
+        InvoiceItem.objects.create(
+            invoice=self.invoice, description="Item", quantity=1, unit_price=Decimal('5.00')
+        )
+    
+    def test_records_per_view(self):
+        """Test requests are counted per URL name with their queries and size"""
+        self.client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        self.client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        self.client.get('/no-such-page/')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn(
+            'invoices_http_requests_total{method="GET",status="200",view="invoice_detail"} 2',
+            body
+        )
+        self.assertIn('view="<unresolved>"', body)
+        self.assertIn('invoices_http_request_duration_seconds_count{view="invoice_detail"} 2', body)
+        self.assertIn('invoices_http_request_duration_seconds_bucket{view="invoice_detail",le="+Inf"} 2', body)
+        self.assertIn('invoices_http_response_size_bytes_count{view="invoice_detail"} 2', body)
+        series = metrics.registry.values[('invoices_http_db_queries', (('view', 'invoice_detail'),))]
+        self.assertEqual(series[-1], 2)
+        self.assertGreater(series[-2], 0)
+    
+    def test_overlapping_async_requests(self):
+        """Test concurrent async requests only count their own queries"""
+        both_started = asyncio.Barrier(2)
+        
+        async def view(request):
+            await both_started.wait()
+            await sync_to_async(Company.objects.count)()
+            await both_started.wait()
+            return HttpResponse('ok')
+        
+        middleware = metrics.MetricsMiddleware(view)
+        
+        async def serve():
+            await asyncio.gather(
+                middleware(RequestFactory().get('/a/')), middleware(RequestFactory().get('/b/'))
+            )
+        
+        async_to_sync(serve)()
+        series = metrics.registry.values[('invoices_http_db_queries', (('view', '<unresolved>'),))]
+        self.assertEqual(series[-1], 2)
+        self.assertEqual(series[-2], 2)
+    
+    def test_pdf_render_histogram(self):
+        """Test the xhtml2pdf step is timed"""
+        with tempfile.TemporaryDirectory() as cache, override_settings(INVOICES_PDF_CACHE_DIR=cache):
+            self.client.get(reverse('invoice_pdf', args=[self.invoice.pk]))
+        body = metrics.exposition()
+        self.assertIn('invoices_pdf_render_duration_seconds_count{outcome="ok"} 1', body)
+    
+    def test_aggregates_across_processes(self):
+        """Test the totals of every process sharing the metrics directory are summed"""
+        with tempfile.TemporaryDirectory() as tmp, override_settings(INVOICES_METRICS_DIR=tmp):
+            metrics.registry.inc('invoices_http_requests_total', {'view': 'x', 'method': 'GET', 'status': 200})
+            metrics.registry.observe('invoices_http_db_queries', {'view': 'x'}, 3)
+            other = [
+                ['invoices_http_requests_total', [['method', 'GET'], ['status', 200], ['view', 'x']], 4],
+                ['invoices_http_db_queries', [['view', 'x']], [0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 7, 1]],
+            ]
+            with open(os.path.join(tmp, '999999.json'), 'w') as f:
+                json.dump(other, f)
+            body = metrics.exposition()
+            self.assertTrue(os.path.exists(os.path.join(tmp, f'{os.getpid()}.json')))
+        self.assertIn('invoices_http_requests_total{method="GET",status="200",view="x"} 5', body)
+        self.assertIn('invoices_http_db_queries_bucket{view="x",le="5"} 2', body)
+        self.assertIn('invoices_http_db_queries_sum{view="x"} 10', body)
+        self.assertIn('invoices_http_db_queries_count{view="x"} 2', body)
+
+
+class InvoiceAdminScalingTest(TestCase):
+    """Test cases for the admin changelists on large tables"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin', 'a@example.com', 'pw'))
+        self.company = Company.objects.create(name="Admin Co")
+        self.customer = Customer.objects.create(name="Admin Customer")
+        self.invoice = self.add_invoices(1)[0]
+    
+    def add_invoices(self, count):
+        invoices = []
+        for n in range(count):
+            invoice = Invoice.objects.create(
+                invoice_number=f"ADM-{Invoice.objects.count():04d}", company=self.company,
+                customer=Customer.objects.create(name=f"Customer {n}"), date_due=date.today()
+            )
+            for _ in range(3):
+                InvoiceItem.objects.create(
+                    invoice=invoice, description="Item", quantity=2, unit_price=Decimal('1.50')
+                )
+            invoices.append(invoice)
+        return invoices
+    
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+    
+    def test_changelist_queries_do_not_grow(self):
+        """Test the invoice and item changelists run a fixed number of queries"""
+        urls = [
+            reverse('admin:invoices_invoice_changelist'),
+            reverse('admin:invoices_invoice_changelist') + '?status__exact=draft',
+            reverse('admin:invoices_invoiceitem_changelist'),
+            reverse('admin:invoices_invoice_change', args=[self.invoice.pk]),
+        ]
+        for url in urls:
+            # Warm the per-process caches (content types) first
+            self.client.get(url)
+        before = [self.count_queries(url) for url in urls]
+        self.add_invoices(5)
+        for _ in range(4):
+            InvoiceItem.objects.create(
+                invoice=self.invoice, description="More", quantity=1, unit_price=Decimal('1.00')
+            )
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+    
+    def test_changelist_shows_totals(self):
+        """Test stored invoice totals and SQL line totals are listed"""
+        response = self.client.get(reverse('admin:invoices_invoice_changelist'))
+        self.assertIn('<td class="field-total">9.00</td>', response.content.decode())
+        response = self.client.get(reverse('admin:invoices_invoiceitem_changelist'))
+        self.assertIn('<td class="field-line_total">3.00</td>', response.content.decode())
+    
+    def test_date_hierarchy(self):
+        """Test the changelist can be narrowed by creation date"""
+        today = date.today()
+        url = reverse('admin:invoices_invoice_changelist')
+        response = self.client.get(url, {
+            'date_created__year': today.year, 'date_created__month': today.month
+        })
+        self.assertContains(response, self.invoice.invoice_number)
+    
+    def test_search_uses_the_invoice_index(self):
+        """Test the changelist search matches word prefixes through search_invoices"""
+        url = reverse('admin:invoices_invoice_changelist')
+        with mock.patch('invoices.admin.filter_invoices', wraps=filter_invoices) as search:
+            response = self.client.get(url, {'q': 'Custom'})
+        search.assert_called_once()
+        self.assertContains(response, self.invoice.invoice_number)
+        # A match inside a word is not a prefix match
+        response = self.client.get(url, {'q': 'ustomer'})
+        self.assertNotContains(response, self.invoice.invoice_number)
+    
+    def test_estimated_count_falls_back_to_exact(self):
+        """Test the paginator counts exactly where no estimate is available"""
+        paginator = EstimatedCountPaginator(Invoice.objects.order_by('pk'), 10)
+        self.assertEqual(paginator.count, 1)
+
+
+class RevenueRollupTest(TestCase):
+    """Test cases for the revenue rollups and the dashboard reading them"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.company = Company.objects.create(name="Rollup Co")
+        self.customer = Customer.objects.create(name="Rollup Customer")
+    
+    def create_invoice(self, number, status='sent', **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(
+                invoice_number=number, company=self.company, customer=self.customer,
+                date_due=date.today(), status=status, **kwargs
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice, description="Item", quantity=2, unit_price=Decimal('10.00')
+            )
+        return invoice
+    
+    def rollup(self, status):
+        return RevenueRollup.objects.get(
+            day=date.today(), company=self.company, status=status
+        )
+    
+    def snapshot(self):
+        return sorted(
+            RevenueRollup.objects.values_list(
+                'day', 'company_id', 'status', 'invoice_count', 'subtotal', 'total'
+            )
+        )
+    
+    def test_items_and_invoices_update_their_bucket(self):
+        """Test item and invoice edits are reflected in the bucket"""
+        invoice = self.create_invoice("ROLL-001", shipping_amount=Decimal('5.00'))
+        self.create_invoice("ROLL-002")
+        rollup = self.rollup('sent')
+        self.assertEqual(rollup.invoice_count, 2)
+        self.assertEqual(rollup.subtotal, Decimal('40.00'))
+        self.assertEqual(rollup.shipping, Decimal('5.00'))
+        self.assertEqual(rollup.total, Decimal('45.00'))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.items.first().delete()
+        self.assertEqual(self.rollup('sent').total, Decimal('25.00'))
+    
+    def test_status_change_moves_between_buckets(self):
+        """Test an invoice leaving a bucket is removed from it"""
+        invoice = self.create_invoice("ROLL-003")
+        invoice.status = 'paid'
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.save()
+        self.assertFalse(RevenueRollup.objects.filter(status='sent').exists())
+        self.assertEqual(self.rollup('paid').invoice_count, 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.delete()
+        self.assertFalse(RevenueRollup.objects.exists())
+    
+    def test_refresh_waits_for_commit_and_runs_once(self):
+        """Test a transaction's saves re-aggregate their buckets once, after it commits"""
+        with mock.patch('invoices.rollups.refresh', wraps=rollups.refresh) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                invoice = Invoice.objects.create(
+                    invoice_number="ROLL-008", company=self.company, customer=self.customer,
+                    date_due=date.today(), status='sent'
+                )
+                for quantity in (1, 2):
+                    InvoiceItem.objects.create(
+                        invoice=invoice, description="Item", quantity=quantity,
+                        unit_price=Decimal('10.00')
+                    )
+                refresh.assert_not_called()
+            refresh.assert_called_once()
+            self.assertEqual(self.rollup('sent').total, Decimal('30.00'))
+            
+            refresh.reset_mock()
+            invoice.notes = "Thanks"
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                invoice.save()
+            self.assertEqual(callbacks, [])
+            refresh.assert_not_called()
+    
+    def test_rebuild_matches_incremental(self):
+        """Test rebuild_rollups reproduces the incrementally kept rows"""
+        self.create_invoice("ROLL-004")
+        self.create_invoice("ROLL-005", status='paid')
+        incremental = self.snapshot()
+        # Writes through update() skip the signals
+        Invoice.objects.filter(invoice_number="ROLL-005").update(status='draft')
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertNotEqual(self.snapshot(), incremental)
+        self.assertEqual(self.rollup('draft').invoice_count, 1)
+        RevenueRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(len(self.snapshot()), 2)
+    
+    def test_bulk_loaders_refresh_rollups(self):
+        """Test imported and generated invoices reach the rollups"""
+        call_command(
+            'generate_data', companies=2, customers=3, invoices=20, stdout=StringIO()
+        )
+        generated = self.snapshot()
+        self.assertEqual(sum(row[3] for row in generated), 20)
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.snapshot(), generated)
+        
+        record = {
+            'invoice_number': 'IMP-ROLL', 'company': 'Rollup Co', 'customer': 'Rollup Customer',
+            'date_due': '2026-01-31', 'date_created': '2026-01-01', 'status': 'paid',
+            'items': [{'description': 'A', 'quantity': 3, 'unit_price': '2.00'}],
+        }
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            call_command('import_invoices', f.name, stdout=StringIO())
+        rollup = RevenueRollup.objects.get(day=date(2026, 1, 1), company=self.company)
+        self.assertEqual(rollup.total, Decimal('6.00'))
+    
+    def test_importer_refreshes_rollups_once(self):
+        """Test a chunked import re-aggregates the touched days once, at the end"""
+        records = [
+            (n, {'invoice_number': f'IMP-{n}', 'company': 'Rollup Co', 'customer': 'Rollup Customer',
+                 'date_due': '2026-01-31', 'date_created': f'2026-01-0{n}',
+                 'items': [{'description': 'A', 'quantity': 1, 'unit_price': '2.00'}]})
+            for n in range(1, 4)
+        ]
+        with mock.patch('invoices.rollups.refresh_days', wraps=rollups.refresh_days) as refresh_days:
+            InvoiceImporter(chunk_size=1).run(records)
+        refresh_days.assert_called_once()
+        self.assertEqual(
+            RevenueRollup.objects.filter(company=self.company, day__month=1).count(), 3
+        )
+    
+    def test_json_report(self):
+        """Test the JSON endpoint groups the rollups"""
+        self.create_invoice("ROLL-006")
+        self.create_invoice("ROLL-007", status='paid')
+        response = self.client.get(reverse('revenue_report_json'), {'group': 'status'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['label'] for row in data['rows']], ['Paid', 'Sent'])
+        self.assertEqual(Decimal(data['totals']['total']), Decimal('40.00'))
+        self.assertEqual(data['totals']['invoice_count'], 2)
+        
+        response = self.client.get(reverse('revenue_report_json'), {'status': 'paid'})
+        rows = response.json()['rows']
+        self.assertEqual(rows[0]['label'], date.today().strftime('%Y-%m'))
+        self.assertEqual(Decimal(rows[0]['total']), Decimal('20.00'))
+    
+    def test_report_reads_only_rollups(self):
+        """Test the dashboard's queries don't depend on invoice volume"""
+        self.create_invoice("ROLL-008")
+        url = reverse('revenue_dashboard')
+        with CaptureQueriesContext(connection) as before:
+            response = self.client.get(url, {'group': 'company'})
+        self.assertContains(response, "Rollup Co")
+        for n in range(5):
+            self.create_invoice(f"ROLL-1{n:02d}", status='paid')
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url, {'group': 'company'})
+        self.assertEqual(len(after), len(before))
+        self.assertFalse(any(
+            'invoices_invoice"' in query['sql'] for query in after.captured_queries
+        ))
+    
+    def test_invalid_filters(self):
+        """Test malformed report filters are rejected"""
+        response = self.client.get(reverse('revenue_report_json'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('start', response.json()['errors'])
+        response = self.client.get(reverse('revenue_dashboard'), {'group': 'hour'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AgingReportTest(TestCase):
+    """Test cases for the accounts-receivable aging report"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.as_of = date(2026, 6, 30)
+        company = Company.objects.create(name="Aging Co")
+        self.alice = Customer.objects.create(name="Alice")
+        self.bob = Customer.objects.create(name="Bob")
+        # (customer, days past due, status, shipping = the invoice total)
+        for n, (customer, days, status, amount) in enumerate([
+            (self.alice, -5, 'sent', '10.00'),
+            (self.alice, 0, 'sent', '20.00'),
+            (self.alice, 30, 'sent', '30.00'),
+            (self.alice, 31, 'sent', '40.00'),
+            (self.bob, 90, 'sent', '50.00'),
+            (self.bob, 91, 'sent', '60.00'),
+            (self.bob, 200, 'paid', '70.00'),
+            (self.bob, 10, 'draft', '80.00'),
+        ]):
+            Invoice.objects.create(
+                invoice_number=f"AGE-{n}", company=company, customer=customer,
+                date_due=self.as_of - timedelta(days=days), status=status,
+                shipping_amount=Decimal(amount)
+            )
+    
+    def test_buckets_per_customer(self):
+        """Test sent invoices land in the right bucket for their days past due"""
+        rows = {row['customer_id']: row for row in aging.aging_by_customer(self.as_of)}
+        self.assertEqual(set(rows), {self.alice.pk, self.bob.pk})
+        alice, bob = rows[self.alice.pk], rows[self.bob.pk]
+        self.assertEqual(alice['invoice_count'], 4)
+        self.assertEqual(Decimal(alice['current']), Decimal('10.00'))
+        self.assertEqual(Decimal(alice['days_0_30']), Decimal('50.00'))
+        self.assertEqual(Decimal(alice['days_31_60']), Decimal('40.00'))
+        self.assertEqual(Decimal(alice['outstanding']), Decimal('100.00'))
+        self.assertEqual(Decimal(bob['days_61_90']), Decimal('50.00'))
+        self.assertEqual(Decimal(bob['days_over_90']), Decimal('60.00'))
+        self.assertEqual(Decimal(bob['outstanding']), Decimal('110.00'))
+        # Largest balance first
+        self.assertEqual(list(rows), [self.bob.pk, self.alice.pk])
+        
+        totals = aging.aging_totals(self.as_of)
+        self.assertEqual(totals['invoice_count'], 6)
+        self.assertEqual(Decimal(totals['outstanding']), Decimal('210.00'))
+    
+    def test_report_view(self):
+        """Test the report page lists customers with their bucket totals"""
+        response = self.client.get(reverse('aging_report'), {'as_of': '2026-06-30'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Alice')
+        self.assertContains(response, '$210.00')
+        response = self.client.get(reverse('aging_report'), {'as_of': 'soon'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_csv(self):
+        """Test the CSV covers every customer with SQL-side totals"""
+        response = self.client.get(reverse('aging_report_csv'), {'as_of': '2026-06-30'})
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], [
+            'customer_id', 'customer', 'invoices', 'current', 'days_0_30',
+            'days_31_60', 'days_61_90', 'days_over_90', 'outstanding',
+        ])
+        self.assertEqual(rows[1][1:], ['Bob', '2', '0.00', '0.00', '0.00', '50.00', '60.00', '110.00'])
+        self.assertEqual(rows[2][1:], ['Alice', '4', '10.00', '50.00', '40.00', '0.00', '0.00', '100.00'])
+    
+    def test_open_invoice_index(self):
+        """Test the partial index behind the report exists"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, 'invoices_invoice')
+        self.assertIn('invoices_inv_open_due_idx', constraints)
+
+
+class QueryPlanTest(TestCase):
+    """EXPLAIN-based regression checks for the key queries"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', companies=5, customers=200, invoices=2000, items='1',
+            end_date=date(2026, 6, 30), stdout=StringIO()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+    
+    def test_key_queries_use_indexes(self):
+        """Test no key query scans a large table or sorts"""
+        for name, plan, problems in query_plans.check():
+            with self.subTest(name):
+                self.assertEqual(problems, set(), plan)
+    
+    def test_detects_scans_and_sorts(self):
+        """Test the harness flags unindexed filters and orderings"""
+        self.assertEqual(
+            query_plans.plan_problems(Invoice.objects.filter(notes='x')),
+            {'scan:invoices_invoice'}
+        )
+        self.assertIn('sort', query_plans.plan_problems(Invoice.objects.order_by('notes')[:10]))
+    
+    def test_command(self):
+        """Test check_query_plans passes on the indexed schema"""
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('invoice_list: ok', out.getvalue())
+
+
+@override_settings(INVOICES_PAGE_SIZE=2)
+class AsyncViewsTest(TestCase):
+    """Test cases for the async list, detail and PDF views"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = override_settings(INVOICES_PDF_CACHE_DIR=self.cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.registry.values.clear()
+        
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        for n in range(1, 4):
+            self.invoice = Invoice.objects.create(
+                invoice_number=f"INV-00{n}",
+                company=self.company,
+                customer=self.customer,
+                date_due=date.today() + timedelta(days=30)
+            )
+        InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Test Item",
+            quantity=2,
+            unit_price=Decimal('50.00')
+        )
+    
+    async def test_list_pages_under_asgi(self):
+        """Test the list view pages through the async ORM"""
+        url = reverse('invoice_list')
+        first = await self.async_client.get(url)
+        self.assertEqual(first.status_code, 200)
+        page = first.context['page']
+        self.assertEqual([i.invoice_number for i in page], ['INV-003', 'INV-002'])
+        second = await self.async_client.get(url, {'cursor': page.next_cursor})
+        self.assertEqual([i.invoice_number for i in second.context['page']], ['INV-001'])
+        response = await self.async_client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+    
+    async def test_detail_under_asgi(self):
+        """Test the detail template renders without querying from the event loop"""
+        response = await self.async_client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Test Item', response.content)
+        response = await self.async_client.get(reverse('invoice_detail', args=[9999]))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_detail_loads_everything_up_front(self):
+        """Test the detail view fetches invoice, parties and items in two queries"""
+        with self.assertNumQueries(2):
+            self.client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+    
+    async def test_pdf_rendered_in_pool_then_cached(self):
+        """Test the PDF is rendered off the event loop once, then read from disk"""
+        url = reverse('invoice_pdf', args=[self.invoice.pk])
+        with mock.patch('invoices.pdf.ahtml_to_pdf', wraps=pdf.ahtml_to_pdf) as render:
+            first = await self.async_client.get(url)
+            second = await self.async_client.get(url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertTrue(first.content.startswith(b'%PDF'))
+        self.assertEqual(first.content, second.content)
+        self.assertIn('invoices_pdf_render_duration_seconds_count{outcome="ok"} 1', metrics.exposition())
+        response = await self.async_client.get(url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+    
+    async def test_middleware_counts_async_queries(self):
+        """Test the metrics middleware sees the queries of async views"""
+        await self.async_client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        series = metrics.registry.values[('invoices_http_db_queries', (('view', 'invoice_detail'),))]
+        self.assertEqual(series[-1], 1)
+        self.assertEqual(series[-2], 2)
+    
+    async def test_async_page_matches_page(self):
+        """Test apage() returns the same rows and cursors as page()"""
+        paginator = KeysetPaginator(Invoice.objects.all(), ('-date_created', '-id'), 2)
+        expected = await sync_to_async(paginator.page)()
+        page = await paginator.apage()
+        self.assertEqual(list(page), list(expected))
+        self.assertEqual(page.next_cursor, expected.next_cursor)
+        back = await paginator.apage((await paginator.apage(page.next_cursor)).prev_cursor)
+        self.assertEqual(list(back), list(expected))
+
+
+class ConcurrencyBenchmarkTest(TransactionTestCase):
+    """Test cases for the WSGI/ASGI concurrency benchmark"""
+    
+    def test_both_servers_serve_every_case(self):
+        """Test each case completes without errors behind both handlers"""
+        call_command(
+            'generate_data', companies=1, customers=3, invoices=6, items='1',
+            stdout=StringIO()
+        )
+        results = benchmark.run_concurrency(requests=6, concurrency=3)
+        self.assertEqual(set(results['servers']), {'wsgi', 'asgi'})
+        for server, views in results['servers'].items():
+            self.assertEqual(set(views), {'invoice_list', 'invoice_detail', 'invoice_pdf:uncached'})
+            for name, result in views.items():
+                with self.subTest(server=server, view=name):
+                    self.assertEqual(result['errors'], 0)
+                    self.assertGreater(result['requests_per_second'], 0)
+
+
+@override_settings(INVOICES_READ_REPLICA='replica')
+class ReplicaRoutingTest(TestCase):
+    """Test cases for sending read-only views to the read replica"""
+    databases = {'default', 'replica'}
+    
+    def setUp(self):
+        # Different rows on each side show which database a view read
+        for alias, number in (('default', 'INV-PRIMARY'), ('replica', 'INV-REPLICA')):
+            company = Company.objects.using(alias).create(
+                name="Test Company", address="123 Test St", phone="555-1234",
+                email="test@company.com"
+            )
+            customer = Customer.objects.using(alias).create(
+                name="John Doe", email="john@example.com", phone="555-5678",
+                address="456 Customer Ave"
+            )
+            Invoice.objects.using(alias).create(
+                invoice_number=number, company=company, customer=customer,
+                date_due=date.today() + timedelta(days=30)
+            )
+        self.company = Company.objects.get()
+        self.customer = Customer.objects.get()
+    
+    def numbers(self, response):
+        return [invoice.invoice_number for invoice in response.context['invoices']]
+    
+    def test_router(self):
+        """Test reads follow the context variable and writes stay on the primary"""
+        router = replicas.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Invoice))
+        with replicas.reading_from('replica'):
+            self.assertEqual(router.db_for_read(Invoice), 'replica')
+            self.assertEqual(Invoice.objects.get().invoice_number, 'INV-REPLICA')
+            self.assertEqual(router.db_for_write(Invoice), 'default')
+        self.assertEqual(Invoice.objects.get().invoice_number, 'INV-PRIMARY')
+        replica_invoice = Invoice.objects.using('replica').get()
+        self.assertEqual(router.db_for_write(Invoice, instance=replica_invoice), 'default')
+        self.assertTrue(router.allow_relation(replica_invoice, self.company))
+    
+    def test_read_only_views_use_replica(self):
+        """Test the list, detail and exports read from the replica"""
+        self.assertEqual(self.numbers(self.client.get(reverse('invoice_list'))), ['INV-REPLICA'])
+        replica_pk = Invoice.objects.using('replica').get().pk
+        response = self.client.get(reverse('invoice_detail', args=[replica_pk]))
+        self.assertEqual(response.context['invoice'].invoice_number, 'INV-REPLICA')
+        response = self.client.get(reverse('invoice_export', args=['invoices', 'csv']))
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('INV-REPLICA', body)
+        self.assertNotIn('INV-PRIMARY', body)
+    
+    async def test_async_streamed_exports_use_replica(self):
+        """Test the async body of an ASGI export still reads from the replica"""
+        response = await self.async_client.get(reverse('invoice_export', args=['invoices', 'csv']))
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('INV-REPLICA', body)
+        self.assertNotIn('INV-PRIMARY', body)
+    
+    def test_reads_stay_on_primary_after_a_write(self):
+        """Test a successful POST pins the client to the primary"""
+        response = self.client.post(reverse('invoice_create'), {
+            'invoice_number': 'INV-NEW',
+            'company': self.company.pk,
+            'customer': self.customer.pk,
+            'date_due': date.today() + timedelta(days=30),
+            'discount_amount': '0.00',
+            'shipping_amount': '0.00',
+            'status': 'draft',
+            'items-TOTAL_FORMS': '0',
+            'items-INITIAL_FORMS': '0',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[replicas.STICKY_COOKIE]['max-age'], 10)
+        self.assertFalse(Invoice.objects.using('replica').filter(invoice_number='INV-NEW').exists())
+        
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.context['invoice'].invoice_number, 'INV-NEW')
+        self.assertEqual(
+            self.numbers(self.client.get(reverse('invoice_list'))), ['INV-NEW', 'INV-PRIMARY']
+        )
+    
+    def test_reads_and_failed_writes_do_not_pin(self):
+        """Test GETs and rejected POSTs leave the client on the replica"""
+        response = self.client.get(reverse('invoice_list'))
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+        response = self.client.post(reverse('invoice_pdf_async', args=[9999]))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+    
+    @override_settings(INVOICES_READ_REPLICA=None)
+    def test_without_replica(self):
+        """Test everything reads from the primary when no replica is configured"""
+        self.assertEqual(self.numbers(self.client.get(reverse('invoice_list'))), ['INV-PRIMARY'])
+
+
+class FragmentCacheTest(TestCase):
+    """Test cases for the versioned list row and detail fragments"""
+    
+    def setUp(self):
+        fragments.cache().clear()
+        metrics.registry.values.clear()
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.invoice = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Test Item",
+            quantity=2,
+            unit_price=Decimal('50.00')
+        )
+        self.detail_url = reverse('invoice_detail', args=[self.invoice.pk])
+    
+    def lookups(self, fragment, outcome):
+        key = ('invoices_fragment_cache_requests_total', (('fragment', fragment), ('outcome', outcome)))
+        return metrics.registry.values.get(key, 0)
+    
+    def test_rows_served_from_cache(self):
+        """Test the second list request reuses the cached row"""
+        first = self.client.get(reverse('invoice_list'))
+        second = self.client.get(reverse('invoice_list'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.lookups('row', 'miss'), 1)
+        self.assertEqual(self.lookups('row', 'hit'), 1)
+        self.assertIn('invoices_fragment_cache_requests_total{fragment="row",outcome="hit"} 1',
+                      metrics.exposition())
+    
+    def test_detail_hit_skips_items_query(self):
+        """Test a cached detail block needs neither rendering nor the items"""
+        with self.assertNumQueries(2):
+            self.client.get(self.detail_url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url)
+        self.assertIn(b'Test Item', response.content)
+        self.assertEqual(self.lookups('detail', 'hit'), 1)
+    
+    def test_changes_bump_the_version(self):
+        """Test item, customer and company edits all show up straight away"""
+        self.client.get(self.detail_url)
+        self.item.description = "Changed Item"
+        self.item.save()
+        self.assertIn(b'Changed Item', self.client.get(self.detail_url).content)
+        self.customer.name = "Jane Roe"
+        self.customer.save()
+        self.assertIn(b'Jane Roe', self.client.get(self.detail_url).content)
+        self.assertIn(b'Jane Roe', self.client.get(reverse('invoice_list')).content)
+        self.company.name = "Renamed Company"
+        self.company.save()
+        self.assertIn(b'Renamed Company', self.client.get(self.detail_url).content)
+        self.assertEqual(self.lookups('detail', 'hit'), 0)
+    
+    def test_bulk_writes_setting_updated_at(self):
+        """Test UPDATEs that bypass the signals show once they move updated_at"""
+        self.client.get(reverse('invoice_list'))
+        Invoice.objects.filter(pk=self.invoice.pk).update(
+            invoice_number='INV-BULK', updated_at=timezone.now()
+        )
+        self.assertIn(b'INV-BULK', self.client.get(reverse('invoice_list')).content)
+    
+    def test_row_loaded_before_a_save_is_not_cached_as_new(self):
+        """Test markup rendered from a row read before a save never outlives it"""
+        stale = Invoice.objects.with_totals().get(pk=self.invoice.pk)
+        Invoice.objects.get(pk=self.invoice.pk).save()
+        async_to_sync(fragments.aprime)(None, 'row', [stale])
+        fragments.render(None, 'row', stale, lambda: 'stale markup')
+        async_to_sync(fragments.astore)([stale], 'row')
+        
+        fresh = Invoice.objects.with_totals().get(pk=self.invoice.pk)
+        html = fragments.render(None, 'row', fresh, lambda: 'fresh markup')
+        self.assertEqual(html, 'fresh markup')
+    
+    def test_tag_without_priming(self):
+        """Test the tag looks fragments up itself when the view didn't prime them"""
+        template = Template(
+            '{% load invoice_fragments %}'
+            '{% invoice_fragment "badge" invoice %}{{ invoice.invoice_number }}{% endinvoice_fragment %}'
+        )
+        self.assertEqual(template.render(Context({'invoice': self.invoice})), 'INV-001')
+        self.assertEqual(template.render(Context({'invoice': self.invoice})), 'INV-001')
+        self.assertEqual(self.lookups('badge', 'miss'), 1)
+        self.assertEqual(self.lookups('badge', 'hit'), 1)
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load invoice_fragments %}{% invoice_fragment "x" %}{% endinvoice_fragment %}')
+
+
+class ConditionalGetTest(TestCase):
+    """Test cases for ETag / Last-Modified on the HTML invoice views"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.invoice = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30),
+            status='sent'
+        )
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description="Test Item",
+            quantity=2,
+            unit_price=Decimal('50.00')
+        )
+        self.detail_url = reverse('invoice_detail', args=[self.invoice.pk])
+        self.list_url = reverse('invoice_list')
+    
+    def revalidate(self, url, etag, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+    
+    def test_item_edit_moves_updated_at(self):
+        """Test updated_at follows item changes through the stored totals"""
+        before = self.invoice.updated_at
+        self.item.quantity = 3
+        self.item.save()
+        self.invoice.refresh_from_db()
+        self.assertGreater(self.invoice.updated_at, before)
+    
+    def test_detail_not_modified(self):
+        """Test a matching ETag gets a 304 from one query, without rendering"""
+        # The first visit sets the CSRF cookie, which the ETag covers
+        self.client.get(self.detail_url)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1), mock.patch('invoices.views.render') as render:
+            not_modified = self.revalidate(self.detail_url, response['ETag'])
+        render.assert_not_called()
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        
+        since = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+        self.assertEqual(self.revalidate(reverse('invoice_detail', args=[9999]), '"x"').status_code, 404)
+    
+    def test_detail_changes(self):
+        """Test item, customer and company edits all change the ETag"""
+        self.client.get(self.detail_url)
+        etag = self.client.get(self.detail_url)['ETag']
+        self.item.quantity = 3
+        self.item.save()
+        response = self.revalidate(self.detail_url, etag)
+        self.assertEqual(response.status_code, 200)
+        for party in (self.customer, self.company):
+            etag = response['ETag']
+            party.name = "Renamed"
+            party.save()
+            response = self.revalidate(self.detail_url, etag)
+            self.assertEqual(response.status_code, 200)
+    
+    def test_party_edit_leaves_invoices_alone(self):
+        """Test customer and company edits move their own version, not their invoices'"""
+        updated_at = self.invoice.updated_at
+        for party in (self.customer, self.company):
+            party.phone = "555-9999"
+            with CaptureQueriesContext(connection) as queries:
+                party.save()
+            self.assertFalse([q for q in queries if 'invoices_invoice' in q['sql']])
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.updated_at, updated_at)
+        invoice = Invoice.objects.with_totals().get(pk=self.invoice.pk)
+        self.assertEqual(invoice.versions[1:], (self.customer.updated_at, self.company.updated_at))
+    
+    def test_pending_messages_skip_304(self):
+        """Test the page after an edit is sent in full to show its message"""
+        self.client.get(self.detail_url)
+        etag = self.client.get(self.detail_url)['ETag']
+        self.assertEqual(self.revalidate(self.detail_url, etag).status_code, 304)
+        with mock.patch('invoices.conditional.messages.get_messages', return_value=['Saved']):
+            self.assertEqual(self.revalidate(self.detail_url, etag).status_code, 200)
+    
+    def test_list_not_modified(self):
+        """Test the list revalidates per filter from one query"""
+        response = self.client.get(self.list_url)
+        with self.assertNumQueries(1), mock.patch('invoices.views.render') as render:
+            not_modified = self.revalidate(self.list_url, response['ETag'])
+        render.assert_not_called()
+        self.assertEqual(not_modified.status_code, 304)
+        
+        filtered = self.client.get(self.list_url, {'status': 'sent'})
+        self.assertEqual(self.revalidate(self.list_url, filtered['ETag'], status='sent').status_code, 304)
+        self.assertEqual(self.revalidate(self.list_url, filtered['ETag'], status='paid').status_code, 200)
+        
+        Invoice.objects.create(
+            invoice_number="INV-002",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        self.assertEqual(self.revalidate(self.list_url, response['ETag']).status_code, 200)
+        self.assertEqual(self.revalidate(self.list_url, filtered['ETag'], status='sent').status_code, 304)
+    
+    def test_list_customer_rename(self):
+        """Test renaming a customer changes the ETag of the pages listing them"""
+        etag = self.client.get(self.list_url)['ETag']
+        self.customer.name = "Jane Roe"
+        self.customer.save()
+        response = self.revalidate(self.list_url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Jane Roe', response.content)
+
+
+class InvoiceApiTest(TestCase):
+    """Test cases for the JSON API"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.invoices = []
+        for number in range(5):
+            invoice = Invoice.objects.create(
+                invoice_number=f"INV-{number:03d}",
+                company=self.company,
+                customer=self.customer,
+                date_due=date.today() + timedelta(days=30),
+                status='sent' if number % 2 else 'draft'
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice, description="Widget", quantity=2, unit_price=Decimal('5.00')
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice, description="Gadget", quantity=1, unit_price=Decimal('2.50')
+            )
+            self.invoices.append(invoice)
+        self.url = reverse('api_invoices')
+    
+    def test_fetch_by_ids(self):
+        """Test ids= returns those invoices in request order, items from one query"""
+        first, second = self.invoices[3], self.invoices[1]
+        ids = f'{first.pk},9999,{second.pk}'
+        with self.assertNumQueries(2):
+            data = self.client.get(self.url, {'ids': ids}).json()
+        self.assertEqual([row['id'] for row in data['results']], [first.pk, second.pk])
+        self.assertEqual(data['missing'], [9999])
+        row = data['results'][0]
+        self.assertEqual(row['invoice_number'], 'INV-003')
+        self.assertEqual(row['total'], '12.50')
+        self.assertEqual(row['customer'], {
+            'id': self.customer.pk, 'name': 'John Doe', 'email': 'john@example.com',
+            'phone': '555-5678', 'address': '456 Customer Ave',
+        })
+        self.assertEqual(row['items'][0], {
+            'id': first.items.order_by('id')[0].pk, 'description': 'Widget',
+            'quantity': 2, 'unit_price': '5.00', 'total': '10.00',
+        })
+    
+    def test_sparse_fields(self):
+        """Test fields= limits both the keys and the columns queried"""
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {
+                'ids': self.invoices[0].pk, 'fields': 'invoice_number,total',
+            }).json()
+        self.assertEqual(data['results'], [
+            {'id': self.invoices[0].pk, 'invoice_number': 'INV-000', 'total': '12.50'},
+        ])
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertNotIn('notes', sql)
+        self.assertNotIn('invoices_customer', sql)
+    
+    def test_cursor_pagination(self):
+        """Test the list pages follow the list filters and ordering by cursor"""
+        with override_settings(INVOICES_API_PAGE_SIZE=2):
+            first = self.client.get(self.url, {'fields': 'invoice_number'}).json()
+            second = self.client.get(first['next']).json()
+            third = self.client.get(second['next']).json()
+            back = self.client.get(second['previous']).json()
+            sent = self.client.get(self.url, {'status': 'sent', 'fields': 'status'}).json()
+        numbers = [
+            row['invoice_number'] for page in (first, second, third) for row in page['results']
+        ]
+        self.assertEqual(numbers, ['INV-004', 'INV-003', 'INV-002', 'INV-001', 'INV-000'])
+        self.assertIsNone(first['previous'])
+        self.assertIsNone(third['next'])
+        self.assertEqual(back['results'], first['results'])
+        self.assertEqual([row['status'] for row in sent['results']], ['sent', 'sent'])
+    
+    def test_invalid_parameters(self):
+        """Test bad fields, ids and cursors get a 400 naming the parameter"""
+        for params, name in [
+            ({'fields': 'total,secret'}, 'fields'),
+            ({'ids': '1,x'}, 'ids'),
+            ({'ids': f'1,{2**63}'}, 'ids'),
+            ({'ids': '0'}, 'ids'),
+            ({'cursor': 'garbage'}, 'cursor'),
+        ]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(name, response.json()['errors'])
+        with override_settings(INVOICES_API_MAX_IDS=2):
+            response = self.client.get(self.url, {'ids': '1,2,3'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkStatusTest(TestCase):
+    """Test cases for bulk status transitions"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoices = [
+                Invoice.objects.create(
+                    invoice_number=f"INV-{number:03d}",
+                    company=self.company,
+                    customer=self.customer,
+                    date_due=date.today() + timedelta(days=30),
+                    status=status
+                )
+                for number, status in enumerate(['sent', 'sent', 'sent', 'draft', 'paid'])
+            ]
+            for invoice in self.invoices:
+                InvoiceItem.objects.create(
+                    invoice=invoice, description="Widget", quantity=1, unit_price=Decimal('10.00')
+                )
+    
+    def statuses(self):
+        return list(Invoice.objects.order_by('pk').values_list('status', flat=True))
+    
+    def test_allowed_transitions_only(self):
+        """Test only invoices allowed to reach the status move, in chunked UPDATEs"""
+        before = Invoice.objects.get(pk=self.invoices[0].pk).updated_at
+        with CaptureQueriesContext(connection) as queries:
+            moved, skipped = transitions.transition(Invoice.objects.all(), 'paid', batch_size=2)
+        self.assertEqual((moved, skipped), (3, 2))
+        self.assertEqual(self.statuses(), ['paid', 'paid', 'paid', 'draft', 'paid'])
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "invoices_invoice"')]
+        self.assertEqual(len(updates), 2)
+        self.assertGreater(Invoice.objects.get(pk=self.invoices[0].pk).updated_at, before)
+        with self.assertRaises(ValueError):
+            transitions.transition(Invoice.objects.all(), 'archived')
+    
+    def test_rollups_and_fragments_follow(self):
+        """Test the rollups and updated_at follow despite the bypassed signals"""
+        before = Invoice.objects.get(pk=self.invoices[0].pk).updated_at
+        transitions.transition(Invoice.objects.filter(status='sent'), 'paid')
+        rollup = RevenueRollup.objects.get(company=self.company, status='paid')
+        self.assertEqual(rollup.invoice_count, 4)
+        self.assertEqual(rollup.total, Decimal('40.00'))
+        self.assertFalse(RevenueRollup.objects.filter(status='sent').exists())
+        self.assertGreater(Invoice.objects.get(pk=self.invoices[0].pk).updated_at, before)
+    
+    def test_rollups_refresh_locked_buckets(self):
+        """Test only the buckets left and entered are refreshed, under the bucket locks"""
+        with mock.patch('invoices.rollups.refresh', wraps=rollups.refresh) as refresh, \
+                mock.patch('invoices.rollups.refresh_days') as refresh_days:
+            transitions.transition(Invoice.objects.all(), 'cancelled')
+        refresh_days.assert_not_called()
+        today = self.invoices[0].date_created
+        self.assertEqual(refresh.call_args.args[0], {
+            (today, self.company.pk, 'sent'),
+            (today, self.company.pk, 'draft'),
+            (today, self.company.pk, 'cancelled'),
+        })
+        self.assertEqual(RevenueRollup.objects.get(status='cancelled').invoice_count, 4)
+        self.assertEqual(RevenueRollup.objects.get(status='paid').invoice_count, 1)
+    
+    def test_view(self):
+        """Test the view moves invoices by id or by filter and validates the selection"""
+        url = reverse('invoice_bulk_status')
+        ids = f'{self.invoices[0].pk},{self.invoices[3].pk}'
+        response = self.client.post(url, {'to': 'cancelled', 'ids': ids})
+        self.assertEqual(response.json(), {'status': 'cancelled', 'moved': 2, 'skipped': 0})
+        response = self.client.post(url, {'to': 'paid', 'status': 'sent'})
+        self.assertEqual(response.json()['moved'], 2)
+        self.assertEqual(self.statuses(), ['cancelled', 'paid', 'paid', 'cancelled', 'paid'])
+        
+        for data in [
+            {'to': 'paid'}, {'to': 'archived', 'status': 'sent'}, {'to': 'paid', 'ids': 'x'},
+            {'to': 'paid', 'ids': f'1,{2**63}'}, {'to': 'paid', 'ids': '-1'},
+        ]:
+            self.assertEqual(self.client.post(url, data).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+    
+    def test_admin_action(self):
+        """Test the InvoiceAdmin actions report moved and skipped invoices"""
+        self.client.force_login(User.objects.create_superuser('admin', 'a@example.com', 'pw'))
+        response = self.client.post(reverse('admin:invoices_invoice_changelist'), {
+            'action': 'mark_paid',
+            '_selected_action': [self.invoices[0].pk, self.invoices[3].pk],
+        }, follow=True)
+        self.assertContains(response, "Marked 1 invoices as paid.")
+        self.assertContains(response, "Skipped 1 invoices that can")
+        self.assertEqual(self.statuses(), ['paid', 'sent', 'sent', 'draft', 'paid'])
+    
+    def test_command(self):
+        """Test transition_invoices selects by ids or filters"""
+        out = StringIO()
+        call_command('transition_invoices', 'sent', ids=str(self.invoices[3].pk), stdout=out)
+        self.assertIn("Moved 1 invoices to sent", out.getvalue())
+        call_command('transition_invoices', 'paid', status='sent', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.statuses(), ['paid'] * 5)
+        with self.assertRaises(CommandError):
+            call_command('transition_invoices', 'paid', stdout=StringIO())
+
+
+class BulkItemFormSetTest(TestCase):
+    """Test cases for the diff-based item formset save"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.invoice = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        self.items = [
+            InvoiceItem.objects.create(
+                invoice=self.invoice,
+                description=f"Item {number}",
+                quantity=1,
+                unit_price=Decimal('10.00')
+            )
+            for number in range(4)
+        ]
+        self.invoice.refresh_from_db()
+    
+    def formset_data(self, rows):
+        data = {
+            'items-TOTAL_FORMS': str(len(rows)),
+            'items-INITIAL_FORMS': str(len(self.items)),
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+        }
+        for index, row in enumerate(rows):
+            for name, value in row.items():
+                data[f'items-{index}-{name}'] = value
+        return data
+    
+    def existing(self, item, **changes):
+        return {
+            'id': item.pk, 'description': item.description,
+            'quantity': item.quantity, 'unit_price': item.unit_price, **changes,
+        }
+    
+    def test_only_changes_are_written(self):
+        """Test deletes, inserts and updates go out in bulk with one recalculation"""
+        formset = InvoiceItemFormSet(self.formset_data([
+            self.existing(self.items[0]),
+            self.existing(self.items[1], quantity=3),
+            self.existing(self.items[2], unit_price='20.00'),
+            self.existing(self.items[3], DELETE='on'),
+            {'description': 'New A', 'quantity': 2, 'unit_price': '5.00'},
+            {'description': 'New B', 'quantity': 1, 'unit_price': '1.00'},
+        ]), instance=self.invoice)
+        self.assertTrue(formset.is_valid())
+        before = self.invoice.updated_at
+        with CaptureQueriesContext(connection) as queries:
+            formset.save()
+        writes = [
+            q['sql'].split()[0] for q in queries
+            if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+            and 'invoices_invoiceitem' in q['sql'].split('WHERE')[0]
+        ]
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT', 'UPDATE'])
+        sums = [q for q in queries if 'SUM(' in q['sql'] and 'invoices_invoiceitem' in q['sql']]
+        self.assertEqual(len(sums), 1)
+        
+        self.invoice.refresh_from_db()
+        self.assertEqual(
+            sorted(self.invoice.items.values_list('description', 'quantity', 'unit_price')),
+            [('Item 0', 1, Decimal('10.00')), ('Item 1', 3, Decimal('10.00')),
+             ('Item 2', 1, Decimal('20.00')), ('New A', 2, Decimal('5.00')),
+             ('New B', 1, Decimal('1.00'))],
+        )
+        self.assertEqual(self.invoice.subtotal, Decimal('71.00'))
+        self.assertGreater(self.invoice.updated_at, before)
+    
+    def test_unchanged_formset_writes_nothing(self):
+        """Test resubmitting the stored items issues no writes"""
+        formset = InvoiceItemFormSet(
+            self.formset_data([self.existing(item) for item in self.items]), instance=self.invoice
+        )
+        self.assertTrue(formset.is_valid())
+        with self.assertNumQueries(0):
+            formset.save()
+    
+    def test_create_view_saves_items_once(self):
+        """Test invoice_create totals new items with a single recalculation"""
+        self.items = []
+        data = self.formset_data([
+            {'description': 'A', 'quantity': 1, 'unit_price': '4.00'},
+            {'description': 'B', 'quantity': 2, 'unit_price': '3.00'},
+        ])
+        data.update({
+            'invoice_number': 'INV-002', 'company': self.company.id,
+            'customer': self.customer.id, 'date_due': date.today() + timedelta(days=30),
+            'discount_amount': '0.00', 'shipping_amount': '0.00', 'status': 'draft', 'notes': '',
+        })
+        with mock.patch.object(Invoice, 'recalculate_totals', autospec=True,
+                               side_effect=Invoice.recalculate_totals) as recalculate:
+            self.client.post(reverse('invoice_create'), data)
+        recalculate.assert_called_once()
+        self.assertEqual(Invoice.objects.get(invoice_number='INV-002').total, Decimal('10.00'))
+    
+    def test_extra_setting(self):
+        """Test INVOICES_ITEM_FORMSET_EXTRA sets the number of blank rows"""
+        with override_settings(INVOICES_ITEM_FORMSET_EXTRA=10):
+            self.assertEqual(len(InvoiceItemFormSet(instance=self.invoice).forms), 14)
+        self.assertEqual(len(InvoiceItemFormSet().forms), 3)
+
+
+class InvoiceNumberingTest(TestCase):
+    """Test cases for the block-reserving invoice number allocator"""
+    
+    def setUp(self):
+        numbering.discard()
+        self.addCleanup(numbering.discard)
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+        self.day = date(2026, 3, 1)
+    
+    def test_format_and_scopes(self):
+        """Test numbers count up per year, or per company with the format saying so"""
+        self.assertEqual(numbering.allocate(day=self.day), 'INV-2026-000001')
+        self.assertEqual(numbering.allocate(day=self.day), 'INV-2026-000002')
+        self.assertEqual(numbering.allocate(day=date(2027, 1, 1)), 'INV-2027-000001')
+        with override_settings(INVOICES_NUMBER_FORMAT='{company}/{year}/{seq}'):
+            self.assertEqual(numbering.allocate(self.company.pk, self.day), f'{self.company.pk}/2026/1')
+            self.assertEqual(numbering.allocate(9999, self.day), '9999/2026/1')
+            self.assertEqual(numbering.allocate(self.company.pk, self.day), f'{self.company.pk}/2026/2')
+    
+    @override_settings(INVOICES_NUMBER_BLOCK_SIZE=5)
+    def test_blocks(self):
+        """Test the sequence row is touched once per block, not per number"""
+        with CaptureQueriesContext(connection) as queries:
+            numbers = [numbering.allocate(day=self.day) for _ in range(7)]
+        self.assertEqual(numbers, [f'INV-2026-{seq:06d}' for seq in range(1, 8)])
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "invoices_invoicenumbersequence"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(InvoiceNumberSequence.objects.get(scope='INV-2026-{seq}').next_value, 11)
+    
+    @override_settings(INVOICES_NUMBER_BLOCK_SIZE=3)
+    def test_processes_get_disjoint_blocks(self):
+        """Test allocators of different processes never hand out the same number"""
+        first, second = numbering.Allocator(), numbering.Allocator()
+        numbers = []
+        for _ in range(5):
+            numbers += [first.allocate(day=self.day), second.allocate(day=self.day)]
+        self.assertEqual(len(set(numbers)), 10)
+    
+    @override_settings(INVOICES_NUMBER_BLOCK_SIZE=3)
+    def test_skips_numbers_typed_by_hand(self):
+        """Test a block leaves out numbers already on an invoice"""
+        Invoice.objects.create(
+            invoice_number='INV-2026-000002', company=self.company, customer=self.customer,
+            date_due=self.day,
+        )
+        numbers = [numbering.allocate(day=self.day) for _ in range(3)]
+        self.assertEqual(numbers, ['INV-2026-000001', 'INV-2026-000003', 'INV-2026-000004'])
+    
+    def test_create_view_assigns_blank_number(self):
+        """Test invoice_create numbers an invoice submitted without one"""
+        data = {
+            'invoice_number': '', 'company': self.company.id, 'customer': self.customer.id,
+            'date_due': self.day, 'discount_amount': '0.00', 'shipping_amount': '0.00',
+            'status': 'draft', 'notes': '',
+            'items-TOTAL_FORMS': '0', 'items-INITIAL_FORMS': '0',
+            'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+        }
+        self.client.post(reverse('invoice_create'), data)
+        self.client.post(reverse('invoice_create'), data)
+        year = date.today().year
+        self.assertEqual(
+            sorted(Invoice.objects.values_list('invoice_number', flat=True)),
+            [f'INV-{year}-000001', f'INV-{year}-000002'],
+        )
+    
+    def test_importer_numbers_records_without_one(self):
+        """Test imported records without an invoice_number are given the next one"""
+        records = [
+            (1, {'company': 'Test Company', 'customer': 'Acme', 'date_due': '2026-04-01',
+                 'date_created': '2026-03-01'}),
+            (2, {'invoice_number': 'OWN-1', 'company': 'Test Company', 'customer': 'Acme',
+                 'date_due': '2026-04-01'}),
+        ]
+        InvoiceImporter().run(records)
+        self.assertEqual(
+            sorted(Invoice.objects.values_list('invoice_number', flat=True)),
+            ['INV-2026-000001', 'OWN-1'],
+        )
+    
+    def test_importer_numbers_csv_invoices_by_ref(self):
+        """Test consecutive numberless CSV invoices stay apart via invoice_ref"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'invoices.csv')
+        with open(path, 'w', newline='') as f:
+            f.write(
+                "invoice_ref,company,customer,date_created,date_due,description,quantity,unit_price\n"
+                "a,Test Company,Bob,2026-03-01,2026-04-01,Widget,1,5.00\n"
+                "a,Test Company,Bob,2026-03-01,2026-04-01,Gadget,1,5.00\n"
+                "b,Test Company,Carol,2026-03-01,2026-04-01,Widget,1,5.00\n"
+                ",Test Company,Dave,2026-03-01,2026-04-01,Widget,1,5.00\n"
+            )
+        out, err = StringIO(), StringIO()
+        call_command('import_invoices', path, stdout=out, stderr=err)
+        self.assertIn('skipped 1', out.getvalue())
+        self.assertIn('line 5: invoice_ref or invoice_number is required', err.getvalue())
+        self.assertEqual(
+            list(Invoice.objects.order_by('invoice_number').values_list(
+                'invoice_number', 'customer__name', 'total')),
+            [('INV-2026-000001', 'Bob', Decimal('10.00')),
+             ('INV-2026-000002', 'Carol', Decimal('5.00'))],
+        )
+
+
+class InvoiceNumberingConcurrencyTest(TransactionTestCase):
+    """Test cases for allocating invoice numbers from many threads at once"""
+    
+    def setUp(self):
+        numbering.discard()
+        self.addCleanup(numbering.discard)
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        self.customer = Customer.objects.create(
+            name="John Doe",
+            email="john@example.com",
+            phone="555-5678",
+            address="456 Customer Ave"
+        )
+    
+    def allocate(self, allocator, count):
+        try:
+            return [allocator.allocate(self.company.pk) for _ in range(count)]
+        finally:
+            connections.close_all()
+    
+    def allocate_concurrently(self, allocators, count=25):
+        with ThreadPoolExecutor(max_workers=len(allocators)) as pool:
+            futures = [pool.submit(self.allocate, allocator, count) for allocator in allocators]
+            numbers = [number for future in futures for number in future.result()]
+        # Stored as one batch: the unique constraint agrees
+        Invoice.objects.bulk_create([
+            Invoice(invoice_number=number, company=self.company, customer=self.customer,
+                    date_due=date.today())
+            for number in numbers
+        ])
+        return numbers
+    
+    @override_settings(INVOICES_NUMBER_BLOCK_SIZE=7)
+    def test_threads_sharing_an_allocator(self):
+        """Test the threads of one process never get the same number"""
+        numbers = self.allocate_concurrently([numbering.Allocator()] * 8)
+        self.assertEqual(len(set(numbers)), 200)
+        # One process leaves no gaps
+        seqs = sorted(int(number.rsplit('-', 1)[1]) for number in numbers)
+        self.assertEqual(seqs, list(range(1, 201)))
+    
+    @skipUnless(connection.vendor == 'postgresql', "SQLite serializes writers with errors, not waits")
+    @override_settings(INVOICES_NUMBER_BLOCK_SIZE=7)
+    def test_processes_reserving_at_once(self):
+        """Test allocators reserving blocks concurrently get disjoint ones"""
+        numbers = self.allocate_concurrently([numbering.Allocator() for _ in range(8)])
+        self.assertEqual(len(set(numbers)), 200)
+
+
+class AutocompleteTest(TestCase):
+    """Test cases for the company/customer autocomplete"""
+    
+    def setUp(self):
+        self.company = Company.objects.create(
+            name="Test Company",
+            address="123 Test St",
+            phone="555-1234",
+            email="test@company.com"
+        )
+        for name in ["Acorn Ltd", "ACE Hardware", "acme corp", "Beta Inc", "Zeta Acme"]:
+            Customer.objects.create(
+                name=name, email="c@example.com", phone="555-0000", address="1 Main St"
+            )
+        self.customer = Customer.objects.get(name="Beta Inc")
+        self.url = reverse('autocomplete', args=['customers'])
+    
+    def test_prefix_search(self):
+        """Test names starting with q come back in name order, whatever their case"""
+        data = self.client.get(self.url, {'q': 'aC'}).json()
+        self.assertEqual(
+            [row['text'] for row in data['results']], ["ACE Hardware", "acme corp", "Acorn Ltd"]
+        )
+        self.assertFalse(data['more'])
+        with override_settings(INVOICES_AUTOCOMPLETE_LIMIT=2):
+            data = self.client.get(self.url, {'q': 'ac'}).json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertTrue(data['more'])
+        companies = self.client.get(reverse('autocomplete', args=['companies']), {'q': 'test'})
+        self.assertEqual(companies.json()['results'], [{'id': self.company.pk, 'text': "Test Company"}])
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['vendors'])).status_code, 404)
+    
+    def test_prefix_with_punctuation(self):
+        """Test prefixes ending in punctuation keep every match, and _ is literal"""
+        for name in ["a-b Corp", "A-Z Ltd", "a.c", "a_b"]:
+            Customer.objects.create(name=name, email="c@example.com", phone="555-0000", address="1 Main St")
+        names = lambda prefix: [c.name for c in autocomplete.name_prefix(Customer.objects.all(), prefix)]
+        self.assertEqual(names('a-'), ["a-b Corp", "A-Z Ltd"])
+        self.assertEqual(names('a_'), ["a_b"])
+    
+    def test_prefix_search_uses_index(self):
+        """Test the lookup reads the name index instead of scanning customers"""
+        matches = autocomplete.name_prefix(Customer.objects.all(), 'ac')[:20]
+        self.assertEqual(query_plans.plan_problems(matches), set())
+    
+    def test_widgets_render_only_the_selection(self):
+        """Test the form pages list the selected company/customer, not every row"""
+        response = self.client.get(reverse('invoice_create'))
+        self.assertNotContains(response, "Acorn Ltd")
+        self.assertContains(response, 'data-autocomplete-url="%s"' % self.url)
+        
+        invoice = Invoice.objects.create(
+            invoice_number="INV-001",
+            company=self.company,
+            customer=self.customer,
+            date_due=date.today() + timedelta(days=30)
+        )
+        response = self.client.get(reverse('invoice_update', args=[invoice.pk]))
+        self.assertContains(response, '<option value="%s" selected>Beta Inc</option>' % self.customer.pk)
+        self.assertNotContains(response, "Acorn Ltd")
+    
+    def test_validation_looks_up_one_row(self):
+        """Test the submitted ids are checked without loading the choice lists"""
+        data = {
+            'invoice_number': 'INV-002', 'company': self.company.pk, 'customer': self.customer.pk,
+            'date_due': date.today(), 'discount_amount': '0.00', 'shipping_amount': '0.00',
+            'status': 'draft',
+        }
+        form = InvoiceForm(data)
+        # Each id is fetched by the form field and checked again by the model's
+        # foreign key; the fifth query is the invoice_number uniqueness check
+        with self.assertNumQueries(5):
+            self.assertTrue(form.is_valid())
+        form = InvoiceForm({**data, 'customer': 9999})
+        self.assertIn('customer', form.errors)
+        self.assertNotIn("Acorn Ltd", str(form['customer']))
@@ -0,0 +1,64 @@
+"""Bulk invoice status changes, run as chunked set-based UPDATEs.
+
+Each chunk is one ``UPDATE ... WHERE id IN (...) AND status IN (...)`` in its
+own transaction, so a large run never holds its locks for long and an invoice
+whose status changed in the meantime is skipped rather than forced into a
+transition it no longer allows. The UPDATEs set updated_at, which retires
+the cached fragments and ETags of the moved invoices, and bypass the model
+signals, so the rollup buckets the invoices left and entered are refreshed
+once the run is done, under the same bucket locks as an edit takes.
+"""
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from . import rollups
+from .models import Invoice
+
+# Statuses an invoice may move to from each status
+ALLOWED_TRANSITIONS = {
+    'draft': {'sent', 'cancelled'},
+    'sent': {'paid', 'cancelled'},
+    # A payment that bounced puts the invoice back to sent
+    'paid': {'sent'},
+    'cancelled': {'draft'},
+}
+
+BATCH_SIZE = 5000
+
+
+def sources(status):
+    """The statuses an invoice may move to ``status`` from"""
+    return sorted(source for source, targets in ALLOWED_TRANSITIONS.items() if status in targets)
+
+
+def transition(invoices, status, batch_size=BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """Move every invoice of ``invoices`` allowed to go to ``status`` there.
+
+    Returns ``(moved, skipped)``; skipped invoices were already in ``status``
+    or in one it can't be reached from.
+    """
+    if status not in ALLOWED_TRANSITIONS:
+        raise ValueError(f"Unknown invoice status {status!r}")
+    allowed = sources(status)
+    selected = invoices.using(using).count()
+    rows = (
+        invoices.using(using).filter(status__in=allowed)
+        .order_by('pk').values_list('pk', 'date_created', 'company_id', 'status')
+    )
+    moved = 0
+    buckets = set()
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic(using=using):
+            moved += Invoice.objects.using(using).filter(
+                pk__in=[pk for pk, *_ in batch], status__in=allowed,
+            ).update(status=status, updated_at=timezone.now())
+        for _, day, company_id, source in batch:
+            buckets.update({(day, company_id, source), (day, company_id, status)})
+        last_pk = batch[-1][0]
+    if buckets:
+        rollups.refresh(buckets, using=using)
+    return moved, selected - moved
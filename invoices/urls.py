@@ -3,9 +3,21 @@ from .views import *
 
 urlpatterns = [
     path('', invoice_list, name='invoice_list'),
+    path('export/pdfs.zip', invoice_export_pdfs, name='invoice_export_pdfs'),
+    path('export/<slug:dataset>.<slug:fmt>', invoice_export, name='invoice_export'),
     path('invoice/<int:pk>/', invoice_detail, name='invoice_detail'),
     path('invoice/create/', invoice_create, name='invoice_create'),
     path('invoice/<int:pk>/update/', invoice_update, name='invoice_update'),
     path('invoice/<int:pk>/delete/', invoice_delete, name='invoice_delete'),
     path('invoice/<int:pk>/pdf/', invoice_pdf, name='invoice_pdf'),
+    path('invoice/<int:pk>/pdf/async/', invoice_pdf_async, name='invoice_pdf_async'),
+    path('invoice/bulk-status/', invoice_bulk_status, name='invoice_bulk_status'),
+    path('jobs/<int:pk>/', job_status, name='job_status'),
+    path('jobs/<int:pk>/result/', job_result, name='job_result'),
+    path('reports/revenue/', revenue_dashboard, name='revenue_dashboard'),
+    path('reports/revenue.json', revenue_report_json, name='revenue_report_json'),
+    path('reports/aging/', aging_report, name='aging_report'),
+    path('reports/aging.csv', aging_report_csv, name='aging_report_csv'),
+    path('api/invoices/', api_invoices, name='api_invoices'),
+    path('autocomplete/<slug:kind>/', autocomplete_names, name='autocomplete'),
 ]
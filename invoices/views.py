@@ -1,42 +1,136 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, aget_object_or_404, get_object_or_404
+from django.conf import settings
 from django.contrib import messages
-from django.db.models import Q
-from django.http import HttpResponse
-from django.template.loader import get_template
-from xhtml2pdf import pisa
-from io import BytesIO
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import aprefetch_related_objects
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_POST
 
 from .models import *
 from .forms import *
+from . import (
+    aging, api, autocomplete, conditional, fragments, jobs, numbering, pdf_cache, rollups,
+    transitions,
+)
+from .exports import (
+    INVOICE_COLUMNS, ITEM_COLUMNS, invoice_rows, item_rows, iter_invoice_pdfs,
+    stream_csv, stream_jsonl, stream_zip, streaming_response,
+)
+from .metrics import exposition
+from .pagination import InvalidCursor, KeysetPaginator
+from .replicas import replica_reads
+from .pdf import render_pdf
+from .search import filter_invoices
 
 # Create your views here.
 
 
-def invoice_list(request):
-    invoices = Invoice.objects.all().order_by('-date_created')
+@replica_reads
+async def invoice_list(request):
     search = request.GET.get('search', '')
     status = request.GET.get('status', '')
+    invoices, ordering = filter_invoices(Invoice.objects.with_totals(), search, status)
     
-    if search:
-        invoices = invoices.filter(
-            Q(invoice_number__icontains=search) |
-            Q(customer__name__icontains=search)
-        )
-    
-    if status:
-        invoices = invoices.filter(status=status)
+    paginator = KeysetPaginator(
+        invoices,
+        ordering=ordering,
+        per_page=getattr(settings, 'INVOICES_PAGE_SIZE', 50),
+    )
+    template_name = 'invoices/invoice_list.html'
+    cursor = request.GET.get('cursor')
+    try:
+        if conditional.is_conditional(request):
+            # Revalidate against the ids and versions of the page's rows
+            rows = await paginator.apage(cursor, fields=VERSION_FIELDS)
+            etag = conditional.etag(request, template_name, _page_versions(rows))
+            if (response := conditional.not_modified(request, etag)) is not None:
+                return response
+        page = await paginator.apage(cursor)
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
     
+    await fragments.aprime(template_name, 'row', page.object_list)
     context = {
-        'invoices': invoices,
+        'invoices': page.object_list,
+        'page': page,
         'search': search,
         'status': status,
     }
-    return render(request, 'invoices/invoice_list.html', context)
+    response = render(request, template_name, context)
+    await fragments.astore(page.object_list, 'row')
+    etag = conditional.etag(request, template_name, _page_versions(page))
+    return conditional.set_validators(response, etag)
 
-def invoice_detail(request, pk):
-    invoice = get_object_or_404(Invoice, pk=pk)
+def _page_versions(page):
+    """What a list page shows, as far as its ETag is concerned"""
+    return [(invoice.pk, *invoice.versions) for invoice in page] + [
+        page.has_previous(), page.has_next(),
+    ]
+
+@replica_reads
+def invoice_export_pdfs(request):
+    """Stream the PDFs of every invoice matching the list filters as one ZIP"""
+    invoices, ordering = filter_invoices(
+        Invoice.objects.with_totals(),
+        request.GET.get('search', ''),
+        request.GET.get('status', ''),
+    )
+    entries = iter_invoice_pdfs(invoices.order_by(*ordering))
+    response = streaming_response(request, stream_zip(entries), 'application/zip')
+    response['Content-Disposition'] = 'attachment; filename=invoices.zip'
+    return response
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson'),
+}
+
+@replica_reads
+def invoice_export(request, dataset, fmt):
+    """Stream invoices or their line items matching the list filters as CSV/JSONL"""
+    if dataset not in ('invoices', 'items') or fmt not in EXPORT_FORMATS:
+        raise Http404("Unknown export")
+    invoices, ordering = filter_invoices(
+        Invoice.objects.all(),
+        request.GET.get('search', ''),
+        request.GET.get('status', ''),
+    )
+    if dataset == 'invoices':
+        columns, rows = INVOICE_COLUMNS, invoice_rows(invoices.order_by(*ordering))
+    else:
+        columns, rows = ITEM_COLUMNS, item_rows(invoices)
+    stream, content_type = EXPORT_FORMATS[fmt]
+    response = streaming_response(request, stream(columns, rows), content_type)
+    response['Content-Disposition'] = f'attachment; filename={dataset}.{fmt}'
+    return response
+
+@replica_reads
+async def invoice_detail(request, pk):
+    template_name = 'invoices/invoice_detail.html'
+    if conditional.is_conditional(request):
+        # Revalidate from the primary key indexes before loading anything
+        versions = await Invoice.objects.filter(pk=pk).values_list(*VERSION_FIELDS).afirst()
+        if versions is None:
+            raise Http404("No Invoice matches the given query.")
+        etag = conditional.etag(request, template_name, [pk, *versions])
+        if (response := conditional.not_modified(request, etag, max(versions))) is not None:
+            return response
+    
+    # Everything the template shows is loaded here; rendering can't query
+    invoice = await aget_object_or_404(Invoice.objects.with_totals(), pk=pk)
+    await fragments.aprime(template_name, 'detail', [invoice])
+    if fragments.missing(invoice, 'detail'):
+        # Only a fresh render of the detail fragment shows the items
+        await aprefetch_related_objects([invoice], 'items')
     context = {'invoice': invoice}
-    return render(request, 'invoices/invoice_detail.html', context)
+    response = render(request, template_name, context)
+    await fragments.astore([invoice], 'detail')
+    etag = conditional.etag(request, template_name, [invoice.pk, *invoice.versions])
+    return conditional.set_validators(response, etag, max(invoice.versions))
 
 def invoice_create(request):
     if request.method == 'POST':
@@ -44,9 +138,13 @@ def invoice_create(request):
         formset = InvoiceItemFormSet(request.POST)
         
         if form.is_valid() and formset.is_valid():
-            invoice = form.save()
-            formset.instance = invoice
-            formset.save()
+            if not form.instance.invoice_number:
+                # Before the transaction, which a new block of numbers can't join
+                form.instance.invoice_number = numbering.allocate(form.instance.company_id)
+            with transaction.atomic():
+                invoice = form.save()
+                formset.instance = invoice
+                formset.save()
             messages.success(request, 'Invoice created successfully!')
             return redirect('invoice_detail', pk=invoice.pk)
     else:
@@ -68,8 +166,9 @@ def invoice_update(request, pk):
         formset = InvoiceItemFormSet(request.POST, instance=invoice)
         
         if form.is_valid() and formset.is_valid():
-            form.save()
-            formset.save()
+            with transaction.atomic():
+                form.save()
+                formset.save()
             messages.success(request, 'Invoice updated successfully!')
             return redirect('invoice_detail', pk=invoice.pk)
     else:
@@ -97,30 +196,229 @@ def invoice_delete(request, pk):
 
 def render_to_pdf(template_src, context_dict={}):
     """Helper function to render HTML to PDF"""
-    template = get_template(template_src)
-    html = template.render(context_dict)
-    result = BytesIO()
-    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result)
-    if not pdf.err:
-        return HttpResponse(result.getvalue(), content_type='application/pdf')
+    pdf = render_pdf(template_src, context_dict)
+    if pdf is not None:
+        return HttpResponse(pdf, content_type='application/pdf')
     return None
 
-def invoice_pdf(request, pk):
+@replica_reads
+async def invoice_pdf(request, pk):
     """Generate PDF for a specific invoice"""
-    invoice = get_object_or_404(Invoice, pk=pk)
-    context = {'invoice': invoice}
-    
-    # Create PDF
-    pdf = render_to_pdf('invoices/invoice_pdf.html', context)
+    invoice = await aget_object_or_404(
+        Invoice.objects.with_totals().prefetch_related('items'), pk=pk
+    )
+    digest = pdf_cache.invoice_digest(invoice)
+    etag = f'"{digest}"'
     
-    if pdf:
-        response = HttpResponse(pdf, content_type='application/pdf')
-        filename = f"Invoice_{invoice.invoice_number}.pdf"
-        content = f"inline; filename={filename}"
-        download = request.GET.get("download")
-        if download:
-            content = f"attachment; filename={filename}"
-        response['Content-Disposition'] = content
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
         return response
     
-    return HttpResponse("Error generating PDF", status=400)
+    # Create PDF (or reuse the cached one) without blocking the event loop
+    pdf = await pdf_cache.aread_or_render(invoice, digest)
+    if pdf is None:
+        return HttpResponse("Error generating PDF", status=400)
+    
+    response = HttpResponse(pdf, content_type='application/pdf')
+    filename = f"Invoice_{invoice.invoice_number}.pdf"
+    content = f"inline; filename={filename}"
+    download = request.GET.get("download")
+    if download:
+        content = f"attachment; filename={filename}"
+    response['Content-Disposition'] = content
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@require_POST
+def invoice_bulk_status(request):
+    """Move the selected invoices to another status in a few set-based UPDATEs"""
+    form = BulkStatusForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    moved, skipped = transitions.transition(form.invoices(), form.cleaned_data['to'])
+    return JsonResponse({'status': form.cleaned_data['to'], 'moved': moved, 'skipped': skipped})
+
+@require_POST
+def invoice_pdf_async(request, pk):
+    """Queue PDF rendering for an invoice and point the client at the job"""
+    invoice = get_object_or_404(Invoice, pk=pk)
+    job = jobs.enqueue('render_invoice_pdf', {'invoice_id': invoice.pk})
+    return JsonResponse(_job_data(job), status=202)
+
+def job_status(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    return JsonResponse(_job_data(job))
+
+def job_result(request, pk):
+    """Send the client to the output of a finished job"""
+    job = get_object_or_404(Job, pk=pk)
+    if job.status != 'done':
+        return JsonResponse(_job_data(job), status=409)
+    if job.kind == 'render_invoice_pdf':
+        # The worker left the PDF in the cache, so this is served without rendering
+        url = reverse('invoice_pdf', kwargs={'pk': job.result['invoice_id']})
+        return redirect(f"{url}?download=1")
+    return JsonResponse(job.result, safe=False)
+
+def _job_data(job):
+    data = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'status_url': reverse('job_status', kwargs={'pk': job.pk}),
+    }
+    if job.status == 'done':
+        data['result_url'] = reverse('job_result', kwargs={'pk': job.pk})
+    if job.status == 'failed':
+        data['error'] = job.error.strip().splitlines()[-1]
+    return data
+
+def metrics(request):
+    """Prometheus metrics for every worker sharing INVOICES_METRICS_DIR"""
+    return HttpResponse(
+        exposition(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+def _revenue_report(request):
+    """Validate the report filters; returns ``(form, rows, totals)``"""
+    form = RevenueReportForm(request.GET)
+    if not form.is_valid():
+        return form, None, None
+    data = form.cleaned_data
+    rows, totals = rollups.report(
+        group=data['group'] or 'month',
+        start=data['start'],
+        end=data['end'],
+        status=data['status'],
+        company=data['company'].pk if data['company'] else None,
+    )
+    return form, rows, totals
+
+@replica_reads
+def revenue_dashboard(request):
+    """Revenue by month, day, status or company, read from the rollup tables"""
+    form, rows, totals = _revenue_report(request)
+    context = {'form': form, 'rows': rows, 'totals': totals}
+    status = 400 if rows is None else 200
+    return render(request, 'invoices/revenue_dashboard.html', context, status=status)
+
+@replica_reads
+def revenue_report_json(request):
+    """JSON version of revenue_dashboard"""
+    form, rows, totals = _revenue_report(request)
+    if rows is None:
+        return JsonResponse({'errors': form.errors}, status=400)
+    return JsonResponse({
+        'group': form.cleaned_data['group'] or 'month',
+        'rows': rows,
+        'totals': totals,
+    })
+
+@replica_reads
+def aging_report(request):
+    """Open (sent) invoice balances per customer, bucketed by days past due"""
+    form = AgingReportForm(request.GET)
+    if not form.is_valid():
+        return render(request, 'invoices/aging_report.html', {'form': form}, status=400)
+    as_of = form.cleaned_data['as_of'] or timezone.localdate()
+    paginator = Paginator(
+        aging.aging_by_customer(as_of), getattr(settings, 'INVOICES_PAGE_SIZE', 50)
+    )
+    page = paginator.get_page(request.GET.get('page'))
+    columns = [name for name, _, _, _ in aging.BUCKETS]
+    rows = [
+        {**row, 'amounts': [row[name] for name in columns]}
+        for row in aging.with_customer_names(page.object_list)
+    ]
+    totals = aging.aging_totals(as_of)
+    totals['amounts'] = [totals[name] for name in columns]
+    context = {
+        'form': form,
+        'as_of': as_of,
+        'buckets': aging.BUCKETS,
+        'page': page,
+        'rows': rows,
+        'totals': totals,
+    }
+    return render(request, 'invoices/aging_report.html', context)
+
+@replica_reads
+def aging_report_csv(request):
+    """CSV version of aging_report covering every customer"""
+    form = AgingReportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    as_of = form.cleaned_data['as_of'] or timezone.localdate()
+    rows = aging.csv_rows(as_of)
+    response = streaming_response(request, stream_csv(aging.AGING_COLUMNS, rows), 'text/csv')
+    response['Content-Disposition'] = f'attachment; filename=aging-{as_of.isoformat()}.csv'
+    return response
+
+@replica_reads
+async def api_invoices(request):
+    """Invoices as JSON: those named by ``ids``, or a cursor page of the list filters"""
+    try:
+        fields = api.parse_fields(request.GET.get('fields', ''))
+        ids = api.parse_ids(
+            request.GET.get('ids', ''), getattr(settings, 'INVOICES_API_MAX_IDS', 500)
+        )
+    except api.InvalidParameter as error:
+        return JsonResponse({'errors': {error.name: [str(error)]}}, status=400)
+    
+    if ids is not None:
+        invoices = api.select(Invoice.objects.filter(pk__in=ids), fields)
+        found = {invoice.pk: invoice async for invoice in invoices}
+        return JsonResponse({
+            'results': [api.serialize(found[pk], fields) for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found],
+        })
+    
+    invoices, ordering = filter_invoices(
+        Invoice.objects.all(),
+        request.GET.get('search', ''),
+        request.GET.get('status', ''),
+    )
+    paginator = KeysetPaginator(
+        api.select(invoices, fields, ordering),
+        ordering=ordering,
+        per_page=getattr(settings, 'INVOICES_API_PAGE_SIZE', 100),
+    )
+    try:
+        page = await paginator.apage(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'errors': {'cursor': ["Invalid page cursor."]}}, status=400)
+    return JsonResponse({
+        'results': [api.serialize(invoice, fields) for invoice in page],
+        'next': _cursor_url(request, page.next_cursor),
+        'previous': _cursor_url(request, page.prev_cursor),
+    })
+
+def _cursor_url(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f"{request.path}?{params.urlencode()}"
+
+AUTOCOMPLETE_MODELS = {
+    'companies': Company,
+    'customers': Customer,
+}
+
+@replica_reads
+async def autocomplete_names(request, kind):
+    """Companies or customers whose name starts with ``q``, for the invoice form selects"""
+    if kind not in AUTOCOMPLETE_MODELS:
+        raise Http404("Unknown autocomplete")
+    size = autocomplete.limit()
+    matches = autocomplete.name_prefix(
+        AUTOCOMPLETE_MODELS[kind].objects.all(), request.GET.get('q', '')
+    )
+    rows = [row async for row in matches.values_list('pk', 'name')[:size + 1]]
+    return JsonResponse({
+        'results': [{'id': pk, 'text': name} for pk, name in rows[:size]],
+        'more': len(rows) > size,
+    })